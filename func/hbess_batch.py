@@ -0,0 +1,172 @@
+import itertools
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from . import hbess_ems
+from . import hbess_engine
+from . import hbess_pipeline
+from . import hbess_tables
+
+# Batch runner: sizes every load profile x cell pair x EMS combination on a process pool,
+# and searches a cell catalog for the cheapest HE/HP pair.
+# The load profiles are placed in shared memory once; workers attach to them instead of receiving a pickled copy per task.
+# The same workers run the profile stages (sharing and integration) of the load profiles of one run_sizing_envelope.
+
+worker_profiles = {}    #name: load profile DataFrame (inside a worker)
+worker_cells = {}       #name: Cell (inside a worker)
+worker_memory = []      #attached shared memory blocks, kept alive while the worker runs
+
+
+def share_profiles(profiles):
+    # Copy each profile into a shared memory block holding the (2, n) array [t, P]
+    blocks, specs = [], {}
+    for name, load_profile in profiles.items():
+        data = np.stack([load_profile['t'].to_numpy(dtype=float), load_profile['P'].to_numpy(dtype=float)])
+        block = shared_memory.SharedMemory(create=True, size=data.nbytes)
+        np.ndarray(data.shape, dtype=data.dtype, buffer=block.buf)[:] = data
+        blocks.append(block)
+        specs[name] = (block.name, data.shape)
+    return blocks, specs
+
+
+def attach_profiles(specs, cells):
+    # Worker initializer: map the shared profiles (no copy) and keep the (small) cells; the parent unlinks the blocks
+    for name, (block_name, shape) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        data = np.ndarray(shape, dtype=float, buffer=block.buf)
+        worker_memory.append(block)
+        worker_profiles[name] = pd.DataFrame({'t': data[0], 'P': data[1]}, copy=False)
+    worker_cells.update(cells)
+
+
+def run_scenario(scenario, params):
+    load, HE, HP, method = scenario
+    row = {'load': load, 'HE': HE, 'HP': HP, 'EMS': method}
+    try:
+        result = hbess_engine.run_sizing(worker_profiles[load], worker_cells[HE], worker_cells[HP], method, **params)
+        row.update(hbess_engine.summarise(result))
+    except Exception as error:
+        row['error'] = str(error)
+    return row
+
+
+def run_profile(name, inputs):
+    # Worker: the profile stages of one shared load profile (inputs: those of hbess_pipeline.profile_stages, but the profile)
+    return hbess_pipeline.run_pipeline(hbess_pipeline.profile_stages, dict(inputs, load_profile=worker_profiles[name]))[0]
+
+
+def run_profiles(profiles, inputs, max_workers=None, progress=None):
+    # profiles: {name: DataFrame}; returns {name: values of the profile stages}, calculated in parallel
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    blocks, specs = share_profiles(profiles)
+    runs = {}
+    try:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(profiles)), initializer=attach_profiles, initargs=(specs, {})) as pool:
+            futures = {pool.submit(run_profile, name, inputs): name for name in profiles}
+            for i, future in enumerate(as_completed(futures)):
+                runs[futures[future]] = future.result()
+                if progress is not None:
+                    progress((i + 1) / len(profiles), f'{i + 1}/{len(profiles)} load profiles')
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return runs
+
+
+def run_batch(profiles, cells, methods, params, pairs=None, max_workers=None, progress=None):
+    # profiles: {name: DataFrame}, cells: {name: Cell}
+    # params: the remaining run_sizing arguments (SOC_0, V_ref, N_year, DoD, P_chrg, lifetime, factor)
+    # pairs: (HE, HP) cell names to compare, by default every ordered pair of different cells
+    if pairs is None:
+        pairs = [(HE, HP) for HE, HP in itertools.product(cells, cells) if HE != HP]
+    scenarios = [(load, HE, HP, method) for load in profiles for HE, HP in pairs for method in methods]
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    blocks, specs = share_profiles(profiles)
+    rows = []
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=attach_profiles, initargs=(specs, cells)) as pool:
+            futures = [pool.submit(run_scenario, scenario, params) for scenario in scenarios]
+            for i, future in enumerate(as_completed(futures)):
+                rows.append(future.result())
+                if progress is not None:
+                    progress((i + 1) / len(scenarios), f'{i + 1}/{len(scenarios)} scenarios')
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    # One comparison table, in scenario order
+    df_batch = pd.DataFrame(rows)
+    order = {scenario: i for i, scenario in enumerate(scenarios)}
+    df_batch['order'] = [order[tuple(row)] for row in df_batch[['load', 'HE', 'HP', 'EMS']].itertuples(index=False)]
+    return df_batch.sort_values('order').drop(columns='order').reset_index(drop=True)
+
+
+def pair_lower_bounds(load_profile, cells, pairs, DoD, fraction=1.0):
+    # Cheap lower bounds on the total cost (eur) of each (HE, HP) pair, valid for every EMS whose packs deliver fraction
+    # of the load power together (P_HE + P_HP = fraction x P, see hbess_ems.load_fraction):
+    # - energy: the required energies of both packs add up to at least fraction x the required energy of the profile
+    # - power: the nominal power of both packs (cells x V_nom x I_dis) must cover fraction x the peak of the profile
+    E_req = fraction * hbess_tables.get_required_energy(load_profile['P'].to_numpy(dtype=float), load_profile['t'].to_numpy(dtype=float)) #Wh
+    P_peak = fraction * max(load_profile['P'].max(), 0) #W
+    names = list(cells)
+    cost_energy = np.array([cells[name].cost / cells[name].energy for name in names])                        #eur/Wh
+    cost_power = np.array([cells[name].cost / (cells[name].voltage * cells[name].I_dis) for name in names])   #eur/W
+
+    index = {name: i for i, name in enumerate(names)}
+    HE = np.array([index[pair[0]] for pair in pairs], dtype=int)
+    HP = np.array([index[pair[1]] for pair in pairs], dtype=int)
+    LB_energy = E_req / (DoD / 100) * np.minimum(cost_energy[HE], cost_energy[HP])
+    LB_power = P_peak * np.minimum(cost_power[HE], cost_power[HP])
+    return np.maximum(LB_energy, LB_power)
+
+
+def power_feasible(row, cells):
+    # The nominal power of each pack must cover the peak power it is given
+    return (row['P_HE_peak'] * 1000 <= row['N_HE'] * cells[row['HE']].voltage * cells[row['HE']].I_dis + 1e-6 and
+            row['P_HP_peak'] * 1000 <= row['N_HP'] * cells[row['HP']].voltage * cells[row['HP']].I_dis + 1e-6)
+
+
+def search_pairs(load_profile, cells, method, params, max_workers=None, progress=None):
+    # Cheapest power-feasible (HE, HP) pair for one load profile and EMS. Pairs are evaluated in parallel, in order of
+    # their lower bound; pairs whose lower bound can't beat the best feasible cost found so far are pruned.
+    pairs = [(HE, HP) for HE, HP in itertools.product(cells, cells) if HE != HP]
+    LB = pair_lower_bounds(load_profile, cells, pairs, params['DoD'], hbess_ems.load_fraction(method))
+    order = np.argsort(LB, kind='stable')
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    wave = 4 * max_workers
+
+    blocks, specs = share_profiles({'load': load_profile})
+    rows, best, done = [], np.inf, 0
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=attach_profiles, initargs=(specs, cells)) as pool:
+            while done < len(order) and LB[order[done]] < best:
+                batch = [i for i in order[done:done + wave] if LB[i] < best]
+                futures = [pool.submit(run_scenario, ('load', *pairs[i], method), params) for i in batch]
+                for i, future in zip(batch, futures):
+                    row = future.result()
+                    row['LB'] = LB[i]
+                    row['feasible'] = 'error' not in row and power_feasible(row, cells)
+                    if row['feasible']:
+                        best = min(best, row['C_tot'])
+                    rows.append(row)
+                done += wave
+                if progress is not None:
+                    progress(min(done, len(order)) / len(order), f'{len(rows)} pairs evaluated, best: {best:,.0f} eur')
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    df_search = pd.DataFrame(rows)
+    if len(df_search):
+        df_search = df_search.drop(columns='load').sort_values(['feasible', 'C_tot'], ascending=[False, True]).reset_index(drop=True)
+    return df_search, len(pairs) - len(rows)
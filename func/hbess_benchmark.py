@@ -0,0 +1,183 @@
+import gc
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import warnings
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from . import hbess_ems
+from . import hbess_engine
+from . import hbess_tables
+from . import hbess_visualise
+
+# Reproducible benchmarks of the EMS methods, the pipeline stages, the chart builders and the whole sizing, on synthetic
+# load profiles of 10^3 to 10^7 samples: the shape of a bundled profile, repeated at its own sample rate, with seeded
+# noise (so that no two samples are equal). Every stage is timed (best of a number of runs, outside its setup), then run
+# once more under tracemalloc for its peak memory. Results are written as JSON and compared between runs for regressions.
+
+sizes = (10**3, 10**4, 10**5, 10**6, 10**7)
+
+# Scenario of the benchmarks (the defaults of the app)
+scenario = {'shape': 'Tug boat 1', 'cell_HE': 'NMC Samsung 94Ah', 'cell_HP': 'LTO Toshiba 23Ah', 'SOC_0': 90, 'V_ref': 1000,
+            'N_year': 365, 'DoD': 80, 'P_chrg': 2000.0, 'lifetime': 20, 'height': 300}
+
+
+def synthetic_profile(shape, n, noise=0.01, seed=0):
+    # n samples of the bundled load profile shape, repeated at its mean sample interval, with white noise (of the peak power)
+    profile = hbess_engine.read_load(shape)
+    t_0, P_0 = profile['t'].to_numpy(dtype=float), profile['P'].to_numpy(dtype=float)
+    dt = (t_0[-1] - t_0[0]) / (len(t_0) - 1)
+    t = t_0[0] + dt * np.arange(n)
+    P = np.interp((t - t_0[0]) % (t_0[-1] - t_0[0] + dt), t_0 - t_0[0], P_0)
+    P += np.random.default_rng(seed).normal(0, noise * np.abs(P_0).max(), n)
+    return pd.DataFrame({'t': t, 'P': P})
+
+
+def benchmark_context(profile, cell_HE, cell_HP):
+    # Inputs of the stages: the Power sharing of the profile with charging, its packs and simulation (not timed)
+    s = scenario
+    shared = hbess_ems.power_sharing(profile.copy())
+    charging = hbess_tables.add_charging(shared, hbess_tables.get_cumulative_energy(shared), s['P_chrg'])
+    packs_HE = hbess_tables.calculate_packs(charging['P_HE'], charging['t'], cell_HE, s['V_ref'], s['DoD'])
+    packs_HP = hbess_tables.calculate_packs(charging['P_HP'], charging['t'], cell_HP, s['V_ref'], s['DoD'])
+    df_E_cum = hbess_tables.get_cumulative_energy(charging)
+    df_SOC = hbess_tables.get_soc(df_E_cum, packs_HE[4], packs_HP[4], s['SOC_0'])
+    df_V = hbess_tables.get_voltage(df_SOC, cell_HE, cell_HP, packs_HE[0], packs_HP[0])
+    df_I = hbess_tables.get_current(charging, df_V)
+    return {'profile': profile, 'cell_HE': cell_HE, 'cell_HP': cell_HP, 'charging': charging, 'packs_HE': packs_HE, 'packs_HP': packs_HP,
+            'df_E_cum': df_E_cum, 'df_SOC': df_SOC, 'df_V': df_V, 'df_I': df_I}
+
+
+# name: (arguments from the context, function); the arguments are prepared outside the timing (e.g. copies of the profile)
+# The profile stages only need the synthetic profile: they run before the rest of the context is built, so that the
+# end-to-end sizing of 10^7 samples does not share the memory with it
+profile_stages = ('split_sharing', 'power_sharing', 'gradient_sharing', 'cost_split', 'cost_limit', 'run_sizing')
+stages = OrderedDict([
+    ('split_sharing', (lambda c: (c['profile'].copy(), 50), hbess_ems.split_sharing)),
+    ('power_sharing', (lambda c: (c['profile'].copy(),), hbess_ems.power_sharing)),
+    ('gradient_sharing', (lambda c: (c['profile'].copy(),), hbess_ems.gradient_sharing)),
+    ('cost_split', (lambda c: (c['profile'].copy(), c['cell_HE'], c['cell_HP'], scenario['V_ref'], scenario['DoD']), hbess_ems.cost_split)),
+    ('cost_limit', (lambda c: (c['profile'].copy(), c['cell_HE'], c['cell_HP'], scenario['V_ref'], scenario['DoD']), hbess_ems.cost_limit)),
+    ('calculate_packs', (lambda c: (c['charging']['P_HE'], c['charging']['t'], c['cell_HE'], scenario['V_ref'], scenario['DoD']), hbess_tables.calculate_packs)),
+    ('get_cumulative_energy', (lambda c: (c['charging'],), hbess_tables.get_cumulative_energy)),
+    ('get_soc', (lambda c: (c['df_E_cum'], c['packs_HE'][4], c['packs_HP'][4], scenario['SOC_0']), hbess_tables.get_soc)),
+    ('get_voltage', (lambda c: (c['df_SOC'], c['cell_HE'], c['cell_HP'], c['packs_HE'][0], c['packs_HP'][0]), hbess_tables.get_voltage)),
+    ('get_current', (lambda c: (c['charging'], c['df_V']), hbess_tables.get_current)),
+    ('fig_loadprofile', (lambda c: (c['charging'], scenario['height']), hbess_visualise.fig_loadprofile)),
+    ('fig_cumul_energy', (lambda c: (c['df_E_cum'], scenario['height']), hbess_visualise.fig_cumul_energy)),
+    ('fig_soc', (lambda c: (c['df_SOC'], scenario['height']), hbess_visualise.fig_soc)),
+    ('fig_voltage', (lambda c: (c['df_V'], scenario['height']), hbess_visualise.fig_voltage)),
+    ('fig_current', (lambda c: (c['df_I'], scenario['height']), hbess_visualise.fig_current)),
+    ('run_sizing', (lambda c: (c['profile'], c['cell_HE'], c['cell_HP'], 'Power', scenario['SOC_0'], scenario['V_ref'], scenario['N_year'],
+                               scenario['DoD'], scenario['P_chrg'], scenario['lifetime'], None), hbess_engine.run_sizing)),
+])
+
+
+def time_stage(function, arguments, repeat=5, budget=1.0, min_total=0.2, max_runs=100):
+    # Times of at least repeat runs (s), more (up to max_runs) until they add up to min_total, so that the best of fast
+    # stages is not noise; fewer once a run takes longer than budget (s). Then the peak memory of one run (MB)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore') #e.g. pandas deprecations, reported on every run
+        times = []
+        while len(times) < repeat or (sum(times) < min_total and len(times) < max_runs):
+            args = arguments()
+            gc.collect()
+            start = time.perf_counter()
+            function(*args)
+            times.append(time.perf_counter() - start)
+            del args
+            if times[-1] > budget:
+                break
+
+        args = arguments()
+        gc.collect()
+        tracemalloc.start()
+        try:
+            function(*args)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return times, peak / 1e6
+
+
+def environment():
+    # Versions and machine of a run, and the commit of the code (if in a git checkout)
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=hbess_engine.ROOT, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(), 'cpus': os.cpu_count(), 'platform': platform.platform(), 'commit': commit,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run_benchmarks(names=None, sizes=sizes, repeat=5, max_seconds=60.0, shape=None, progress=None):
+    # Times the stages (names, by default all) on the synthetic profile of every size. A stage that took longer than
+    # max_seconds at one size is skipped at the larger sizes (recorded with time None)
+    names = list(names or stages)
+    unknown = [name for name in names if name not in stages]
+    if unknown:
+        raise ValueError(f'Unknown benchmark: {", ".join(unknown)}')
+    if progress is None:
+        progress = lambda fraction, text: None
+
+    cell_HE, cell_HP = hbess_engine.read_cell(scenario['cell_HE']), hbess_engine.read_cell(scenario['cell_HP'])
+    rows, slow = [], set()
+    steps = len(sizes) * len(names)
+    for i, n in enumerate(sizes):
+        progress(len(rows) / steps, f'Preparing a profile of {n} samples')
+        context = {'profile': synthetic_profile(shape or scenario['shape'], n), 'cell_HE': cell_HE, 'cell_HP': cell_HP}
+        for name in sorted(names, key=lambda name: name not in profile_stages):
+            if name not in profile_stages and 'charging' not in context:
+                progress(len(rows) / steps, f'Simulating a profile of {n} samples')
+                context = benchmark_context(context['profile'], cell_HE, cell_HP)
+            if name in slow:
+                rows.append({'stage': name, 'samples': n, 'time': None, 'times': [], 'peak_memory': None})
+                continue
+            progress(len(rows) / steps, f'{name} ({n} samples)')
+            arguments, function = stages[name]
+            times, peak = time_stage(function, lambda: arguments(context), repeat)
+            rows.append({'stage': name, 'samples': n, 'time': min(times), 'times': times, 'peak_memory': peak})
+            if max(times) > max_seconds:
+                slow.add(name)
+        del context
+
+    rows.sort(key=lambda row: (row['samples'], names.index(row['stage'])))
+    progress(1.0, 'Done')
+    return {'environment': environment(), 'scenario': dict(scenario, shape=shape or scenario['shape']), 'results': rows}
+
+
+def write_results(results, path):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=1)
+
+
+def read_results(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def results_table(results):
+    # One row per stage and profile size: best and median time (ms), throughput (million samples per second), peak memory (MB)
+    df = pd.DataFrame(results['results'], columns=['stage', 'samples', 'time', 'times', 'peak_memory'])
+    df['time'] = df['time'].astype(float) * 1000 #s to ms
+    df['time_median'] = [np.median(times) * 1000 if times else np.nan for times in df.pop('times')] #s to ms
+    df['throughput'] = df['samples'] / df['time'] / 1000 #million samples per second
+    return df
+
+
+def compare_results(baseline, results, threshold=1.5, min_time=10.0, min_memory=1.0):
+    # Time and peak memory of results relative to a baseline run, per stage and size. A time regression is a best time
+    # above threshold x the median time of the baseline (the spread of its runs is noise), a memory regression a peak
+    # above threshold x that of the baseline. Times below min_time (ms) and peaks below min_memory (MB) don't count
+    df = results_table(baseline).merge(results_table(results), on=['stage', 'samples'], suffixes=('_baseline', ''))
+    df['time_ratio'] = df['time'] / df['time_baseline']
+    df['memory_ratio'] = df['peak_memory'] / df['peak_memory_baseline']
+    slower = (df['time'] > threshold * df['time_median_baseline'].fillna(df['time_baseline'])) & (df['time'] >= min_time)
+    larger = (df['memory_ratio'] > threshold) & (df['peak_memory'] >= min_memory)
+    df['regression'] = slower | larger
+    return df[['stage', 'samples', 'time_baseline', 'time', 'time_ratio', 'peak_memory_baseline', 'peak_memory', 'memory_ratio', 'regression']]
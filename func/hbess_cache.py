@@ -0,0 +1,89 @@
+import copy
+import dataclasses
+import functools
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+# Memoization of parsed inputs and sizing results, keyed on the content of the arguments.
+# Files are keyed on their content hash (not their name), DataFrames on their values, and
+# callbacks (e.g. on_error) are left out of the key: the messages they received are replayed on a cache hit.
+
+
+def content_hash(value, digest=None):
+    if digest is None:
+        digest = hashlib.sha1()
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(repr((type(value).__name__, getattr(value, 'name', None), list(getattr(value, 'columns', [])))).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(repr((value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(f'{type(value).__name__}{len(value)}'.encode())
+        for item in value:
+            content_hash(item, digest)
+    elif dataclasses.is_dataclass(value):
+        content_hash((type(value).__name__, [getattr(value, field.name) for field in dataclasses.fields(value)]), digest)
+    elif isinstance(value, dict):
+        content_hash(sorted(value.items(), key=lambda item: repr(item[0])), digest)
+    elif isinstance(value, str) and os.path.isfile(value):
+        with open(value, 'rb') as file:
+            digest.update(file.read())
+    elif hasattr(value, 'getvalue'):
+        digest.update(value.getvalue()) #uploaded file (BytesIO-like)
+    elif hasattr(value, 'read') and hasattr(value, 'seek'):
+        position = value.tell()
+        digest.update(value.read())
+        value.seek(position)
+    else:
+        digest.update(repr(value).encode())
+
+    return digest
+
+
+def memoize(max_entries=32):
+    # Least-recently-used cache of at most max_entries results per function
+    def decorator(function):
+        cache = OrderedDict()
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            callbacks = {i: arg for i, arg in enumerate(args) if callable(arg)}
+            callbacks.update({name: arg for name, arg in kwargs.items() if callable(arg)})
+            key_args = [None if i in callbacks else arg for i, arg in enumerate(args)]
+            key_kwargs = {name: arg for name, arg in kwargs.items() if name not in callbacks}
+            key = content_hash((function.__qualname__, key_args, key_kwargs)).hexdigest()
+
+            if key in cache:
+                cache.move_to_end(key)
+                value, messages = cache[key]
+                for name, message in messages:
+                    if name in callbacks:
+                        callbacks[name](*message)
+                return copy.deepcopy(value)
+
+            # Record what the callbacks receive, so that a later hit can replay it
+            messages = []
+            def recorder(name, callback):
+                def record(*message):
+                    messages.append((name, message))
+                    return callback(*message)
+                return record
+            args = [recorder(i, arg) if i in callbacks else arg for i, arg in enumerate(args)]
+            kwargs = {name: recorder(name, arg) if name in callbacks else arg for name, arg in kwargs.items()}
+
+            value = function(*args, **kwargs)
+            cache[key] = (copy.deepcopy(value), messages)
+            while len(cache) > max_entries:
+                cache.popitem(last=False)
+            return value
+
+        wrapper.cache = cache
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
@@ -0,0 +1,86 @@
+import json
+import os
+from . import hbess_cell
+from . import hbess_tables
+
+# On-disk cell catalog: every cell .csv file in a directory, parsed once and kept in an index (JSON: the cell fields,
+# the error of an invalid file and the modification time and size of each file; data only, so that an index found in
+# any directory is safe to read). An entry is re-parsed only when the modification time (or size) of its file changes.
+
+index_name = '.hbess_index.json'
+index_version = 3
+
+
+def read_index(index_path):
+    # {file name: (stamp, Cell or None, error or None)}; empty if missing, of another version or not valid
+    try:
+        with open(index_path) as file:
+            data = json.load(file)
+        if data['version'] != index_version:
+            return {}
+        return {str(file_name): ((int(entry['stamp'][0]), int(entry['stamp'][1])),
+                                 None if entry['cell'] is None else hbess_cell.cell_from_fields(entry['cell']),
+                                 None if entry['error'] is None else str(entry['error']))
+                for file_name, entry in data['cells'].items()}
+    except (OSError, ValueError, TypeError, KeyError, IndexError, AttributeError):
+        return {}
+
+
+def write_index(index_path, index):
+    data = {'version': index_version,
+            'cells': {file_name: {'stamp': list(stamp), 'cell': None if cell is None else hbess_cell.cell_fields(cell), 'error': error}
+                      for file_name, (stamp, cell, error) in index.items()}}
+    try:
+        with open(index_path + '.tmp', 'w') as file:
+            json.dump(data, file)
+        os.replace(index_path + '.tmp', index_path)
+    except OSError:
+        pass #read-only directory: the catalog still works, only without the cache
+
+
+def scan_cells(directory, on_error=None, update_index=True):
+    # Returns {path: Cell} for the valid cell files in directory; invalid files are reported to on_error and skipped
+    # update_index: write the index back if a file changed (False: only read it, e.g. when the engine is imported)
+    index_path = os.path.join(directory, index_name)
+    index = read_index(index_path)
+
+    catalog, changed = {}, False
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.lower().endswith('.csv'):
+            continue
+        path = os.path.join(directory, file_name)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+
+        if file_name in index and index[file_name][0] == stamp:
+            cell, error = index[file_name][1:]
+        else:
+            cell, error = None, None
+            try:
+                cell = hbess_tables.read_cell_csv(path)
+            except (ValueError, SyntaxError, OSError) as exception:
+                error = str(exception)
+            index[file_name] = (stamp, cell, error)
+            changed = True
+
+        if error is not None and on_error is not None:
+            on_error(f'{file_name}: {error}')
+
+        # Placeholder cells (e.g. None.csv) have no capacity, voltage or cost
+        if cell is not None and min(cell.capacity, cell.voltage, cell.cost) > 0:
+            catalog[path] = cell
+
+    # Forget deleted files
+    for file_name in set(index) - set(os.listdir(directory)):
+        del index[file_name]
+        changed = True
+
+    if changed and update_index:
+        write_index(index_path, index)
+
+    return catalog
+
+
+def cell_names(catalog):
+    # {product name: path}, e.g. for the dict_cell mapping of the app
+    return {cell.name: path for path, cell in catalog.items()}
@@ -0,0 +1,66 @@
+import ast
+import dataclasses
+import numpy as np
+from dataclasses import dataclass
+
+# Compact, immutable battery cell: the cell .csv file is parsed once into typed fields,
+# so pack calculations don't index the parameter DataFrame, and cells are cheap to send to worker processes.
+
+
+@dataclass(frozen=True, eq=False)
+class Cell:
+    name: str
+    technology: str
+    capacity: float         #Ah
+    voltage: float          #V (nominal)
+    weight: float           #kg
+    cost: float             #eur
+    I_dis: float            #A (maximum continuous discharge current)
+    I_chrg: float           #A (maximum continuous charge current)
+    OCV: np.ndarray         #V
+    OCV_SOC: np.ndarray     #- (0 to 1)
+    SOH: np.ndarray         #- (0 to 1)
+    SOH_N: np.ndarray       #cycles
+    R: float = 0.0          #Ohm (DC internal resistance, optional 13th row of the .csv file in mOhm; 0 if unknown)
+
+    @property
+    def energy(self):
+        return self.voltage * self.capacity #Wh
+
+
+def parse_cell(df_cell):
+    # df_cell: the 'parameter, value, unit' DataFrame of a cell .csv file, in the row order of the template
+    # (12 rows, or 13 with the internal resistance)
+    values = df_cell['value'].tolist()
+    curves = []
+    for value in values[8:12]:
+        # Convert the string representations of the lists to read-only arrays
+        curve = np.array(ast.literal_eval(value), dtype=float)
+        curve.setflags(write=False)
+        curves.append(curve)
+
+    R = float(values[12]) / 1000 if len(values) > 12 else 0.0 #mOhm to Ohm
+    return Cell(str(values[0]), str(values[1]), *(float(value) for value in values[2:8]), *curves, R)
+
+
+curves = ('OCV', 'OCV_SOC', 'SOH', 'SOH_N')
+names = ('name', 'technology')
+
+
+def cell_fields(cell):
+    # The fields of a cell as plain JSON data (curves as lists), e.g. for the catalog index
+    return {field.name: getattr(cell, field.name).tolist() if field.name in curves else getattr(cell, field.name) for field in dataclasses.fields(cell)}
+
+
+def cell_from_fields(fields):
+    # The Cell of cell_fields. Every field is converted to its type (read-only arrays for the curves): anything else,
+    # e.g. an index of another version, raises TypeError or ValueError
+    values = {}
+    for name, value in fields.items():
+        if name in curves:
+            value = np.array(value, dtype=float)
+            value.setflags(write=False)
+        else:
+            value = str(value) if name in names else float(value)
+        values[name] = value
+    return Cell(**values)
@@ -0,0 +1,70 @@
+import numpy as np
+import scipy
+from . import hbess_result
+from . import hbess_tables
+
+# Equivalent-circuit (R-int) simulation of the packs: an OCV source with the internal resistance of the pack in series.
+# The current follows from the terminal power at every time step, P = (OCV - R I) I, solved in closed form for the whole
+# profile at once. The SoC is counted from the current (coulomb counting); as the OCV depends on the SoC, the current and
+# the SoC are iterated (a fixed point, vectorised over all time steps) until the SoC no longer changes.
+
+
+def solve_current(P, OCV, R):
+    # Smallest current that delivers the power P (W) at the terminals: R I^2 - OCV I + P = 0
+    # Where P exceeds the maximum power OCV^2 / 4R, the current at maximum power is returned and the step is infeasible
+    P, OCV = np.asarray(P, dtype=float), np.asarray(OCV, dtype=float)
+    if R <= 0:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return P / OCV, np.zeros(len(P), dtype=bool)
+
+    discriminant = OCV ** 2 - 4 * R * P
+    infeasible = discriminant < 0
+    # (OCV - sqrt(D)) / 2R, written as 2P / (OCV + sqrt(D)) to stay accurate when R I is small
+    with np.errstate(divide='ignore', invalid='ignore'):
+        I = np.where(infeasible, OCV / (2 * R), 2 * P / (OCV + np.sqrt(np.maximum(discriminant, 0))))
+    return I, infeasible
+
+
+def simulate_pack(P, t, cell, S, N_par, SOC_0, tolerance=1e-6, max_iterations=50):
+    # Terminal power P (W) at times t (s) for a pack of S cells in series and N_par strings in parallel
+    # Returns the SoC (%), terminal voltage (V), current (A) and the infeasible time steps
+    n = len(P)
+    if N_par == 0:
+        return np.full(n, np.nan), np.full(n, np.nan), np.full(n, np.nan), np.zeros(n, dtype=bool)
+
+    R = S * cell.R / N_par #Ohm
+    Q = N_par * cell.capacity * 3600 #As
+
+    # Start from the SoC of the energy balance at nominal voltage (as get_soc), then iterate the coulomb count
+    SOC = SOC_0 - 100 * scipy.integrate.cumtrapz(P, t, initial=0) / (Q * S * cell.voltage)
+    for iteration in range(max_iterations):
+        OCV = S * hbess_tables.get_ocv(cell, SOC / 100)
+        I, infeasible = solve_current(P, OCV, R)
+        SOC_next = SOC_0 - 100 * scipy.integrate.cumtrapz(I, t, initial=0) / Q
+        converged = np.nanmax(np.abs(SOC_next - SOC)) <= tolerance if n else True
+        SOC = SOC_next
+        if converged:
+            break
+
+    OCV = S * hbess_tables.get_ocv(cell, SOC / 100)
+    I, infeasible = solve_current(P, OCV, R)
+    return SOC, OCV - R * I, I, infeasible
+
+
+def simulate_circuit(load_profile, cell_HE, cell_HP, packs_HE, packs_HP, SOC_0, dtype=None, t_h=None):
+    # R-int counterpart of get_soc, get_voltage and get_current: the same DataFrames (t in hours, one shared time axis),
+    # and the number of time steps in which each pack can't deliver its power. dtype: storage of the results (float64 by default)
+    # t_h: the time axis to share (e.g. of df_E_cum), by default computed from the load profile
+    t = load_profile['t'].to_numpy(dtype=float)
+    frames = {'t': t / 3600 if t_h is None else t_h} #s to h
+    infeasible = {}
+    for pack, cell, packs in (('HE', cell_HE, packs_HE), ('HP', cell_HP, packs_HP)):
+        frames[f'SOC_{pack}'], frames[f'V_{pack}'], frames[f'I_{pack}'], steps = simulate_pack(
+            load_profile[f'P_{pack}'].to_numpy(dtype=float), t, cell, packs[0], packs[1], SOC_0)
+        infeasible[pack] = int(steps.sum())
+
+    dtype = dtype or 'float64'
+    df_SOC = hbess_result.as_frame(frames['t'], dtype, SOC_HE=frames['SOC_HE'], SOC_HP=frames['SOC_HP'])
+    df_V = hbess_result.as_frame(frames['t'], dtype, V_HE=frames['V_HE'], V_HP=frames['V_HP'])
+    df_I = hbess_result.as_frame(frames['t'], dtype, I=frames['I_HE'] + frames['I_HP'], I_HE=frames['I_HE'], I_HP=frames['I_HP'])
+    return df_SOC, df_V, df_I, infeasible
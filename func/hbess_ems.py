@@ -1,10 +1,16 @@
 import pandas as pd
 import numpy as np
-import streamlit as st
+import scipy
+import math
+import collections
 from .hbess_tables import *
+from . import hbess_online
 
 def load_sharing(load_profile, cell_HE, cell_HP, method, SOC_0, V_ref, N_year, DoD, P_chrg, lifetime, factor):
-    
+    # Returns the shared profile, the cost table of the cost strategies (or None), and the smallest pack energies
+    # (E_HE, E_HP in Wh) the sharing is planned for, or None: the packs are then sized from the shared profile only
+    E_min = None
+
     match method:
         case 'Split':
             #split sharing method
@@ -28,12 +34,39 @@ def load_sharing(load_profile, cell_HE, cell_HP, method, SOC_0, V_ref, N_year, D
 
         case 'Cost: Limit':
             load_profile, df_cost = cost_limit(load_profile, cell_HE, cell_HP, V_ref, DoD)
-            
+
+        case 'Cost: Split (exact)':
+            load_profile, df_cost = optimal_split(load_profile, cell_HE, cell_HP, V_ref, DoD)
+
+        case 'Cost: Limit (exact)':
+            load_profile, df_cost = optimal_limit(load_profile, cell_HE, cell_HP, V_ref, DoD)
+
+        case 'Optimal':
+            load_profile, df_cost, E_min = optimal_lp(load_profile, cell_HE, cell_HP, DoD, SOC_0)
+
+        case 'Rolling mean' | 'Rolling max':
+            load_profile = rolling_sharing(load_profile, factor, method.removeprefix('Rolling '))
+            df_cost = None
+
+        case 'Cost: Rolling mean' | 'Cost: Rolling max':
+            load_profile, df_cost = cost_rolling(load_profile, cell_HE, cell_HP, V_ref, DoD, method.removeprefix('Cost: Rolling '))
+
+        case 'Online: Peak' | 'Online: Low-pass' | 'Online: Rate limit':
+            # The causal controllers of hbess_online
+            load_profile = hbess_online.online_profile(load_profile, *online_controller(method, factor))
+            df_cost = None
+
         case default:
             load_profile = split_none(load_profile)
             df_cost = None
 
-    return load_profile, df_cost
+    return load_profile, df_cost, E_min
+
+
+def online_controller(method, factor):
+    # Controller and parameter of an 'Online: ...' strategy; factor: time constant (s) of the low-pass, HE ramp rate (kW/s)
+    controller = method.removeprefix('Online: ')
+    return controller, {'Peak': None, 'Low-pass': factor, 'Rate limit': None if factor is None else 1000 * factor}[controller]
 
 
 def split_sharing(load_profile, factor):
@@ -67,66 +100,438 @@ def gradient_sharing(load_profile):
     return load_profile
 
 
+none_factors = (0.1, 0.2)  #HE and HP shares of the load power in split_none ('Cost')
+
 def split_none(load_profile):
-    load_profile['P_HE'] = 0.1 * load_profile['P']
-    load_profile['P_HP'] = 0.2 * load_profile['P']
+    load_profile['P_HE'] = none_factors[0] * load_profile['P']
+    load_profile['P_HP'] = none_factors[1] * load_profile['P']
 
     return load_profile
 
-def cost_split(load_profile, cell_HE, cell_HP, V_ref, DoD):
-    temp_profile = load_profile.copy()
-    df_cost = pd.DataFrame(columns=['factor', 'cost'])
-    my_bar = st.progress(0, text="Operation in progress. Please wait.")
-    
-    for factor in range(0, 101):
-        my_bar.progress(factor, text="Operation in progress. Please wait.")
-
-        #Calculate power of each pack
-        temp_profile['P_HE'] = (factor/100) * load_profile['P']
-        temp_profile['P_HP'] = (1-(factor/100)) * load_profile['P']
-
-        #Calculate total cost
-        S_HE, P_HE, N_HE, C_HE, E_HE, V_HE = calculate_packs(temp_profile['P_HE'], temp_profile['t'], cell_HE, V_ref, DoD)
-        S_HP, P_HP, N_HP, C_HP, E_HP, V_HP = calculate_packs(temp_profile['P_HP'], temp_profile['t'], cell_HP, V_ref, DoD)
-        C_tot = C_HE + C_HP
-        
-        new_row = pd.DataFrame({'factor': factor, 'cost': C_tot}, index=[0])
-        df_cost = pd.concat([df_cost, new_row], ignore_index=True)
-    
+def load_fraction(method):
+    # Fraction of the load power delivered by both packs together (P_HE + P_HP): all of it, except in split_none
+    return sum(none_factors) if method == 'Cost' else 1.0
+
+def split_energy(load_profile, factors):
+    # The energy of a scaled profile is the scaled energy: integrate once, then scale for every factor (%)
+    E_max = get_required_energy(load_profile['P'].to_numpy(), load_profile['t'].to_numpy()) #Wh
+    E_HE = (factors/100) * E_max    #Wh
+    E_HP = (1 - (factors/100)) * E_max    #Wh
+    return E_HE, E_HP
+
+def cost_split(load_profile, cell_HE, cell_HP, V_ref, DoD, step=1):
+    # Multiples of step (%) from 0 up to 100
+    factors = np.minimum(np.round(np.arange(0, 100 + step/2, step), 6), 100)
+
+    #Calculate total cost for all split factors at once
+    E_HE, E_HP = split_energy(load_profile, factors)
+    S_HE, P_HE, N_HE, C_HE, E_HE, V_HE = calculate_packs_array(E_HE, cell_HE, V_ref, DoD)
+    S_HP, P_HP, N_HP, C_HP, E_HP, V_HP = calculate_packs_array(E_HP, cell_HP, V_ref, DoD)
+    C_tot = C_HE + C_HP
+
+    if np.all(factors == np.round(factors)):
+        factors = factors.astype(int)
+    df_cost = pd.DataFrame({'factor': factors, 'cost': C_tot})
+
     factor = df_cost.loc[df_cost['cost'].idxmin(), 'factor']
     load_profile['P_HE'] = (factor/100) * load_profile['P']
     load_profile['P_HP'] = (1 - (factor/100)) * load_profile['P']
-    my_bar.empty()
 
     return load_profile, df_cost
 
+def limit_energy(load_profile, limits):
+    # Required energy of the HE pack (capped at each power limit) and HP pack (excess above the limit), for all limits at once
+    t = load_profile['t'].to_numpy(dtype=float)
+    P = load_profile['P'].to_numpy(dtype=float)
+    limits = np.asarray(limits, dtype=float)
+
+    # Trapezoidal weight of every sample: the integral of P is sum(w * P)
+    dt = np.diff(t)
+    w = np.zeros_like(P)
+    w[:-1] += dt / 2
+    w[1:] += dt / 2
+
+    # Excess above each limit from the sorted power levels and their suffix sums
+    order = np.argsort(P, kind='stable')
+    P_sorted = P[order]
+    w_sum = np.append(np.cumsum(w[order][::-1])[::-1], 0)
+    wP_sum = np.append(np.cumsum((w * P)[order][::-1])[::-1], 0)
+    idx = np.searchsorted(P_sorted, limits, side='right')
+    E_HP = np.maximum(wP_sum[idx] - limits * w_sum[idx], 0) / 3600 #Wh
+
+    if P.min() >= 0:
+        # Both packs only discharge, so the required energy is the total energy
+        E_HE = np.maximum(wP_sum[0] / 3600 - E_HP, 0) #Wh
+    else:
+        # The HE pack is recharged when P < 0: integrate the capped profiles in blocks of limits
+        E_HE = np.empty_like(limits)
+        block = max(1, 2**22 // len(P))
+        for i in range(0, len(limits), block):
+            P_HE = np.minimum(P[None, :], limits[i:i+block, None])
+            E_HE[i:i+block] = scipy.integrate.cumtrapz(P_HE, t, initial=0, axis=1).max(axis=1) / 3600 #Wh
+
+    return E_HE, E_HP
+
 # def cost_limit(load_profile, cell_HE, cell_HP, SOC_0, V_ref, N_year, DoD, P_chrg, lifetime)
 def cost_limit(load_profile, cell_HE, cell_HP, V_ref, DoD, cost=False):
-    temp_profile = load_profile.copy()
-    df_cost = pd.DataFrame(columns=['factor', 'cost'])
-
-    my_bar = st.progress(0, text="Operation in progress. Please wait.")
     P_max = load_profile['P'].max()
+    step = max(1, int(round(P_max/500)))
+    limits = np.arange(0, int(P_max + round(P_max/500)), step)
+
+    #Calculate total cost for all power limits at once
+    E_HE, E_HP = limit_energy(load_profile, limits)
+    S_HE, P_HE, N_HE, C_HE, E_HE, V_HE = calculate_packs_array(E_HE, cell_HE, V_ref, DoD)
+    S_HP, P_HP, N_HP, C_HP, E_HP, V_HP = calculate_packs_array(E_HP, cell_HP, V_ref, DoD)
+    C_tot = C_HE + C_HP
+
+    df_cost = pd.DataFrame({'factor': limits, 'cost': C_tot})
+
+    P_lim = df_cost.loc[df_cost['cost'].idxmin(), 'factor']
+    load_profile['P_HE'] = np.minimum(load_profile['P'], P_lim).astype(float)
+    load_profile['P_HP'] = np.maximum(load_profile['P'] - P_lim, 0).astype(float)
+
+    return load_profile, df_cost
+
+
+def rolling_mean(t, P, window):
+    # Time-weighted mean of P over the trailing window (t - window, t] (s) at every sample, from the cumulative
+    # energy (cumsum) at both ends of the window (searchsorted): O(n) for any window. Shorter at the start of the profile.
+    C = np.concatenate(([0], np.cumsum(np.diff(t) * (P[1:] + P[:-1]) / 2))) #Ws
+    start = np.maximum(t - window, t[0])
+    span = t - start
+
+    # Energy up to the start of the window: the sample before it, plus the trapezoid to the interpolated power
+    j = np.clip(np.searchsorted(t, start, side='right') - 1, 0, len(t) - 1)
+    P_start = np.interp(start, t, P)
+    C_start = C[j] + (start - t[j]) * (P[j] + P_start) / 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(span > 0, (C - C_start) / span, P)
+
+
+def rolling_max(t, P, window):
+    # Maximum of P over the trailing window (t - window, t] (s) at every sample. The deque holds the samples that can
+    # still be the maximum (decreasing power); every sample enters and leaves it once: amortized O(n) for any window.
+    if window <= 0:
+        return np.asarray(P, dtype=float).copy()
+    t_list, P_list = t.tolist(), P.tolist()
+    candidates, maxima = collections.deque(), []
+    for k, (time, power) in enumerate(zip(t_list, P_list)):
+        while candidates and P_list[candidates[-1]] <= power:
+            candidates.pop()
+        candidates.append(k)
+        while t_list[candidates[0]] <= time - window:
+            candidates.popleft()
+        maxima.append(P_list[candidates[0]])
+    return np.array(maxima)
+
+
+def rolling_limit(t, P, window, statistic):
+    # Power limit of the HE pack for a window (s): the rolling mean of the demand, or the highest rolling mean within
+    # the window (a rolling max of the demand itself is never below the demand, so it would not shave anything)
+    limit = rolling_mean(t, P, window)
+    if statistic == 'max':
+        limit = rolling_max(t, limit, window)
+    return limit
+
+
+def rolling_sharing(load_profile, window, statistic):
+    # The HE pack takes the demand up to the rolling limit, the HP pack the excess; window in minutes
+    t = load_profile['t'].to_numpy(dtype=float)
+    P = load_profile['P'].to_numpy(dtype=float)
+    P_HE = np.minimum(P, rolling_limit(t, P, 60 * window, statistic))
+    load_profile['P_HE'] = P_HE
+    load_profile['P_HP'] = P - P_HE
+    return load_profile
+
+
+def rolling_energy(load_profile, windows, statistic):
+    # Required energy (Wh) of the HE and HP packs for every window (min)
+    t = load_profile['t'].to_numpy(dtype=float)
+    P = load_profile['P'].to_numpy(dtype=float)
+    E_HE, E_HP = np.empty(len(windows)), np.empty(len(windows))
+    for i, window in enumerate(windows):
+        P_HE = np.minimum(P, rolling_limit(t, P, 60 * window, statistic))
+        E_HE[i], E_HP[i] = get_required_energy(P_HE, t), get_required_energy(P - P_HE, t)
+    return E_HE, E_HP
+
+
+def cost_rolling(load_profile, cell_HE, cell_HP, V_ref, DoD, statistic, n_windows=25):
+    # Sweep of the window length (min), from the median time step to the whole profile on a logarithmic scale
+    t = load_profile['t'].to_numpy(dtype=float)
+    dt = np.diff(t)
+    dt_min = max(np.median(dt[dt > 0]) if np.any(dt > 0) else 1.0, 1e-3) #s
+    windows = np.unique(np.geomspace(dt_min, max(t[-1] - t[0], 2 * dt_min), n_windows) / 60) #min
 
-    for P_lim in range(0, int(P_max + round(P_max/500)), int(round(P_max/500))): 
-        #print(P_lim)
-        my_bar.progress(round(100*P_lim/P_max), text="Operation in progress. Please wait.")
+    #Calculate total cost for all windows
+    E_HE, E_HP = rolling_energy(load_profile, windows, statistic)
+    S_HE, P_HE, N_HE, C_HE, E_HE, V_HE = calculate_packs_array(E_HE, cell_HE, V_ref, DoD)
+    S_HP, P_HP, N_HP, C_HP, E_HP, V_HP = calculate_packs_array(E_HP, cell_HP, V_ref, DoD)
+    C_tot = C_HE + C_HP
 
-        #Calculate the power of each pack
-        temp_profile['P_HE'] = temp_profile.apply(lambda row: row['P'] if row['P'] < P_lim else P_lim, axis=1)
-        temp_profile['P_HP'] = temp_profile.apply(lambda row: 0 if row['P'] < P_lim else row['P'] - P_lim, axis=1)
+    df_cost = pd.DataFrame({'factor': windows, 'cost': C_tot})
 
-        #Calculate total cost
-        S_HE, P_HE, N_HE, C_HE, E_HE, V_HE = calculate_packs(temp_profile['P_HE'], temp_profile['t'], cell_HE, V_ref, DoD)
-        S_HP, P_HP, N_HP, C_HP, E_HP, V_HP = calculate_packs(temp_profile['P_HP'], temp_profile['t'], cell_HP, V_ref, DoD)
-        C_tot = C_HE + C_HP
+    window = df_cost.loc[df_cost['cost'].idxmin(), 'factor']
+    load_profile = rolling_sharing(load_profile, window, statistic)
 
-        new_row = pd.DataFrame({'factor': P_lim, 'cost': C_tot}, index=[0])
-        df_cost = pd.concat([df_cost, new_row], ignore_index=True)
+    return load_profile, df_cost
+
+
+def cost_breakpoints(E_tot, cell_HE, cell_HP, V_ref, DoD):
+    # The cost only changes where a pack gains a parallel string, i.e. where the energy given to the HP pack (Wh)
+    # is a multiple of the HP string energy, or the energy left to the HE pack is a multiple of the HE string energy.
+    E_str_HE = round(V_ref / cell_HE.voltage) * cell_HE.energy * (DoD / 100) #Wh per string
+    E_str_HP = round(V_ref / cell_HP.voltage) * cell_HP.energy * (DoD / 100) #Wh per string
+
+    # Each string count is lowest exactly at its breakpoint: nudge the candidates to the cheap side of the step
+    eps = 1e-9 * E_tot
+    E_HP_brk = np.arange(0, math.floor(E_tot / E_str_HP) + 1) * E_str_HP - eps
+    E_HE_brk = E_tot - np.arange(0, math.floor(E_tot / E_str_HE) + 1) * E_str_HE + eps
+    E_HP = np.unique(np.clip(np.concatenate(([0, E_tot], E_HP_brk, E_HE_brk)), 0, E_tot))
+
+    return E_HP
+
+def optimal_split(load_profile, cell_HE, cell_HP, V_ref, DoD):
+    # Exact minimum-cost split factor, evaluated only at the string-count breakpoints
+    E_HE, E_HP = split_energy(load_profile, np.array([100]))
+    E_tot = E_HE[0] #Wh
+    if E_tot > 0:
+        factors = 100 * (1 - cost_breakpoints(E_tot, cell_HE, cell_HP, V_ref, DoD) / E_tot)
+    else:
+        factors = np.array([0.0, 100.0])
+    factors = np.sort(np.clip(factors, 0, 100))
+
+    E_HE, E_HP = split_energy(load_profile, factors)
+    S_HE, P_HE, N_HE, C_HE, E_HE, V_HE = calculate_packs_array(E_HE, cell_HE, V_ref, DoD)
+    S_HP, P_HP, N_HP, C_HP, E_HP, V_HP = calculate_packs_array(E_HP, cell_HP, V_ref, DoD)
+    C_tot = C_HE + C_HP
+
+    df_cost = pd.DataFrame({'factor': factors, 'cost': C_tot})
+
+    factor = df_cost.loc[df_cost['cost'].idxmin(), 'factor']
+    load_profile['P_HE'] = (factor/100) * load_profile['P']
+    load_profile['P_HP'] = (1 - (factor/100)) * load_profile['P']
+
+    return load_profile, df_cost
+
+def optimal_limit(load_profile, cell_HE, cell_HP, V_ref, DoD):
+    # Exact minimum-cost power limit, evaluated only at the string-count breakpoints
+    if load_profile['P'].min() < 0:
+        # The HE energy is no longer the total minus the HP energy: use the threshold sweep
+        return cost_limit(load_profile, cell_HE, cell_HP, V_ref, DoD)
+
+    # The HP energy is piecewise linear in the limit, with knots at the power levels of the profile
+    P_knots = np.unique(np.append(load_profile['P'].to_numpy(dtype=float), 0))
+    E_HE_knots, E_HP_knots = limit_energy(load_profile, P_knots)
+    E_tot = E_HP_knots[0] #Wh
+
+    # Map the breakpoints on the HP energy back to power limits
+    E_HP = cost_breakpoints(E_tot, cell_HE, cell_HP, V_ref, DoD)
+    limits = np.sort(np.interp(E_HP, E_HP_knots[::-1], P_knots[::-1]))
+
+    E_HE, E_HP = limit_energy(load_profile, limits)
+    S_HE, P_HE, N_HE, C_HE, E_HE, V_HE = calculate_packs_array(E_HE, cell_HE, V_ref, DoD)
+    S_HP, P_HP, N_HP, C_HP, E_HP, V_HP = calculate_packs_array(E_HP, cell_HP, V_ref, DoD)
+    C_tot = C_HE + C_HP
+
+    df_cost = pd.DataFrame({'factor': limits, 'cost': C_tot})
 
     P_lim = df_cost.loc[df_cost['cost'].idxmin(), 'factor']
-    load_profile['P_HE'] = load_profile.apply(lambda row: row['P'] if row['P'] < P_lim else P_lim, axis=1)
-    load_profile['P_HP'] = load_profile.apply(lambda row: 0 if row['P'] < P_lim else row['P'] - P_lim, axis=1)
-    my_bar.empty()
+    load_profile['P_HE'] = np.minimum(load_profile['P'], P_lim).astype(float)
+    load_profile['P_HP'] = np.maximum(load_profile['P'] - P_lim, 0).astype(float)
+
+    return load_profile, df_cost
+
+soc_methods = ('Optimal',)  #strategies whose sharing depends on the initial SoC (the headroom of the packs up to 100%)
+
+# Strategies whose pack powers are fixed fractions of P: the error bound of a compressed profile (hbess_profile.compress_profile)
+# holds for their required energies. The others are run on the original profile: gradients, limits and filters are not
+# linear in P, and the cost searches (e.g. Cost: Split) can pick another split of the compressed profile
+linear_methods = ('Split', 'Cost')
+
+# HiGHS on the sparse LP grows about quadratically with the profile length (Tug boat 1 resampled, 1 CPU:
+# 0.6 s at 2000 samples, 2.6 s at 5000, 9.8 s at 10^4, 38-160 s at 2*10^4 with the simplex or interior point method),
+# so it cannot reach 10^5 samples in seconds. The projection onto the two pack energies solves the same LP in linear
+# time (0.07 s at 2000, 0.3 s at 10^4, 4.5 s at 10^5) to the same cost (within 1e-6): it takes the longer profiles
+lp_max_steps = 2000
+
+
+def lp_problem(load_profile, cell_HE, cell_HP, DoD, SOC_0=100):
+    # Data of the optimal sharing LP in scaled units (well conditioned): powers relative to the peak power, times relative
+    # to the mean time step. Every interval between two samples has a constant HE power q, the HP takes the rest.
+    # d: the usable fraction of a pack below its initial SoC (DoD), u: the headroom above it (up to 100% SoC)
+    t = load_profile['t'].to_numpy(dtype=float)
+    P_unit = max(np.abs(load_profile['P'].to_numpy(dtype=float)).max(), 1.0) #W
+    t_unit = max((t[-1] - t[0]) / (len(t) - 1), 1e-9) #s
+    P = load_profile['P'].to_numpy(dtype=float) / P_unit
+    dt = np.diff(t) / t_unit
+    rate = lambda current, cell: current / cell.capacity * t_unit / 3600 #C-rate per time unit
+
+    return {'P_unit': P_unit, 't_unit': t_unit, 'dt': dt, 'd': DoD / 100, 'u': (100 - (100 if SOC_0 is None else SOC_0)) / 100,
+            'P_max': np.maximum(P[1:], P[:-1]), 'P_min': np.minimum(P[1:], P[:-1]),
+            'E_cum': np.concatenate(([0], np.cumsum(dt * (P[1:] + P[:-1]) / 2))),
+            'r_dis_HE': rate(cell_HE.I_dis, cell_HE), 'r_chrg_HE': rate(cell_HE.I_chrg, cell_HE),
+            'r_dis_HP': rate(cell_HP.I_dis, cell_HP), 'r_chrg_HP': rate(cell_HP.I_chrg, cell_HP),
+            'c_HE': cell_HE.cost / cell_HE.energy, 'c_HP': cell_HP.cost / cell_HP.energy} #eur/Wh
+
+
+def lp_bounds(problem, E_HE, E_HP):
+    # Bounds of the HE power q (per interval) and of the HE discharged energy e (per sample), for pack energies E_HE and E_HP
+    q_min = np.maximum(-problem['r_chrg_HE'] * E_HE, problem['P_max'] - problem['r_dis_HP'] * E_HP)
+    q_max = np.minimum(problem['r_dis_HE'] * E_HE, problem['P_min'] + problem['r_chrg_HP'] * E_HP)
+    # DoD: e <= d E_HE and E_cum - e <= d E_HP; full packs: -e <= u E_HE and e - E_cum <= u E_HP
+    e_min = np.maximum(problem['E_cum'] - problem['d'] * E_HP, -problem['u'] * E_HE)
+    e_max = np.minimum(problem['d'] * E_HE, problem['E_cum'] + problem['u'] * E_HP)
+    e_min[0] = e_max[0] = 0 #both packs start at their initial SoC
+    return q_min, q_max, e_min, e_max
+
+
+def lp_reachable(problem, E_HE, E_HP):
+    # Range [L, U] of HE energies that can be reached at every sample. Without the energy bounds it would grow by
+    # dt q_min and dt q_max per interval; with them, U[k] = min over j <= k of (e_max[j] + sum of dt q_max from j to k),
+    # which is a running minimum (and L a running maximum): the whole profile is checked without a loop.
+    q_min, q_max, e_min, e_max = lp_bounds(problem, E_HE, E_HP)
+    if np.any(q_min > q_max + 1e-12):
+        return False, q_min, q_max, None, None
+    cum_min = np.concatenate(([0], np.cumsum(problem['dt'] * q_min)))
+    cum_max = np.concatenate(([0], np.cumsum(problem['dt'] * q_max)))
+    L = cum_min + np.maximum.accumulate(e_min - cum_min)
+    U = cum_max + np.minimum.accumulate(e_max - cum_max)
+    feasible = np.all(L <= U + 1e-9 * max(1.0, np.abs(problem['E_cum']).max()))
+    return feasible, q_min, q_max, L, U
+
+
+def lp_highs(problem):
+    # The LP itself, solved by HiGHS. Variables: [q (n-1), e (n), E_HE, E_HP]; every interval adds a fixed number
+    # of nonzeros (a bidiagonal energy balance and six inequalities), so the matrices stay sparse.
+    dt, d = problem['dt'], problem['d']
+    m, n = len(dt), len(dt) + 1
+    i_q, i_e, i_HE, i_HP = 0, m, m + n, m + n + 1
+    k = np.arange(m)
+
+    # e[k+1] - e[k] - dt q[k] = 0, and e[0] = 0 (bounds)
+    A_eq = scipy.sparse.csr_matrix((np.concatenate((np.ones(m), -np.ones(m), -dt)),
+                                    (np.tile(k, 3), np.concatenate((i_e + k + 1, i_e + k, i_q + k)))), shape=(m, m + n + 2))
+
+    # C-rates: -q <= r_chrg,HE E_HE, q <= r_dis,HE E_HE, P_max - q <= r_dis,HP E_HP, q - P_min <= r_chrg,HP E_HP
+    # DoD: e <= d E_HE, E_cum - e <= d E_HP; full packs (SoC <= 100%): -e <= u E_HE, e - E_cum <= u E_HP
+    rows, columns, values = [], [], []
+    def add(block, size, column, value):
+        rows.append(block * m + np.arange(size))
+        columns.append(column)
+        values.append(np.broadcast_to(value, size))
+    for block, (sign, pack, r) in enumerate(((-1, i_HE, 'r_chrg_HE'), (1, i_HE, 'r_dis_HE'), (-1, i_HP, 'r_dis_HP'), (1, i_HP, 'r_chrg_HP'))):
+        add(block, m, i_q + k, sign)
+        add(block, m, np.full(m, pack), -problem[r])
+    u = problem['u']
+    for block, (sign, pack, factor) in enumerate(((1, i_HE, d), (-1, i_HP, d), (-1, i_HE, u), (1, i_HP, u))):
+        rows += [4 * m + block * n + np.arange(n)] * 2
+        columns += [i_e + np.arange(n), np.full(n, pack)]
+        values += [np.full(n, float(sign)), np.full(n, -factor)]
+    A_ub = scipy.sparse.csr_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))), shape=(4 * m + 4 * n, m + n + 2))
+    b_ub = np.concatenate((np.zeros(2 * m), -problem['P_max'], problem['P_min'], np.zeros(n), -problem['E_cum'], np.zeros(n), problem['E_cum']))
+
+    # The pack costs, and a negligible cost on e that picks one of the (many) optimal power sharings and speeds up HiGHS
+    c = np.zeros(m + n + 2)
+    c[i_e:i_e + n] = 1e-9 * min(problem['c_HE'], problem['c_HP'])
+    c[i_HE], c[i_HP] = problem['c_HE'], problem['c_HP']
+    bounds = [(None, None)] * m + [(0, 0)] + [(None, None)] * (n - 1) + [(0, None)] * 2
+
+    solution = scipy.optimize.linprog(c, A_ub=A_ub, b_ub=b_ub, A_eq=A_eq, b_eq=np.zeros(m), bounds=bounds, method='highs')
+    if not solution.success:
+        raise ValueError(f'The optimal energy management could not be solved: {solution.message}')
+    return solution.x[i_q:i_q + m], solution.x[i_HE], solution.x[i_HP]
+
+
+def lp_projection(problem, tolerance=1e-6):
+    # The same LP, projected onto the pack energies: the cost only depends on (E_HE, E_HP), and the feasible packs
+    # form a convex set that only grows with either energy. The least HP energy for a given HE energy is found by
+    # bisection, the cheapest HE energy by golden-section search (the cost along that boundary is convex).
+    # Every step is one lp_reachable check, linear in the length of the profile.
+    r_max = lambda values: max(np.max(values, initial=0), 0.0)
+    if problem['u'] == 0 and r_max(-problem['E_cum']) > 0:
+        raise ValueError('The optimal energy management could not be solved: the packs start full and the load profile charges them')
+    E_headroom = r_max(-problem['E_cum']) / problem['u'] if problem['u'] > 0 else 0.0
+    E_HP_0 = max(r_max(problem['P_max']) / problem['r_dis_HP'], r_max(-problem['P_min']) / problem['r_chrg_HP'],
+                 r_max(problem['E_cum']) / problem['d'], E_headroom) #sufficient without HE pack
+    E_HE_0 = max(r_max(problem['P_max']) / problem['r_dis_HE'], r_max(-problem['P_min']) / problem['r_chrg_HE'],
+                 r_max(problem['E_cum']) / problem['d'], E_headroom)
+    E_HE_hi = 2 * E_HE_0 + E_HP_0 * max(problem['r_chrg_HP'] / problem['r_dis_HE'], problem['r_dis_HP'] / problem['r_chrg_HE'], 1)
+
+    # Least HP energy that satisfies the C-rates in every interval (from q_min <= q_max, in closed form)
+    P_max, P_min, P_ramp = r_max(problem['P_max']), r_max(-problem['P_min']), r_max(problem['P_max'] - problem['P_min'])
+    rates_HP = lambda E_HE: max(0.0, (P_max - problem['r_dis_HE'] * E_HE) / problem['r_dis_HP'],
+                                (P_min - problem['r_chrg_HE'] * E_HE) / problem['r_chrg_HP'], P_ramp / (problem['r_dis_HP'] + problem['r_chrg_HP']))
+
+    def least_HP(E_HE):
+        low, high = rates_HP(E_HE), E_HP_0
+        if lp_reachable(problem, E_HE, low)[0]:
+            return low
+        while high - low > tolerance * max(E_HP_0, 1e-12):
+            middle = (low + high) / 2
+            low, high = (low, middle) if lp_reachable(problem, E_HE, middle)[0] else (middle, high)
+        return high
+
+    cost = lambda E_HE: problem['c_HE'] * E_HE + problem['c_HP'] * least_HP(E_HE)
+    golden = (math.sqrt(5) - 1) / 2
+    a, b = 0.0, E_HE_hi
+    x1, x2 = b - golden * (b - a), a + golden * (b - a)
+    f1, f2 = cost(x1), cost(x2)
+    while b - a > tolerance * E_HE_hi:
+        if f1 <= f2:
+            b, x2, f2 = x2, x1, f1
+            x1 = b - golden * (b - a)
+            f1 = cost(x1)
+        else:
+            a, x1, f1 = x1, x2, f2
+            x2 = a + golden * (b - a)
+            f2 = cost(x2)
+    E_HE = min((a, b, x1, x2), key=cost) #the end points too: the optimum may be a pack of one type only
+    E_HP = least_HP(E_HE)
+
+    # A feasible power sharing for these packs, backwards through the reachable ranges
+    feasible, q_min, q_max, L, U = lp_reachable(problem, E_HE, E_HP)
+    dt = problem['dt']
+    share = E_HE / (E_HE + E_HP) if E_HE + E_HP > 0 else 1.0
+    q_pref = np.clip(share * (problem['P_max'] + problem['P_min']) / 2, q_min, q_max)
+    e = np.empty(len(L))
+    e[-1] = min(max(problem['E_cum'][-1] * share, L[-1]), U[-1])
+    for k in range(len(dt) - 1, -1, -1):
+        low, high = max(L[k], e[k + 1] - dt[k] * q_max[k]), min(U[k], e[k + 1] - dt[k] * q_min[k])
+        e[k] = min(max(e[k + 1] - dt[k] * q_pref[k], low), high)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        q = np.where(dt > 0, np.diff(e) / dt, q_pref)
+    return q, E_HE, E_HP
+
+
+def optimal_lp(load_profile, cell_HE, cell_HP, DoD, SOC_0=None):
+    # Cost-optimal power sharing as a sparse linear program, with the (continuous) pack energies E_HE and E_HP (Wh),
+    # the HE power q in every interval between two samples and the HE discharged energy e at every sample:
+    #   minimise   cost_HE E_HE + cost_HP E_HP               (eur/Wh x Wh)
+    #   such that  e[k+1] - e[k] = dt q[k]                  (energy balance, bidiagonal)
+    #              -C_chrg,HE E_HE <= q <= C_dis,HE E_HE    (C-rates: maximum currents of the cell files per Ah)
+    #              -C_chrg,HP E_HP <= P - q <= C_dis,HP E_HP, at both samples of the interval
+    #              e <= DoD E_HE and E_cum - e <= DoD E_HP  (SoC bounds: the depth of discharge below SOC_0,
+    #              -e <= u E_HE and e - E_cum <= u E_HP      and the headroom u = 1 - SOC_0 up to full packs)
+    # Profiles of up to lp_max_steps samples are solved by HiGHS, longer ones by lp_projection (same LP, linear time).
+    # The HE power is constant per interval, so the returned profile has two samples (start and end) per interval.
+    # The pack energies of the LP (Wh) are returned too: the packs must be at least that large for its C-rates, which
+    # the energy sizing of calculate_packs does not check
+    if len(load_profile) < 2 or min(cell_HE.energy, cell_HP.energy) <= 0:
+        # A placeholder cell: nothing to share
+        load_profile['P_HE'] = load_profile['P'].astype(float) if cell_HE.energy > 0 else 0.0
+        load_profile['P_HP'] = load_profile['P'] - load_profile['P_HE']
+        return load_profile, None, None
+
+    problem = lp_problem(load_profile, cell_HE, cell_HP, DoD, SOC_0)
+    if len(load_profile) <= lp_max_steps:
+        q, E_HE, E_HP = lp_highs(problem)
+    else:
+        q, E_HE, E_HP = lp_projection(problem)
 
-    return load_profile, df_cost
\ No newline at end of file
+    t = load_profile['t'].to_numpy(dtype=float)
+    P = load_profile['P'].to_numpy(dtype=float)
+    P_HE = np.repeat(problem['P_unit'] * q, 2) #W
+    P_total = np.column_stack((P[:-1], P[1:])).ravel()
+    load_profile = pd.DataFrame({'t': np.column_stack((t[:-1], t[1:])).ravel(), 'P': P_total, 'P_HE': P_HE, 'P_HP': P_total - P_HE})
+    E_unit = problem['P_unit'] * problem['t_unit'] / 3600 #scaled energy to Wh
+    return load_profile, None, (E_HE * E_unit, E_HP * E_unit)
@@ -0,0 +1,231 @@
+import os
+import numpy as np
+from collections import OrderedDict
+from . import hbess_tables
+from . import hbess_batch
+from . import hbess_cache
+from . import hbess_catalog
+from . import hbess_ems
+from . import hbess_lifetime
+from . import hbess_montecarlo
+from . import hbess_pipeline
+from . import hbess_profile
+from . import hbess_result
+from . import hbess_schedule
+from . import hbess_sweep
+
+# Headless sizing engine: everything the app computes, without Streamlit.
+# Progress and messages are passed to optional callbacks, e.g. progress(0.5, 'Calculating packs').
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+dict_load = {
+    'Tug boat 1': 'load_profiles/tug_boat_1.csv',
+    'Tug boat 2': 'load_profiles/tug_boat_2.csv',
+    'Sine wave': 'load_profiles/sine_wave.csv',
+}
+
+# Every valid cell in battery_cells/ (from the catalog index if there is one, which is not written on import), by product name
+dict_cell = hbess_catalog.cell_names(hbess_catalog.scan_cells(os.path.join(ROOT, 'battery_cells'), update_index=False))
+
+# Memoized inputs: repeated or reverted files return immediately (sizing steps are cached per stage in hbess_pipeline)
+read_load_csv = hbess_cache.memoize(16)(hbess_tables.read_load_csv)
+read_cell_csv = hbess_cache.memoize(32)(hbess_tables.read_cell_csv)
+
+# Voltage models: open-circuit voltage only, or an equivalent circuit with the internal resistance of the cells
+models = ('ocv', 'rint')
+
+# Load sharing of several profiles on a process pool: only for the strategies that take much longer than sending their
+# results back from a worker (searches, linear programs, rolling windows), with at least parallel_samples samples in total
+parallel_methods = ('Cost: Limit', 'Cost: Limit (exact)', 'Cost: Rolling mean', 'Cost: Rolling max', 'Optimal')
+parallel_samples = 10**5
+
+methods = ('Split', 'Power', 'Gradient', 'Cost', 'Cost: Split', 'Cost: Limit', 'Cost: Split (exact)', 'Cost: Limit (exact)', 'Optimal',
+           'Rolling mean', 'Rolling max', 'Cost: Rolling mean', 'Cost: Rolling max',
+           'Online: Peak', 'Online: Low-pass', 'Online: Rate limit')
+
+
+def read_load(name, on_error=None):
+    # Bundled load profile by name, a path / file-like object, or a binary profile ('<name>.t.npy', see hbess_profile)
+    if isinstance(name, str) and name in dict_load:
+        name = os.path.join(ROOT, dict_load[name])
+    if hbess_profile.is_npy_profile(name):
+        return hbess_profile.open_load_npy(name)
+    return read_load_csv(name, on_error)
+
+
+def read_cell(name, on_error=None):
+    # Bundled battery cell by name, or a path / file-like object
+    if isinstance(name, str) and name in dict_cell:
+        name = os.path.join(ROOT, dict_cell[name])
+    return read_cell_csv(name, on_error)
+
+
+def run_sizing(load_profile, cell_HE, cell_HP, method, SOC_0, V_ref, N_year, DoD, P_chrg, lifetime, factor, progress=None, cache=None, tolerance=None, model='ocv', dtype=None):
+    # cell_HE and cell_HP are the Cell objects returned by read_cell_csv
+    # cache: dict kept between calls, so that only the stages affected by changed inputs are recomputed
+    # tolerance: if given (e.g. 0.01), the profile is first compressed with a power and cumulative energy error of at most 1%
+    #   (only for the methods in hbess_ems.linear_methods, ignored otherwise: result['tolerance'] is the one applied)
+    # model: 'ocv' or 'rint' (the packs are simulated with the internal resistance cell.R, see hbess_circuit)
+    # dtype: storage of the simulated quantities, 'float64' (default) or 'float32' (half the memory, see hbess_result)
+    envelope = run_sizing_envelope([load_profile], cell_HE, cell_HP, method, SOC_0, V_ref, N_year, DoD, P_chrg, lifetime, factor,
+                                   progress, cache, tolerance, model, dtype)
+    result = envelope['profiles'][0]
+    result.update({key: value for key, value in envelope.items() if key not in ('profiles', 'driver_HE', 'driver_HP')})
+    return result
+
+
+def run_sizing_envelope(load_profiles, cell_HE, cell_HP, method, SOC_0, V_ref, N_year, DoD, P_chrg, lifetime, factor, progress=None, cache=None, tolerance=None, model='ocv', dtype=None,
+                        max_workers=None):
+    # One HE and one HP pack for several load profiles (e.g. the operating modes of a vessel): every profile is shared
+    # and integrated, the packs are sized for all profiles as one array, and the largest requirement sets each pack.
+    # Every profile is then simulated with these packs. driver_HE and driver_HP are the indices of the profiles that set the packs.
+    # max_workers: processes sharing and integrating the profiles in parallel (see parallel_methods; 1: all in this process)
+    if model not in models:
+        raise ValueError(f'Unknown voltage model: {model}')
+    if dtype not in (None,) + hbess_result.dtypes:
+        raise ValueError(f'Unknown storage dtype: {dtype}')
+    if progress is None:
+        progress = lambda fraction, text: None
+    inputs = {'cell_HE': cell_HE, 'cell_HP': cell_HP, 'method': method, 'factor': factor, 'SOC_0': SOC_0, 'V_ref': V_ref,
+              'DoD': DoD, 'P_chrg': P_chrg, 'N_year': N_year, 'lifetime': lifetime,
+              'tolerance': tolerance if method in hbess_ems.linear_methods else None,
+              'dtype': None if dtype == 'float64' else dtype, 'SOC_0_sharing': SOC_0 if method in hbess_ems.soc_methods else None}
+    n = len(load_profiles)
+    label = lambda i, text: text if n == 1 else f'Load profile {i + 1}: {text}'
+
+    # Load sharing and energy integration of every profile (run, or reused from the cache). Profiles that are not cached
+    # are calculated in parallel (hbess_batch workers) first if worthwhile, then cached as if calculated here
+    keys = [hbess_pipeline.stage_keys(hbess_pipeline.profile_stages, dict(inputs, load_profile=load_profile)) for load_profile in load_profiles]
+    pending = [i for i in range(n) if not hbess_pipeline.is_cached(keys[i], cache)]
+    max_workers = max_workers or os.cpu_count() or 1
+    computed = {}
+    if (max_workers > 1 and len(pending) > 1 and method in parallel_methods
+            and sum(len(load_profiles[i]) for i in pending) >= parallel_samples):
+        computed = hbess_batch.run_profiles({i: load_profiles[i] for i in pending}, inputs, max_workers,
+                                            lambda fraction, text: progress(fraction / 2, f'Load sharing: {text}'))
+    runs, recomputed = [], []
+    for i, load_profile in enumerate(load_profiles):
+        values, stages = hbess_pipeline.run_pipeline(hbess_pipeline.profile_stages, dict(inputs, load_profile=load_profile), cache,
+                                                     lambda fraction, text: progress((i + fraction) / (2 * n), label(i, text)),
+                                                     computed=computed.get(i), keys=keys[i])
+        runs.append(values)
+        recomputed += [stage for stage in stages if stage not in recomputed]
+
+    # Required energy of both packs for every profile (Wh, one row per profile): both packs are integrated at once
+    E_req = np.array([hbess_tables.get_required_energy(values['charging'][['P_HE', 'P_HP']].to_numpy().T, values['charging']['t'].to_numpy())
+                      for values in runs]).reshape(n, 2)
+    # Strategies planned for given pack energies (the C-rates of Optimal): their packs are at least that large
+    for i, values in enumerate(runs):
+        if values['sharing'][2] is not None:
+            E_req[i] = np.maximum(E_req[i], np.array(values['sharing'][2]) * DoD / 100)
+    drivers = E_req.argmax(axis=0)
+    packs = {}
+    for j, (pack, cell) in enumerate((('HE', cell_HE), ('HP', cell_HP))):
+        S, P, N, C, E, V = hbess_tables.calculate_packs_array(E_req[:, j], cell, V_ref, DoD)
+        packs[pack] = (S, P[drivers[j]].item(), N[drivers[j]].item(), C[drivers[j]].item(), E[drivers[j]].item(), V)
+
+    envelope = {'profiles': [], 'driver_HE': drivers[0].item(), 'driver_HP': drivers[1].item(), 'tolerance': inputs['tolerance']}
+    for pack in ('HE', 'HP'):
+        envelope.update(zip([f'{key}_{pack}' for key in 'SPNCEV'], packs[pack]))
+    envelope.update({'C_tot': envelope['C_HE'] + envelope['C_HP'], 'E_tot': envelope['E_HE'] + envelope['E_HP']})
+
+    # Simulation of every profile with the common packs
+    simulation = hbess_pipeline.circuit_stages if model == 'rint' else hbess_pipeline.simulation_stages
+    stages = OrderedDict(list(hbess_pipeline.profile_stages.items()) + list(simulation.items()))
+    for i, load_profile in enumerate(load_profiles):
+        values, simulated = hbess_pipeline.run_pipeline(stages, dict(inputs, load_profile=load_profile, packs_HE=packs['HE'], packs_HP=packs['HP']), cache,
+                                                        lambda fraction, text: progress((n + i + fraction) / (2 * n), label(i, text)))
+        recomputed += [stage for stage in simulated if stage not in recomputed]
+
+        if model == 'rint':
+            values['soc'], values['voltage'], values['current'], infeasible = values['circuit']
+        else:
+            infeasible = {'HE': 0, 'HP': 0}
+
+        # The profile metrics are those of the original (not compressed) profile
+        P = load_profile['P'].to_numpy()
+        envelope['profiles'].append({
+            'P_max': P.max() / 1000, 'P_mean': P.mean() / 1000, #kW
+            'E_req': np.trapz(P, load_profile['t'].to_numpy()) / 3600000, #Ws to kWh
+            'E_req_HE': E_req[i, 0] / 1000, 'E_req_HP': E_req[i, 1] / 1000, #kWh (with EMS and charging)
+            'samples': len(values['profile']),
+            'infeasible_HE': infeasible['HE'], 'infeasible_HP': infeasible['HP'], #time steps above the maximum power of the pack
+            'load_profile': values['charging'], 'df_cost': values['sharing'][1], 'df_E_cum': values['energy'],
+            'E_min': values['sharing'][2], #Wh (the pack energies planned by the strategy, or None)
+            'discharge': hbess_result.head(values['charging'], len(values['sharing'][0])), #views of load_profile, without the charging
+            'df_SOC': values['soc'], 'df_V': values['voltage'], 'df_I': values['current'],
+            'arrays': hbess_result.struct(values['energy'], values['soc'], values['voltage'], values['current']), #the frames above, as arrays
+        })
+
+    # Capacity fade over the lifetime, for the profile that cycles each pack the most (N_year duty cycles per year)
+    lifetimes = {}
+    for j, (pack, cell) in enumerate((('HE', cell_HE), ('HP', cell_HP))):
+        EFC = max(hbess_lifetime.equivalent_cycles(*hbess_lifetime.rainflow(profile['df_SOC'][f'SOC_{pack}'])) for profile in envelope['profiles'])
+        lifetimes[pack] = hbess_lifetime.simulate_lifetime(EFC, E_req[drivers[j], j], cell, envelope[f'S_{pack}'], envelope[f'P_{pack}'], DoD, N_year, lifetime)
+
+        # Pack that still meets the requirement at the end of life (None: more than 10 times the strings would be needed)
+        P_eol = lifetimes[pack]['P_eol']
+        envelope.update({f'EFC_{pack}': EFC, f'SOH_{pack}_eol': 100 * lifetimes[pack]['SOH'][-1], f'year_{pack}_fail': lifetimes[pack]['year_fail'],
+                         f'P_{pack}_eol': P_eol, f'N_{pack}_eol': None if P_eol is None else envelope[f'S_{pack}'] * P_eol,
+                         f'C_{pack}_eol': None if P_eol is None else envelope[f'S_{pack}'] * P_eol * cell.cost})
+    envelope['C_tot_eol'] = None if None in (envelope['C_HE_eol'], envelope['C_HP_eol']) else envelope['C_HE_eol'] + envelope['C_HP_eol']
+    envelope['df_SOH'] = hbess_lifetime.lifetime_table(lifetimes)
+
+    envelope['recomputed'] = recomputed
+    progress(1.0, 'Done')
+    return envelope
+
+
+def run_schedule(result, cell_HE, cell_HP, SOC_0, P_chrg, n_cycles, period=None, efficiency=1.0):
+    # Repeats the sized duty cycle of a run_sizing result (or of a profile of run_sizing_envelope, with the envelope's packs)
+    # n_cycles times (see hbess_schedule.simulate_schedule)
+    # period in hours (None: the discharge plus a full recharge)
+    return hbess_schedule.simulate_schedule(result['discharge'], cell_HE, cell_HP, result['S_HE'], result['E_HE'], result['S_HP'], result['E_HP'],
+                                            SOC_0, P_chrg, n_cycles, None if period is None else period * 3600, efficiency)
+
+
+def run_sweep(result, cell_HE, cell_HP, V_ref, DoD, SOC_0):
+    # Packs, cost, energy and voltage range over the grid of target voltages, DoD and initial SoC (arrays), for the
+    # load sharing of a run_sizing result or of all profiles of a run_sizing_envelope result (see hbess_sweep).
+    # The sharing is kept: strategies that optimise it for V_ref and DoD (e.g. Cost: Split) are not rerun per grid point.
+    profiles = result['profiles'] if 'profiles' in result else [result]
+    energies = {}
+    for pack in ('HE', 'HP'):
+        E_cum = [profile['df_E_cum'][f'E_{pack}_cum'].to_numpy() for profile in profiles] #kWh
+        energies[pack] = (1000 * max(profile[f'E_req_{pack}'] for profile in profiles), #Wh
+                          min(E.min() for E in E_cum), max(E.max() for E in E_cum))
+    return hbess_sweep.sweep_grid(energies, cell_HE, cell_HP, V_ref, DoD, SOC_0)
+
+
+def run_montecarlo(result, cell_HE, cell_HP, method, V_ref, DoD, factor, n_samples=10000, scale=0.1, noise=0.05, warp=0.1,
+                   cost=0.1, capacity=0.05, seed=None):
+    # Monte Carlo sizing around a run_sizing result (or a profile of run_sizing_envelope, with the envelope's packs):
+    # perturbed copies of its shared load profile, and sampled cell costs and capacities (see hbess_montecarlo)
+    limit = None
+    if method in ('Cost: Limit', 'Cost: Limit (exact)') and result['df_cost'] is not None:
+        limit = result['df_cost'].loc[result['df_cost']['cost'].idxmin(), 'factor'] #W
+    return hbess_montecarlo.monte_carlo(result['discharge'], cell_HE, cell_HP, method, V_ref, DoD, factor,
+                                        {'HE': result['P_HE'], 'HP': result['P_HP']}, n_samples, scale, noise, warp, cost, capacity, limit, seed,
+                                        result.get('E_min'))
+
+
+def summarise(result):
+    # Scalar results only (no DataFrames), e.g. for tables or JSON output
+    summary = {key: value for key, value in result.items() if (np.isscalar(value) and not isinstance(value, str)) or value is None}
+    summary.update({
+        'V_HE_min': result['df_V']['V_HE'].min(), 'V_HE_max': result['df_V']['V_HE'].max(),
+        'V_HP_min': result['df_V']['V_HP'].min(), 'V_HP_max': result['df_V']['V_HP'].max(),
+        'I_HE_max': result['df_I']['I_HE'].max(), 'I_HP_max': result['df_I']['I_HP'].max(),
+        'P_HE_peak': result['load_profile']['P_HE'].max() / 1000, 'P_HP_peak': result['load_profile']['P_HP'].max() / 1000, #kW
+    })
+    return {key: value.item() if isinstance(value, np.generic) else value for key, value in summary.items()}
+
+
+def summarise_envelope(envelope, names=None):
+    # Scalar results of run_sizing_envelope: the packs, the profiles that set them, and a summary per profile
+    names = names or [f'Load profile {i + 1}' for i in range(len(envelope['profiles']))]
+    summary = {key: value for key, value in envelope.items() if (np.isscalar(value) and not isinstance(value, str)) or value is None}
+    summary.update({'driver_HE': names[envelope['driver_HE']], 'driver_HP': names[envelope['driver_HP']]})
+    summary['profiles'] = {name: summarise(dict(profile)) for name, profile in zip(names, envelope['profiles'])}
+    return {key: value.item() if isinstance(value, np.generic) else value for key, value in summary.items()}
@@ -0,0 +1,116 @@
+import math
+import numpy as np
+import pandas as pd
+
+# Multi-year degradation of the packs. The cycles in the simulated SoC trace of one duty cycle are counted (rainflow
+# counting) and converted to equivalent full cycles; the capacity fade then follows from the SOH curve of the cell.
+# As a pack fades, the same duty cycle discharges it deeper, so the fade is integrated in steps (vectorised over pack sizes).
+
+
+def turning_points(x):
+    # Local minima and maxima of a series (without plateaus and non-finite values), including the first and last sample
+    x = np.asarray(x, dtype=float)
+    x = x[np.isfinite(x)]
+    if len(x) < 2:
+        return x
+    x = x[np.concatenate(([True], np.diff(x) != 0))]
+    if len(x) < 3:
+        return x
+    slope = np.sign(np.diff(x))
+    return x[np.concatenate(([True], slope[1:] != slope[:-1], [True]))]
+
+
+def rainflow(x, periodic=True):
+    # Rainflow counting (ASTM E1049, three-point method): returns the ranges and their counts (1 full cycle or 0.5 half cycle)
+    # periodic: the series is one period of a repeating duty cycle, so it is restarted at its maximum and closed,
+    # and the counts add up to whole cycles
+    points = turning_points(x)
+    if periodic and len(points) > 2:
+        i = points.argmax()
+        points = turning_points(np.concatenate((points[i:], points[1:i+1] if points[0] == points[-1] else points[:i+1])))
+
+    stack, ranges, counts = [], [], []
+    for point in points:
+        stack.append(point)
+        while len(stack) >= 3:
+            X, Y = abs(stack[-1] - stack[-2]), abs(stack[-2] - stack[-3])
+            if X < Y:
+                break
+            ranges.append(Y)
+            if len(stack) == 3:
+                counts.append(0.5)
+                del stack[0]
+            else:
+                counts.append(1.0)
+                del stack[-3:-1]
+
+    residue = np.abs(np.diff(stack))
+    return np.concatenate((ranges, residue)), np.concatenate((counts, np.full(len(residue), 0.5)))
+
+
+def equivalent_cycles(ranges, counts, exponent=1.0):
+    # Equivalent full cycles of the counted cycles (ranges in %): a cycle with a depth d (0 to 1) counts as d^exponent
+    return float(np.sum(np.asarray(counts) * (np.asarray(ranges) / 100) ** exponent))
+
+
+def soh_at(cell, cycles):
+    # SOH after a number of equivalent full cycles; beyond the last point of the curve, its last slope is extended
+    cycles = np.asarray(cycles, dtype=float)
+    if len(cell.SOH_N) < 2 or cell.SOH_N[-1] <= cell.SOH_N[0]:
+        return np.ones_like(cycles) #no ageing data (e.g. the placeholder cell)
+    SOH = np.interp(cycles, cell.SOH_N, cell.SOH)
+    slope = (cell.SOH[-1] - cell.SOH[-2]) / (cell.SOH_N[-1] - cell.SOH_N[-2])
+    SOH = np.where(cycles > cell.SOH_N[-1], cell.SOH[-1] + slope * (cycles - cell.SOH_N[-1]), SOH)
+    return np.clip(SOH, 0, 1)
+
+
+def fade(EFC, cell, N_year, lifetime, exponent=1.0, steps=12):
+    # SOH and equivalent full cycles at the end of every year (0 to lifetime), for an array of packs
+    # EFC: equivalent full cycles of one duty cycle of every pack, at its initial capacity
+    EFC = np.atleast_1d(np.asarray(EFC, dtype=float))
+    SOH, cycles = soh_at(cell, np.zeros_like(EFC)), np.zeros_like(EFC)
+    SOH_year, cycles_year = [SOH], [cycles]
+
+    for step in range(lifetime * steps):
+        cycles = cycles + N_year / steps * EFC / np.maximum(SOH, 1e-3) ** exponent #deeper cycles in a faded pack
+        SOH = soh_at(cell, cycles)
+        if (step + 1) % steps == 0:
+            SOH_year.append(SOH)
+            cycles_year.append(cycles)
+
+    return np.array(SOH_year).T, np.array(cycles_year).T
+
+
+def simulate_lifetime(EFC, E_req, cell, S, P, DoD, N_year, lifetime, exponent=1.0, max_factor=10):
+    # EFC: equivalent full cycles of one duty cycle of the pack (S cells in series, P strings); E_req: energy (Wh) the pack
+    # must deliver per duty cycle within the DoD. Returns the SOH per year, the first year in which the pack can't deliver
+    # E_req any more (None if never), and the smallest number of strings that still can at the end of life (None if
+    # more than max_factor x P strings would be needed).
+    if P == 0 or E_req <= 0:
+        return {'EFC': 0.0, 'SOH': np.ones(lifetime + 1), 'cycles': np.zeros(lifetime + 1), 'year_fail': None, 'P_eol': P}
+
+    # Candidate packs of P to P_max strings: a pack with p strings cycles P/p as deep
+    P_max = P
+    while True:
+        P_max = min(max(P_max + 1, math.ceil(2 * P_max)), max_factor * P)
+        strings = np.arange(P, P_max + 1)
+        SOH, cycles = fade(EFC * (P / strings) ** exponent, cell, N_year, lifetime, exponent)
+        feasible = S * strings[:, None] * cell.energy * DoD / 100 * SOH >= E_req #(pack, year)
+        if feasible[:, -1].any() or P_max >= max_factor * P:
+            break
+
+    failed = np.flatnonzero(~feasible[0])
+    return {'EFC': EFC, 'SOH': SOH[0], 'cycles': cycles[0],
+            'year_fail': int(failed[0]) if len(failed) else None,
+            'P_eol': int(strings[feasible[:, -1].argmax()]) if feasible[:, -1].any() else None}
+
+
+def lifetime_table(results):
+    # {'HE': simulate_lifetime(...), 'HP': ...} -> DataFrame with the SOH (%) and cycles of every pack per year
+    years = len(next(iter(results.values()))['SOH'])
+    df_SOH = pd.DataFrame({'year': np.arange(years)})
+    for pack, result in results.items():
+        df_SOH[f'SOH_{pack}'] = 100 * result['SOH']
+    for pack, result in results.items():
+        df_SOH[f'cycles_{pack}'] = result['cycles']
+    return df_SOH
@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+from . import hbess_ems
+from . import hbess_online
+
+# Monte Carlo sizing under uncertainty: thousands of perturbed copies of a shared load profile (power scaling, noise and
+# time-warping) and of the cell cost and capacity. The copies are rows of 2-D arrays (sample, time step), evaluated in
+# chunks of rows: the sharing, the energy integrals and the pack sizing are array operations, never a loop over samples
+# (the online controllers loop over the time steps, for all the rows at once).
+
+chunk_elements = 2**21  #samples x time steps per chunk (about 16 MB per float64 array)
+
+percentiles = (5, 25, 50, 75, 95)
+
+
+def perturb_profiles(t, P, n, rng, scale=0.1, noise=0.05, warp=0.1, knots=8, P_HE=None):
+    # n perturbed copies of a load profile, as (n, len(t)) arrays of times (s) and powers (W); relative standard deviations:
+    # scale: of a power factor per copy, noise: of white noise per sample (of the peak power), warp: of the local time
+    # stretch (a smooth rate, linear between knots spread over the profile)
+    # P_HE: the nominal HE power, perturbed along with the load (None: not returned), see perturb_sharing
+    m = len(t)
+    factor = rng.normal(1, scale, (n, 1))
+    white = rng.normal(0, noise * np.abs(P).max(), (n, m))
+    P_rows = P[None, :] * factor + white
+
+    # Time-warping: every interval is stretched by the rate at its midpoint (at least 0.1, so time keeps increasing)
+    dt = np.diff(t)
+    duration = t[-1] - t[0]
+    u = ((t[1:] + t[:-1]) / 2 - t[0]) / duration * (knots - 1) if duration > 0 else np.zeros(m - 1)
+    i = np.minimum(u.astype(int), knots - 2)
+    rates = np.maximum(rng.normal(1, warp, (n, knots)), 0.1)
+    rate = rates[:, i] * (1 - (u - i)) + rates[:, i + 1] * (u - i)
+    t_rows = t[0] + np.concatenate((np.zeros((n, 1)), np.cumsum(dt * rate, axis=1)), axis=1)
+    return t_rows, P_rows, None if P_HE is None else perturb_sharing(P, P_HE, factor, white)
+
+
+def perturb_sharing(P, P_HE, factor, white):
+    # HE power of the copies of a sharing that is not recalculated per copy: the nominal HE power times the power factor
+    # of the copy, plus the part of the noise of the HE share of the power at that sample, |P_HE| / (|P_HE| + |P_HP|).
+    # The share is in [0, 1] (0.5 if neither pack has power), so a sample near a zero crossing of the load does not
+    # amplify the noise, and the HE power of a sample without load (e.g. recharging the HE pack from the HP pack) is kept
+    P_HP = P - P_HE
+    weight = np.abs(P_HE) + np.abs(P_HP)
+    share = np.divide(np.abs(P_HE), weight, out=np.full(len(P), 0.5), where=weight > 0)
+    return P_HE[None, :] * factor + share * white
+
+
+def share_rows(t_rows, P_rows, method, factor=None, P_HE_rows=None, limit=None):
+    # HE and HP power of every copy: Split, Power, Cost (split_none) and the online controllers are applied to every row;
+    # a power limit (Cost: Limit) is kept at the nominal limit; any other strategy (e.g. an optimisation over the whole
+    # profile) keeps the nominal sharing, perturbed as the load (P_HE_rows, see perturb_sharing)
+    if method == 'Cost':
+        return hbess_ems.none_factors[0] * P_rows, hbess_ems.none_factors[1] * P_rows
+    if method == 'Split':
+        P_HE = (factor / 100) * P_rows
+    elif method == 'Power':
+        peak = P_rows.max(axis=1, keepdims=True)
+        factor_HP = np.divide(P_rows, peak, out=np.zeros_like(P_rows), where=peak != 0)
+        P_HE = (1 - factor_HP) * P_rows
+    elif method.startswith('Online: '):
+        P_HE = hbess_online.online_rows(t_rows, P_rows, *hbess_ems.online_controller(method, factor))
+    elif limit is not None:
+        P_HE = np.minimum(P_rows, limit)
+    else:
+        P_HE = P_HE_rows
+    return P_HE, P_rows - P_HE
+
+
+def required_energy_rows(t_rows, P_rows):
+    # get_required_energy of every row (Wh): the maximum of the cumulative trapezoidal energy, from 0
+    E_cum = np.cumsum(np.diff(t_rows, axis=1) * (P_rows[:, 1:] + P_rows[:, :-1]) / 2, axis=1)
+    return np.maximum(E_cum.max(axis=1, initial=0), 0) / 3600
+
+
+def size_rows(E_req, cell, V_ref, DoD, capacity_factor, cost_factor):
+    # calculate_packs for every row, with a sampled capacity and cost of the cell (factors of the nominal values)
+    N_min = (E_req / (cell.energy * capacity_factor)) / (DoD / 100)
+    S = round(V_ref / cell.voltage) #string length (series)
+    P = np.ceil(N_min / S).astype(int) #number of strings (parallel)
+    N = S * P
+    return P, N, N * cell.cost * cost_factor
+
+
+def monte_carlo(discharge, cell_HE, cell_HP, method, V_ref, DoD, factor, design, n_samples=10000, scale=0.1, noise=0.05,
+                warp=0.1, cost=0.1, capacity=0.05, limit=None, seed=None, E_min=None):
+    # discharge: the shared load profile ('t', 'P', 'P_HE', 'P_HP'); design: the nominal number of strings {'HE': P, 'HP': P}
+    # cost, capacity: relative standard deviations of the cell cost and capacity (independent per cell type and copy)
+    # E_min: (HE, HP) pack energies (Wh) planned by the nominal sharing (Optimal): every copy is sized at least as the nominal packs
+    # Returns one row per copy (df_samples), the percentiles of the packs and costs (df_percentiles), and the probability
+    # that the nominal packs are too small
+    rng = np.random.default_rng(seed)
+    t = discharge['t'].to_numpy(dtype=float)
+    P = discharge['P'].to_numpy(dtype=float)
+    P_HE_nominal = discharge['P_HE'].to_numpy(dtype=float)
+
+    columns = {key: np.empty(n_samples) for key in ('E_req_HE', 'E_req_HP', 'C_HE', 'C_HP')}
+    columns.update({key: np.empty(n_samples, dtype=int) for key in ('P_HE', 'P_HP', 'N_HE', 'N_HP')})
+    factors = {f'{kind}_{pack}': np.maximum(rng.normal(1, sigma, n_samples), 0.1)
+               for kind, sigma in (('capacity', capacity), ('cost', cost)) for pack in ('HE', 'HP')}
+
+    rows = max(1, chunk_elements // max(len(t), 1))
+    for start in range(0, n_samples, rows):
+        block = slice(start, min(start + rows, n_samples))
+        t_rows, P_rows, P_HE_rows = perturb_profiles(t, P, block.stop - block.start, rng, scale, noise, warp, P_HE=P_HE_nominal)
+        P_HE, P_HP = share_rows(t_rows, P_rows, method, factor, P_HE_rows, limit)
+        for pack, power, cell in (('HE', P_HE, cell_HE), ('HP', P_HP, cell_HP)):
+            columns[f'E_req_{pack}'][block] = required_energy_rows(t_rows, power)
+            if E_min is not None:
+                columns[f'E_req_{pack}'][block] = np.maximum(columns[f'E_req_{pack}'][block], E_min[('HE', 'HP').index(pack)] * DoD / 100)
+            columns[f'P_{pack}'][block], columns[f'N_{pack}'][block], columns[f'C_{pack}'][block] = size_rows(
+                columns[f'E_req_{pack}'][block], cell, V_ref, DoD, factors[f'capacity_{pack}'][block], factors[f'cost_{pack}'][block])
+
+    for pack in ('HE', 'HP'):
+        columns[f'E_req_{pack}'] /= 1000 #Wh to kWh
+    df_samples = pd.DataFrame({**columns, **factors})
+    df_samples['C_tot'] = df_samples['C_HE'] + df_samples['C_HP']
+    df_samples['undersized_HE'] = df_samples['P_HE'] > design['HE']
+    df_samples['undersized_HP'] = df_samples['P_HP'] > design['HP']
+
+    quantity = ['E_req_HE', 'E_req_HP', 'N_HE', 'N_HP', 'C_HE', 'C_HP', 'C_tot']
+    df_percentiles = pd.DataFrame(np.percentile(df_samples[quantity].to_numpy(dtype=float), percentiles, axis=0), columns=quantity)
+    df_percentiles.insert(0, 'percentile', percentiles)
+
+    return {'df_samples': df_samples, 'df_percentiles': df_percentiles,
+            'undersized_HE': df_samples['undersized_HE'].mean(), 'undersized_HP': df_samples['undersized_HP'].mean(),
+            'undersized': (df_samples['undersized_HE'] | df_samples['undersized_HP']).mean()}
@@ -0,0 +1,164 @@
+import math
+import numpy as np
+import scipy  #scipy.signal is imported by the first Low-pass batch
+
+# Online (causal) energy management: the controller a vessel runs on its power measurements, instead of the offline
+# strategies of hbess_ems that look at the whole profile. Samples arrive one at a time or in small batches; every
+# controller keeps a fixed-size state between batches (a running peak, the filter output or the last HE power), so the
+# memory and the cost per sample do not depend on the length of the stream. Batching does not change the result.
+
+controllers = ('Peak', 'Low-pass', 'Rate limit')
+
+# Parameter of each controller when none is given (as in the app): time constant (s), HE ramp rate (kW/s)
+default_parameters = {'Peak': None, 'Low-pass': 60.0, 'Rate limit': 10.0}
+
+batch_rows = 1000
+
+
+def controller_state(controller, parameter=None):
+    # Initial state of a controller. parameter: the time constant (s) of 'Low-pass', the HE ramp rate (W/s) of 'Rate limit'
+    if controller not in controllers:
+        raise ValueError(f'Unknown online controller: {controller}')
+    if controller != 'Peak' and (parameter is None or parameter < 0):
+        raise ValueError(f'The {controller} controller needs a parameter of at least 0')
+    return {'controller': controller, 'parameter': parameter, 'peak': 0.0, 't': None, 'P_HE': None}
+
+
+def step_peak(state, t, P):
+    # Causal power_sharing: the HP share is the power relative to the highest power so far
+    peak = np.maximum(np.maximum.accumulate(P), state['peak'])
+    state['peak'] = float(peak[-1])
+    factor_HP = np.divide(P, peak, out=np.zeros(len(P)), where=peak > 0)
+    return (1 - factor_HP) * P
+
+
+def step_lowpass(state, t, P):
+    # The HE pack takes the low-pass filtered power (first order, time constant tau), the HP pack the fast remainder
+    tau, y, t_prev = state['parameter'], state['P_HE'], state['t']
+    if tau == 0:
+        return P.copy()
+    start = 0 if t[0] > t_prev else 1  #the first sample of the stream (no time step before it) keeps the initial HE power
+    dt = np.diff(t[start:], prepend=t_prev)
+
+    if len(dt) > 1 and np.ptp(dt) <= 1e-9 * dt.max():
+        # Constant sample rate (telemetry): one call to lfilter, continued from the previous batch by its state zi
+        a = math.exp(-dt[0] / tau)
+        P_HE, _ = scipy.signal.lfilter([1 - a], [1, -a], P[start:], zi=[a * y])
+        return np.concatenate((np.full(start, y), P_HE))
+
+    # Irregular time steps: the exact decay per step, sample by sample
+    P_HE = np.empty(len(P))
+    P_HE[:start] = y
+    for k, (step, power) in enumerate(zip(dt.tolist(), P[start:].tolist()), start):
+        a = math.exp(-step / tau)
+        y = a * y + (1 - a) * power
+        P_HE[k] = y
+    return P_HE
+
+
+def step_rate(state, t, P):
+    # The HE power follows the load, but changes by at most rate x dt per time step; the HP pack covers the difference
+    rate, y, t_prev = state['parameter'], state['P_HE'], state['t']
+    P_HE = np.empty(len(P))
+    for k, (time, power) in enumerate(zip(t.tolist(), P.tolist())):
+        change = rate * (time - t_prev)
+        y = min(max(power, y - change), y + change)
+        t_prev = time
+        P_HE[k] = y
+    return P_HE
+
+
+steps = {'Peak': step_peak, 'Low-pass': step_lowpass, 'Rate limit': step_rate}
+
+
+def controller_step(state, t, P):
+    # HE power (W) for the next samples t (s) and P (W): a scalar or a batch. Updates the state.
+    t, P = np.atleast_1d(np.asarray(t, dtype=float)), np.atleast_1d(np.asarray(P, dtype=float))
+    if len(t) == 0:
+        return np.empty(0)
+    if state['t'] is None:
+        state['t'], state['P_HE'] = t[0], P[0] #start in steady state
+    if t[0] < state['t'] or np.any(np.diff(t) < 0):
+        raise ValueError('The time of the power samples is not increasing')
+
+    P_HE = steps[state['controller']](state, t, P)
+    state['t'], state['P_HE'] = float(t[-1]), float(P_HE[-1])
+    return P_HE
+
+
+def online_rows(t_rows, P_rows, controller, parameter=None):
+    # HE power of many copies of a profile at once, as (copy, sample) arrays (e.g. the copies of hbess_montecarlo):
+    # every row is run through the controller from its first sample, as controller_step over the whole row would.
+    # The loop runs over the samples and is vectorised over the rows.
+    state = controller_state(controller, parameter)
+    if P_rows.shape[1] == 0:
+        return np.empty_like(P_rows)
+    if controller == 'Peak':
+        peak = np.maximum(np.maximum.accumulate(P_rows, axis=1), 0)
+        return (1 - np.divide(P_rows, peak, out=np.zeros_like(P_rows), where=peak > 0)) * P_rows
+    if controller == 'Low-pass' and state['parameter'] == 0:
+        return P_rows.copy()
+
+    dt = np.diff(t_rows, axis=1)
+    if np.any(dt < 0):
+        raise ValueError('The time of the power samples is not increasing')
+    P_HE = np.empty_like(P_rows)
+    P_HE[:, 0] = P_rows[:, 0] #start in steady state
+    for k in range(1, P_rows.shape[1]):
+        if controller == 'Low-pass':
+            a = np.exp(-dt[:, k - 1] / state['parameter'])
+            P_HE[:, k] = a * P_HE[:, k - 1] + (1 - a) * P_rows[:, k]
+        else:
+            change = state['parameter'] * dt[:, k - 1]
+            P_HE[:, k] = np.clip(P_rows[:, k], P_HE[:, k - 1] - change, P_HE[:, k - 1] + change)
+    return P_HE
+
+
+def online_sharing(samples, controller, parameter=None):
+    # Generator: (t, P) batches (or single samples) in, (t, P, P_HE, P_HP) batches out
+    state = controller_state(controller, parameter)
+    for t, P in samples:
+        t, P = np.atleast_1d(np.asarray(t, dtype=float)), np.atleast_1d(np.asarray(P, dtype=float))
+        P_HE = controller_step(state, t, P)
+        yield t, P, P_HE, P - P_HE
+
+
+def stream_profile(load_profile, batch=batch_rows):
+    # Replays a load profile (e.g. a memory-mapped one, see hbess_profile.open_load_npy) as (t, P) batches
+    t, P = load_profile['t'].to_numpy(), load_profile['P'].to_numpy()
+    for i in range(0, len(t), batch):
+        yield np.asarray(t[i:i+batch], dtype=float), np.asarray(P[i:i+batch], dtype=float)
+
+
+def rebatch(chunks, batch=batch_rows):
+    # Splits (t, P) chunks (e.g. hbess_profile.read_load_chunks) into batches of at most batch samples
+    for t, P in chunks:
+        for i in range(0, len(t), batch):
+            yield t[i:i+batch], P[i:i+batch]
+
+
+def online_profile(load_profile, controller, parameter=None):
+    # The online controller over a whole load profile, as the offline strategies of load_sharing
+    batches = list(online_sharing(stream_profile(load_profile), controller, parameter))
+    load_profile['P_HE'] = np.concatenate([batch[2] for batch in batches]) if batches else np.empty(0)
+    load_profile['P_HP'] = load_profile['P'] - load_profile['P_HE']
+    return load_profile
+
+
+def replay_statistics(batches):
+    # Peak powers and energies of the packs from (t, P, P_HE, P_HP) batches, carrying the last sample into the next batch
+    stats = {'samples': 0, 'P_HE_max': -np.inf, 'P_HP_max': -np.inf, 'P_HE_min': np.inf, 'P_HP_min': np.inf, 'E_HE': 0.0, 'E_HP': 0.0}
+    last = None
+    for t, P, P_HE, P_HP in batches:
+        if len(t) == 0:
+            continue
+        stats['samples'] += len(t)
+        for pack, power in (('HE', P_HE), ('HP', P_HP)):
+            stats[f'P_{pack}_max'] = max(stats[f'P_{pack}_max'], float(power.max()))
+            stats[f'P_{pack}_min'] = min(stats[f'P_{pack}_min'], float(power.min()))
+        if last is not None:
+            t, P_HE, P_HP = np.append(last[0], t), np.append(last[1], P_HE), np.append(last[2], P_HP)
+        stats['E_HE'] += float(np.sum(np.diff(t) * (P_HE[1:] + P_HE[:-1]) / 2)) / 3600 #Wh
+        stats['E_HP'] += float(np.sum(np.diff(t) * (P_HP[1:] + P_HP[:-1]) / 2)) / 3600 #Wh
+        last = (t[-1], P_HE[-1], P_HP[-1])
+    return stats
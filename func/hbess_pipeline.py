@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from . import hbess_tables
+from . import hbess_ems
+from . import hbess_profile
+from . import hbess_circuit
+from . import hbess_result
+from .hbess_cache import content_hash
+
+# The sizing pipeline as a dependency graph of stages. Every stage lists the inputs and upstream stages it
+# depends on; its cache key is built from those only, so changing an input recomputes only the stages downstream of it.
+# e.g. the initial SoC only affects 'soc' onward, the charging power only 'charging' onward.
+# The 'profile' stage optionally compresses the load profile within a tolerance (see hbess_profile.compress_profile).
+# The simulated quantities share the time axis of 'energy' and are stored in its dtype (see hbess_result).
+
+
+def stage_sharing(profile, cell_HE, cell_HP, method, V_ref, DoD, factor, SOC_0_sharing):
+    # load_sharing ignores N_year, P_chrg and lifetime, so they are not dependencies of this stage; SOC_0_sharing is
+    # SOC_0 for the strategies that use it (hbess_ems.soc_methods) and None otherwise, so SOC_0 only reruns those
+    return hbess_ems.load_sharing(profile.copy(), cell_HE, cell_HP, method, SOC_0_sharing, V_ref, None, DoD, None, None, factor)
+
+def stage_discharge_energy(sharing):
+    return hbess_tables.get_cumulative_energy(sharing[0])
+
+def stage_charging(sharing, discharge_energy, P_chrg):
+    return hbess_tables.add_charging(sharing[0], discharge_energy, P_chrg)
+
+def stage_packs(charging, sharing, cell, V_ref, DoD, column):
+    # At least the pack energies the sharing is planned for (sharing[2], e.g. the C-rates of Optimal)
+    E_min = 0 if sharing[2] is None else sharing[2][('P_HE', 'P_HP').index(column)]
+    return hbess_tables.calculate_packs(charging[column], charging['t'], cell, V_ref, DoD, E_min)
+
+def stage_soc(energy, packs_HE, packs_HP, SOC_0):
+    return hbess_tables.get_soc(energy, packs_HE[4], packs_HP[4], SOC_0)
+
+def stage_voltage(soc, cell_HE, cell_HP, packs_HE, packs_HP):
+    return hbess_tables.get_voltage(soc, cell_HE, cell_HP, packs_HE[0], packs_HP[0])
+
+def stage_circuit(charging, energy, cell_HE, cell_HP, packs_HE, packs_HP, SOC_0, dtype):
+    return hbess_circuit.simulate_circuit(charging, cell_HE, cell_HP, packs_HE, packs_HP, SOC_0, dtype, hbess_result.time_axis(energy))
+
+
+# name: (function, dependencies), in topological order
+# Per load profile: compression, load sharing and energy integration
+profile_stages = OrderedDict([
+    ('profile', (hbess_profile.compress_profile, ['load_profile', 'tolerance'])),
+    ('sharing', (stage_sharing, ['profile', 'cell_HE', 'cell_HP', 'method', 'V_ref', 'DoD', 'factor', 'SOC_0_sharing'])),
+    ('discharge_energy', (stage_discharge_energy, ['sharing'])),
+    ('charging', (stage_charging, ['sharing', 'discharge_energy', 'P_chrg'])),
+    ('energy', (hbess_tables.get_cumulative_energy, ['charging', 'dtype'])),
+])
+
+pack_stages = OrderedDict([
+    ('packs_HE', (lambda charging, sharing, cell_HE, V_ref, DoD: stage_packs(charging, sharing, cell_HE, V_ref, DoD, 'P_HE'),
+                  ['charging', 'sharing', 'cell_HE', 'V_ref', 'DoD'])),
+    ('packs_HP', (lambda charging, sharing, cell_HP, V_ref, DoD: stage_packs(charging, sharing, cell_HP, V_ref, DoD, 'P_HP'),
+                  ['charging', 'sharing', 'cell_HP', 'V_ref', 'DoD'])),
+])
+
+# Simulation of the packs: packs_HE and packs_HP are stages of sizing_stages, or inputs when the packs are sized elsewhere
+simulation_stages = OrderedDict([
+    ('soc', (stage_soc, ['energy', 'packs_HE', 'packs_HP', 'SOC_0'])),
+    ('voltage', (stage_voltage, ['soc', 'cell_HE', 'cell_HP', 'packs_HE', 'packs_HP'])),
+    ('current', (hbess_tables.get_current, ['charging', 'voltage'])),
+])
+
+# Equivalent-circuit (R-int) simulation instead of simulation_stages: (df_SOC, df_V, df_I, infeasible steps)
+circuit_stages = OrderedDict([
+    ('circuit', (stage_circuit, ['charging', 'energy', 'cell_HE', 'cell_HP', 'packs_HE', 'packs_HP', 'SOC_0', 'dtype'])),
+])
+
+sizing_stages = OrderedDict(list(profile_stages.items()) + list(pack_stages.items()) + list(simulation_stages.items()))
+
+
+def stage_keys(stages, inputs):
+    # Cache key of every stage: the hash of its name and of the keys of its dependencies (inputs are hashed once)
+    keys, input_keys = {}, {}
+    for name, (function, dependencies) in stages.items():
+        for dependency in dependencies:
+            if dependency not in stages and dependency not in input_keys:
+                input_keys[dependency] = content_hash(inputs[dependency]).hexdigest()
+        keys[name] = content_hash((name, [keys.get(dependency) or input_keys[dependency] for dependency in dependencies])).hexdigest()
+    return keys
+
+
+def is_cached(keys, cache):
+    # True if none of the stages (keys from stage_keys) would be recomputed
+    return cache is not None and all(key in cache.get(name, {}) for name, key in keys.items())
+
+
+def run_pipeline(stages, inputs, cache=None, progress=None, max_entries=8, computed=None, keys=None):
+    # cache: a dict kept by the caller between runs (e.g. in st.session_state), holding up to max_entries results per stage
+    # computed: stage results already calculated elsewhere for the same inputs (e.g. in a worker process), cached as is
+    # keys: stage_keys(stages, inputs), if the caller already has them (hashing long profiles takes time)
+    # Stage results are shared between runs: callers must not modify them in place
+    if cache is None:
+        cache = {}
+    if progress is None:
+        progress = lambda fraction, text: None
+    if computed is None:
+        computed = {}
+
+    if keys is None:
+        keys = stage_keys(stages, inputs)
+
+    values, recomputed = {}, []
+    for i, (name, (function, dependencies)) in enumerate(stages.items()):
+        stage_cache = cache.setdefault(name, OrderedDict())
+        if keys[name] in stage_cache:
+            stage_cache.move_to_end(keys[name])
+        else:
+            progress(i / len(stages), f'Calculating {name.replace("_", " ")}')
+            if name in computed:
+                stage_cache[keys[name]] = computed[name]
+            else:
+                arguments = [values[dependency] if dependency in stages else inputs[dependency] for dependency in dependencies]
+                stage_cache[keys[name]] = function(*arguments)
+            recomputed.append(name)
+            while len(stage_cache) > max_entries:
+                stage_cache.popitem(last=False)
+        values[name] = stage_cache[keys[name]]
+
+    progress(1.0, 'Done')
+    return values, recomputed
@@ -0,0 +1,172 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from . import hbess_tables
+from .hbess_tables import report
+
+# Large load profiles: chunk-by-chunk validation and statistics of the .csv file, and a binary format
+# (a pair of .npy files, '<name>.t.npy' and '<name>.P.npy') that later runs open memory-mapped, without parsing.
+
+chunk_rows = 10**6
+
+
+def read_load_chunks(file, chunksize=chunk_rows, on_error=None):
+    # Yields (t, P) arrays of at most chunksize rows, after checking the 'time (s), power (W)' header
+    reader = pd.read_csv(file, chunksize=chunksize, dtype=float)
+    for i, chunk in enumerate(reader):
+        if i == 0 and list(chunk.columns) != ['time (s)', 'power (W)']:
+            report('The uploaded file (load profile) is not in the correct format', on_error)
+            return
+        yield chunk['time (s)'].to_numpy(), chunk['power (W)'].to_numpy()
+
+
+def profile_statistics(chunks):
+    # Energy and peak statistics from (t, P) chunks, carrying the last sample of a chunk into the next one
+    n, E, E_cum_max, P_max, P_min = 0, 0.0, 0.0, -np.inf, np.inf
+    t_start = t_prev = P_prev = None
+    for t, P in chunks:
+        if len(t) == 0:
+            continue
+        if t_start is None:
+            t_start = t[0]
+        else:
+            t, P = np.append(t_prev, t), np.append(P_prev, P)
+            n -= 1
+
+        # Trapezoidal energy of every step, and the maximum of the cumulative energy (as in calculate_packs)
+        E_step = np.diff(t) * (P[1:] + P[:-1]) / 2 #Ws
+        if np.any(np.diff(t) < 0):
+            raise ValueError('The time column of the load profile is not increasing')
+        if len(E_step):
+            E_cum_max = max(E_cum_max, E + np.cumsum(E_step).max())
+            E += E_step.sum()
+
+        n += len(t)
+        P_max, P_min = max(P_max, P.max()), min(P_min, P.min())
+        t_prev, P_prev = t[-1], P[-1]
+
+    if n < 2:
+        raise ValueError('The load profile needs at least two samples')
+    return {'samples': n, 't_start': t_start, 't_end': t_prev, 'E': E / 3600, 'E_req': E_cum_max / 3600, #s, s, Wh, Wh
+            'P_max': P_max, 'P_min': P_min, 'P_mean': E / (t_prev - t_start) if t_prev > t_start else P_max} #W
+
+
+def scan_load_csv(file, chunksize=chunk_rows, on_error=None):
+    # Statistics of a load profile .csv file of any size, in constant memory
+    return profile_statistics(read_load_chunks(file, chunksize, on_error))
+
+
+def npy_paths(name):
+    # 'profile', 'profile.t.npy' or 'profile.P.npy' -> ('profile.t.npy', 'profile.P.npy')
+    for suffix in ('.t.npy', '.P.npy'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name + '.t.npy', name + '.P.npy'
+
+
+def is_npy_profile(name):
+    return isinstance(name, str) and name.endswith(('.t.npy', '.P.npy'))
+
+
+def convert_load_csv(file, name, dtype='float32', chunksize=chunk_rows, on_error=None):
+    # Converts a load profile .csv file into '<name>.t.npy' (float64 time) and '<name>.P.npy' (dtype power), chunk by chunk
+    paths = npy_paths(name)
+    raw = [path + '.part' for path in paths]
+    dtypes = [np.dtype('float64'), np.dtype(dtype)] #time keeps float64: float32 can't resolve 0.1 s steps over a month
+
+    def written(chunks):
+        with open(raw[0], 'wb') as file_t, open(raw[1], 'wb') as file_P:
+            for t, P in chunks:
+                file_t.write(t.astype(dtypes[0]).tobytes())
+                file_P.write(P.astype(dtypes[1]).tobytes())
+                yield t, P
+
+    try:
+        stats = profile_statistics(written(read_load_chunks(file, chunksize, on_error)))
+
+        # Put a .npy header in front of the raw data
+        for path, part, column_dtype in zip(paths, raw, dtypes):
+            with open(path, 'wb') as out, open(part, 'rb') as data:
+                np.lib.format.write_array_header_1_0(out, {'descr': np.lib.format.dtype_to_descr(column_dtype), 'fortran_order': False, 'shape': (stats['samples'],)})
+                shutil.copyfileobj(data, out, 16 * 2**20)
+    finally:
+        for part in raw:
+            if os.path.exists(part):
+                os.remove(part)
+
+    return stats
+
+
+def open_load_npy(name):
+    # Memory-mapped load profile: nothing is parsed or read until the data is used
+    path_t, path_P = npy_paths(name)
+    t = np.load(path_t, mmap_mode='r')
+    P = np.load(path_P, mmap_mode='r')
+    if len(t) != len(P) or len(t) < 2:
+        raise ValueError('The load profile files do not match or contain less than two samples')
+    return pd.DataFrame({'t': t, 'P': P}, copy=False)
+
+
+def scan_load_npy(name, chunksize=chunk_rows):
+    # Statistics of a binary load profile, read chunk by chunk from the memory map
+    path_t, path_P = npy_paths(name)
+    t = np.load(path_t, mmap_mode='r')
+    P = np.load(path_P, mmap_mode='r')
+    return profile_statistics((np.asarray(t[i:i+chunksize], dtype=float), np.asarray(P[i:i+chunksize], dtype=float)) for i in range(0, len(t), chunksize))
+
+
+def compress_profile(load_profile, tolerance):
+    # Piecewise-linear simplification of a load profile: keeps a subset of the samples such that, at every original sample,
+    # - the power error is at most tolerance x the peak power, and
+    # - the cumulative energy error is at most tolerance x the largest cumulative energy.
+    # The samples with the highest/lowest power and cumulative energy are always kept, so the peak power is exact and the
+    # required energy used by calculate_packs (and of every fixed split of the profile) stays within the tolerance.
+    t = load_profile['t'].to_numpy(dtype=float)
+    P = load_profile['P'].to_numpy(dtype=float)
+    n = len(t)
+    if tolerance is None or tolerance <= 0 or n < 3:
+        return load_profile.copy()
+
+    C = np.concatenate(([0], np.cumsum(np.diff(t) * (P[1:] + P[:-1]) / 2))) #Ws
+    P_tol = tolerance * max(np.abs(P).max(), 1e-12)
+    E_tol = tolerance * max(np.abs(C).max(), 1e-12)
+    forced = np.unique([0, n - 1, P.argmax(), P.argmin(), C.argmax(), C.argmin()])
+
+    def feasible(i, j, drift):
+        k = slice(i + 1, j + 1)
+        L = P[i] + (P[j] - P[i]) * (t[k] - t[i]) / (t[j] - t[i]) if t[j] > t[i] else np.full(j - i, P[i])
+        E_err = drift + (C[k] - C[i]) - (P[i] + L) / 2 * (t[k] - t[i])
+        return np.abs(L - P[k]).max() <= P_tol and np.abs(E_err).max() <= E_tol
+
+    keep, i, drift = [0], 0, 0.0
+    while i < n - 1:
+        limit = forced[np.searchsorted(forced, i, side='right')] #never skip a forced sample
+
+        # Exponential search for an infeasible end, then binary search for the furthest feasible one
+        good, step = i + 1, 1
+        while good < limit and feasible(i, min(i + 2 * step, limit), drift):
+            good, step = min(i + 2 * step, limit), 2 * step
+        bad = min(i + 2 * step, limit) if good < limit else good
+        while bad - good > 1:
+            middle = (good + bad) // 2
+            if feasible(i, middle, drift):
+                good = middle
+            else:
+                bad = middle
+
+        drift += (C[good] - C[i]) - (P[i] + P[good]) / 2 * (t[good] - t[i])
+        keep.append(good)
+        i = good
+
+    return load_profile.iloc[keep].reset_index(drop=True)
+
+
+def compression_error(load_profile, compressed):
+    # Relative peak-power and required-energy errors of a compressed profile
+    E_req = hbess_tables.get_required_energy(load_profile['P'].to_numpy(dtype=float), load_profile['t'].to_numpy(dtype=float))
+    E_req_compressed = hbess_tables.get_required_energy(compressed['P'].to_numpy(dtype=float), compressed['t'].to_numpy(dtype=float))
+    P_max = load_profile['P'].abs().max()
+    return {'samples': len(compressed), 'ratio': len(load_profile) / len(compressed),
+            'P_max_error': abs(compressed['P'].abs().max() - P_max) / P_max if P_max else 0.0,
+            'E_req_error': abs(E_req_compressed - E_req) / E_req if E_req else 0.0}
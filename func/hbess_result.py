@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+# Simulation results as a struct of arrays: one 1-D array per quantity next to a single time axis, optionally stored as
+# float32. The DataFrames of the stages (df_E_cum, df_SOC, df_V, df_I) and the charts are views of these arrays
+# (pandas copy=False): the time axis is shared by all of them instead of copied into each one.
+# The time axis itself stays float64 (float32 can't resolve 0.1 s steps over a long profile).
+
+dtypes = ('float64', 'float32')
+
+frames = ('df_E_cum', 'df_SOC', 'df_V', 'df_I')  #result frames on the simulation time axis (hours)
+
+
+def as_frame(t, dtype=None, **columns):
+    # DataFrame view of the time axis t (not copied) and the columns, cast to dtype only if needed (None: kept as they are)
+    data = {'t': np.asarray(t, dtype=float)}
+    data.update({name: np.asarray(values) if dtype is None else np.asarray(values).astype(dtype, copy=False) for name, values in columns.items()})
+    return pd.DataFrame(data, copy=False)
+
+
+def time_axis(df):
+    # The time axis of a frame built by as_frame (a view)
+    return df['t'].to_numpy()
+
+
+def storage_dtype(df, column):
+    # dtype of a stored column: derived results (e.g. the voltage from the SoC) keep the storage of their inputs
+    return df[column].to_numpy().dtype
+
+
+def head(df, n):
+    # The first n rows of a frame, as views of its columns (e.g. the discharge part of a load profile with charging)
+    return pd.DataFrame({column: df[column].to_numpy()[:n] for column in df.columns}, copy=False)
+
+
+def struct(*frames):
+    # The columns of frames that share a time axis, as one dict of arrays (views, no copies)
+    arrays = {'t': time_axis(frames[0])}
+    for df in frames:
+        if not np.shares_memory(time_axis(df), arrays['t']):
+            raise ValueError('The results do not share their time axis')
+        arrays.update({column: df[column].to_numpy() for column in df.columns if column != 't'})
+    return arrays
+
+
+def share_axis(result, keys=frames):
+    # Rebuilds the frames of a result (e.g. decoded from JSON, one time axis per frame) as views of one time axis,
+    # and adds their struct of arrays as result['arrays']
+    t = time_axis(result[keys[0]])
+    for key in keys:
+        result[key] = as_frame(t, None, **{column: result[key][column].to_numpy() for column in result[key].columns if column != 't'})
+    result['arrays'] = struct(*(result[key] for key in keys))
+    return result
+
+
+def nbytes(arrays):
+    # Memory held by a struct of arrays (every buffer counted once)
+    buffers = {}
+    for values in arrays.values():
+        base = values
+        while isinstance(base.base, np.ndarray):
+            base = base.base
+        buffers[id(base)] = base.nbytes
+    return sum(buffers.values())
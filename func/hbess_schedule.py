@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+import scipy
+from . import hbess_tables
+
+# Periodic duty schedule: the discharge profile is repeated n_cycles times, one start every period, with a charging
+# window between the end of a discharge and the next start. The profile (times and powers) is stored once; only the SoC,
+# voltage and current of all cycles are computed into preallocated (cycle, sample) arrays, so SoC drift over days or
+# weeks becomes visible.
+
+
+def simulate_schedule(discharge, cell_HE, cell_HP, S_HE, E_HE, S_HP, E_HP, SOC_0, P_chrg, n_cycles, period=None, efficiency=1.0):
+    # discharge: the shared load profile ('t', 'P', 'P_HE', 'P_HP', without charging), E_HE and E_HP: pack energies (kWh)
+    # Every charging window charges at P_chrg (kW, split between the packs as in add_charging) until the packs are back
+    # at SOC_0 or the next cycle starts; efficiency is the fraction of the charging energy that is stored.
+    # period: time between the starts of two cycles (s), by default the discharge plus a full (lossless) recharge
+    t = discharge['t'].to_numpy(dtype=float)
+    P = {column: discharge[column].to_numpy(dtype=float) for column in ('P', 'P_HE', 'P_HP')}
+    t_h = t / 3600 #s to h
+    E_cum = {pack: scipy.integrate.cumtrapz(P[f'P_{pack}'], t_h, initial=0) / 1000 for pack in ('HE', 'HP')} #kWh
+    E_tot = E_cum['HE'][-1] + E_cum['HP'][-1]
+    share = {pack: E_cum[pack][-1] / E_tot if E_tot > 0 else 0.5 for pack in ('HE', 'HP')} #of the charging power
+    E_pack = {'HE': E_HE, 'HP': E_HP}
+
+    t_end = t[-1]
+    if period is None:
+        period = t_end + max(E_tot, 0) / float(P_chrg) * 3600
+    if period < t_end:
+        raise ValueError('The period of the schedule is shorter than the load profile')
+    window = period - t_end #s
+
+    # SoC at the start of every cycle: only this recursion is sequential (a scalar per cycle)
+    SOC_start = {pack: np.empty(n_cycles) for pack in ('HE', 'HP')}
+    t_chrg = np.empty(n_cycles)
+    SOC = {pack: float(SOC_0) for pack in ('HE', 'HP')}
+    for cycle in range(n_cycles):
+        t_full = 0.0
+        SOC_end = {}
+        for pack in ('HE', 'HP'):
+            SOC_start[pack][cycle] = SOC[pack]
+            SOC_end[pack] = SOC[pack] - 100 * E_cum[pack][-1] / E_pack[pack] if E_pack[pack] > 0 else SOC[pack]
+            P_pack = share[pack] * float(P_chrg) * efficiency #kW stored
+            if SOC_end[pack] < SOC_0 and P_pack > 0:
+                t_full = max(t_full, (SOC_0 - SOC_end[pack]) / 100 * E_pack[pack] / P_pack * 3600) #s
+        t_chrg[cycle] = min(t_full, window)
+        for pack in ('HE', 'HP'):
+            charged = 100 * share[pack] * float(P_chrg) * efficiency * t_chrg[cycle] / 3600 / E_pack[pack] if E_pack[pack] > 0 else 0.0
+            SOC[pack] = min(SOC_0, SOC_end[pack] + charged) if SOC_end[pack] < SOC_0 else SOC_end[pack]
+
+    # The SoC, voltage and current of every cycle are (cycle, sample) arrays: the discharge samples, then the end of the
+    # discharge and of the charging. The power of a sample is the same in every cycle (a single row), as is its time
+    # relative to the start of the cycle (except the end of the charging), so neither is repeated per cycle.
+    n = len(t)
+    shape = (n_cycles, n + 2)
+    arrays = {name: np.empty(shape) for name in ('SOC_HE', 'SOC_HP', 'V_HE', 'V_HP', 'I_HE', 'I_HP')}
+    for pack, cell, S in (('HE', cell_HE, S_HE), ('HP', cell_HP, S_HP)):
+        SOC_pack, V_pack, I_pack = arrays[f'SOC_{pack}'], arrays[f'V_{pack}'], arrays[f'I_{pack}']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            SOC_pack[:, :n] = SOC_start[pack][:, None] - 100 * E_cum[pack] / E_pack[pack]
+        SOC_pack[:, n] = SOC_pack[:, n - 1]
+        SOC_pack[:, n + 1] = np.append(SOC_start[pack][1:], SOC[pack]) #the SoC at the start of the next cycle
+        V_pack[:] = S * hbess_tables.get_ocv(cell, SOC_pack / 100)
+        P_row = np.append(P[f'P_{pack}'], [-1000 * share[pack] * float(P_chrg)] * 2) #W
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(P_row, V_pack, out=I_pack)
+        I_pack[t_chrg == 0, n:] = 0 #no charging window
+
+    # Flat frames, as the DataFrames of the single-cycle simulation (reshaped views of the arrays, no copies).
+    # Only their time column is built per cycle: the start of the cycle plus the time of the sample
+    t_flat = np.empty(shape)
+    t_flat[:, :n + 1] = np.append(t, t_end)
+    t_flat[:, n + 1] = t_end + t_chrg
+    t_flat += period * np.arange(n_cycles)[:, None]
+    t_flat = t_flat.reshape(-1) / 3600 #s to h
+    flat = {name: array.reshape(-1) for name, array in arrays.items()}
+    df_SOC = pd.DataFrame({'t': t_flat, 'SOC_HE': flat['SOC_HE'], 'SOC_HP': flat['SOC_HP']}, copy=False)
+    df_V = pd.DataFrame({'t': t_flat, 'V_HE': flat['V_HE'], 'V_HP': flat['V_HP']}, copy=False)
+    df_I = pd.DataFrame({'t': t_flat, 'I': flat['I_HE'] + flat['I_HP'], 'I_HE': flat['I_HE'], 'I_HP': flat['I_HP']}, copy=False)
+
+    df_cycles = pd.DataFrame({'cycle': np.arange(1, n_cycles + 1), 'SOC_HE': SOC_start['HE'], 'SOC_HP': SOC_start['HP'],
+                              'SOC_HE_min': arrays['SOC_HE'].min(axis=1), 'SOC_HP_min': arrays['SOC_HP'].min(axis=1),
+                              't_chrg': t_chrg / 3600}) #h
+
+    # First cycle in which a pack runs empty (None if never)
+    empty = {pack: np.flatnonzero(df_cycles[f'SOC_{pack}_min'].to_numpy() < 0) for pack in ('HE', 'HP')}
+
+    return {'period': period, 'df_SOC': df_SOC, 'df_V': df_V, 'df_I': df_I, 'df_cycles': df_cycles,
+            'SOC_HE_end': SOC['HE'], 'SOC_HP_end': SOC['HP'],
+            'SOC_HE_min': df_cycles['SOC_HE_min'].min(), 'SOC_HP_min': df_cycles['SOC_HP_min'].min(),
+            'drift_HE': (SOC['HE'] - SOC_0) / n_cycles, 'drift_HP': (SOC['HP'] - SOC_0) / n_cycles, #% per cycle
+            'cycle_empty_HE': int(empty['HE'][0]) + 1 if len(empty['HE']) else None,
+            'cycle_empty_HP': int(empty['HP'][0]) + 1 if len(empty['HP']) else None}
@@ -0,0 +1,280 @@
+import asyncio
+import dataclasses
+import json
+import os
+import time
+import urllib.error
+import urllib.request
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from . import hbess_cell
+from . import hbess_engine
+from . import hbess_profile
+from . import hbess_result
+from .hbess_cache import content_hash
+
+# Local sizing job service, shared by the users of one deployment: a small HTTP server (localhost) on an asyncio loop.
+# Sizing requests (the run_sizing_envelope arguments, as JSON) are queued and run in a bounded process pool. A job is
+# identified by the content hash of its request and of the files it names (see request_key): identical requests share one
+# job while it runs, and finished jobs are served from a least-recently-used result cache. Clients submit a job, then
+# poll it until it is done.
+#   POST /jobs        request -> {"id": ..., "status": "queued" | "running" | "done" | "error"}
+#   GET  /jobs/<id>   -> {"id": ..., "status": ..., "result": ... (when done), "error": ... (when failed)}
+#   GET  /status      -> number of queued and running jobs and of cached results
+
+default_host = '127.0.0.1'
+default_port = 8765
+
+reasons = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+
+worker_cache = {}   #stage cache of run_sizing_envelope (inside a worker): repeated stages of different jobs are reused
+
+
+def encode(value):
+    # JSON-compatible copy of a result: DataFrames, arrays and cells are tagged, so that decode can rebuild them
+    if isinstance(value, pd.DataFrame):
+        return {'__frame__': {'columns': [str(column) for column in value.columns],
+                              'data': [encode(value[column].to_numpy()) for column in value.columns],
+                              'dtypes': [str(dtype) for dtype in value.dtypes]}}
+    if isinstance(value, hbess_cell.Cell):
+        return {'__cell__': {field.name: encode(getattr(value, field.name)) for field in dataclasses.fields(value)}}
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {str(key): encode(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [encode(item) for item in value]
+    return value
+
+
+def decode(value):
+    if isinstance(value, dict):
+        if '__frame__' in value:
+            frame = value['__frame__']
+            dtypes = frame.get('dtypes', [None] * len(frame['columns']))
+            return pd.DataFrame({column: np.asarray(data, dtype=dtype) for column, data, dtype in zip(frame['columns'], frame['data'], dtypes)},
+                                columns=frame['columns'])
+        if '__cell__' in value:
+            fields = value['__cell__']
+            return hbess_cell.Cell(**{name: np.array(item, dtype=float) if isinstance(item, list) else item for name, item in fields.items()})
+        return {key: decode(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [decode(item) for item in value]
+    return value
+
+
+def sizing_request(load_profiles, cell_HE, cell_HP, method, SOC_0, V_ref, N_year, DoD, P_chrg, lifetime, factor, tolerance=None, model='ocv', dtype=None):
+    # JSON request for a run_sizing_envelope job. Load profiles and cells are bundled names (or paths on the server),
+    # or DataFrames and Cell objects, which are sent by value
+    loads = [load if isinstance(load, str) else {'t': encode(load['t'].to_numpy(dtype=float)), 'P': encode(load['P'].to_numpy(dtype=float))}
+             for load in load_profiles]
+    cells = [cell if isinstance(cell, str) else encode(cell) for cell in (cell_HE, cell_HP)]
+    return {'loads': loads, 'cell_HE': cells[0], 'cell_HP': cells[1], 'method': method, 'SOC_0': SOC_0, 'V_ref': V_ref,
+            'N_year': N_year, 'DoD': DoD, 'P_chrg': P_chrg, 'lifetime': lifetime, 'factor': factor, 'tolerance': tolerance, 'model': model,
+            'dtype': dtype}
+
+
+def check_request(request):
+    if not isinstance(request, dict) or not request.get('loads'):
+        raise ValueError('A sizing request needs at least one load profile')
+    if request.get('method') not in hbess_engine.methods:
+        raise ValueError(f'Unknown energy management strategy: {request.get("method")}')
+    if request.get('model', 'ocv') not in hbess_engine.models:
+        raise ValueError(f'Unknown voltage model: {request.get("model")}')
+    if request.get('dtype') not in (None,) + hbess_result.dtypes:
+        raise ValueError(f'Unknown storage dtype: {request.get("dtype")}')
+    missing = [key for key in ('cell_HE', 'cell_HP', 'SOC_0', 'V_ref', 'N_year', 'DoD', 'P_chrg', 'lifetime') if key not in request]
+    if missing:
+        raise ValueError(f'Missing parameters: {", ".join(missing)}')
+
+
+def run_job(request):
+    # Worker: runs one sizing request and returns the result as JSON text (encoded here, not in the server loop)
+    loads = [hbess_engine.read_load(load) if isinstance(load, str) else pd.DataFrame({'t': np.asarray(load['t'], dtype=float), 'P': np.asarray(load['P'], dtype=float)})
+             for load in request['loads']]
+    cells = [hbess_engine.read_cell(cell) if isinstance(cell, str) else decode(cell) for cell in (request['cell_HE'], request['cell_HP'])]
+    envelope = hbess_engine.run_sizing_envelope(loads, *cells, request['method'], request['SOC_0'], request['V_ref'], request['N_year'],
+                                                request['DoD'], request['P_chrg'], request['lifetime'], request.get('factor'),
+                                                cache=worker_cache, tolerance=request.get('tolerance'), model=request.get('model', 'ocv'),
+                                                dtype=request.get('dtype'), max_workers=1) #the jobs are already spread over the workers
+    for profile in envelope['profiles']:
+        profile.pop('arrays') #views of the frames: rebuilt by the client (see wait_job)
+    return json.dumps(encode(envelope))
+
+
+def service_state(pool, workers, max_entries=64):
+    # jobs: status of the queued and running jobs; results: finished jobs, ('done', JSON text) or ('error', message)
+    return {'pool': pool, 'workers': workers, 'semaphore': asyncio.Semaphore(workers), 'jobs': {}, 'results': OrderedDict(),
+            'max_entries': max_entries, 'tasks': set()}
+
+
+def request_files(name, bundled):
+    # Files read by the service for a load profile or cell sent by name: bundled, a path, or a binary profile (two files)
+    path = os.path.join(hbess_engine.ROOT, bundled[name]) if name in bundled else name
+    return list(hbess_profile.npy_paths(path)) if hbess_profile.is_npy_profile(path) else [path]
+
+
+def request_key(request):
+    # Job id of a request: loads and cells sent by name are keyed by the size and modification time of their files too,
+    # so that a changed file is a new job instead of a stale cached result
+    names = [(load, hbess_engine.dict_load) for load in request['loads'] if isinstance(load, str)]
+    names += [(request[key], hbess_engine.dict_cell) for key in ('cell_HE', 'cell_HP') if isinstance(request[key], str)]
+    stamps = []
+    for name, bundled in names:
+        for path in request_files(name, bundled):
+            stat = os.stat(path) if os.path.isfile(path) else None
+            stamps.append((path, None if stat is None else (stat.st_size, stat.st_mtime_ns)))
+    return content_hash((request, stamps)).hexdigest()
+
+
+def submit_job(state, request):
+    check_request(request)
+    key = request_key(request)
+    if key in state['jobs']:
+        return {'id': key, 'status': state['jobs'][key]} #identical request in flight
+    if key in state['results'] and state['results'][key][0] == 'done':
+        state['results'].move_to_end(key)
+        return {'id': key, 'status': 'done'}
+
+    state['results'].pop(key, None) #a failed job is run again
+    state['jobs'][key] = 'queued'
+    task = asyncio.get_running_loop().create_task(execute_job(state, key, request))
+    state['tasks'].add(task)
+    task.add_done_callback(state['tasks'].discard)
+    return {'id': key, 'status': 'queued'}
+
+
+async def execute_job(state, key, request):
+    # At most one job per worker leaves the queue at a time, so the status tells queued and running jobs apart
+    async with state['semaphore']:
+        state['jobs'][key] = 'running'
+        try:
+            result = ('done', await asyncio.get_running_loop().run_in_executor(state['pool'], run_job, request))
+        except Exception as error:
+            result = ('error', str(error) or type(error).__name__)
+        state['results'][key] = result
+        while len(state['results']) > state['max_entries']:
+            state['results'].popitem(last=False)
+        del state['jobs'][key]
+
+
+def job_response(state, key):
+    # JSON text of the status of a job (the cached result is inserted as is)
+    if key in state['jobs']:
+        return 200, json.dumps({'id': key, 'status': state['jobs'][key]})
+    if key not in state['results']:
+        return 404, json.dumps({'id': key, 'error': 'Unknown job'})
+    state['results'].move_to_end(key)
+    status, value = state['results'][key]
+    if status == 'error':
+        return 200, json.dumps({'id': key, 'status': status, 'error': value})
+    return 200, '{"id": %s, "status": "done", "result": %s}' % (json.dumps(key), value)
+
+
+def route(state, method, path, body):
+    if path == '/jobs':
+        if method != 'POST':
+            return 405, json.dumps({'error': 'Use POST to submit a job'})
+        response = submit_job(state, json.loads(body or b'null'))
+        return 200 if response['status'] == 'done' else 202, json.dumps(response)
+    if path.startswith('/jobs/') and method == 'GET':
+        return job_response(state, path[len('/jobs/'):])
+    if path == '/status' and method == 'GET':
+        running = sum(status == 'running' for status in state['jobs'].values())
+        return 200, json.dumps({'queued': len(state['jobs']) - running, 'running': running, 'results': len(state['results']), 'workers': state['workers']})
+    return 404, json.dumps({'error': f'Unknown path: {path}'})
+
+
+async def handle_connection(state, reader, writer):
+    # One HTTP/1.1 request per connection
+    try:
+        method, path, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+        status, payload = route(state, method, path.split('?')[0], body)
+    except (ValueError, KeyError, TypeError, asyncio.IncompleteReadError) as error:
+        status, payload = 400, json.dumps({'error': str(error)})
+
+    data = payload.encode()
+    writer.write(f'HTTP/1.1 {status} {reasons[status]}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n'
+                 f'Connection: close\r\n\r\n'.encode() + data)
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(host=default_host, port=default_port, workers=None, max_entries=64, ready=None):
+    # Runs the service until cancelled; ready(server) is called once it listens
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        state = service_state(pool, workers, max_entries)
+        server = await asyncio.start_server(lambda reader, writer: handle_connection(state, reader, writer), host, port)
+        if ready is not None:
+            ready(server)
+        async with server:
+            await server.serve_forever()
+
+
+# Client (e.g. the app): submit a request, then poll it
+
+
+def request_json(url, data=None, timeout=60):
+    request = urllib.request.Request(url, data=None if data is None else json.dumps(data).encode(),
+                                     headers={'Content-Type': 'application/json'}, method='GET' if data is None else 'POST')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        raise ValueError(json.loads(error.read() or b'{}').get('error', str(error))) from None
+
+
+def poll_job(url, request, job=None):
+    # One status of the job of a sizing request (see sizing_request) on the service at url: the request is submitted if
+    # job (the id of its job) is None or no longer known to the service. Returns the response, with its 'result' decoded
+    # once the job is done; raises the error of a failed job
+    url = url.rstrip('/')
+    response = None
+    if job is not None:
+        try:
+            response = request_json(f'{url}/jobs/{job}')
+        except ValueError:
+            response = None #dropped from the result cache, or the service restarted
+    if response is None:
+        response = request_json(f'{url}/jobs', request)
+        if response['status'] == 'done':
+            response = request_json(f'{url}/jobs/{response["id"]}')
+    if response['status'] == 'error':
+        raise ValueError(response['error'])
+    if response['status'] == 'done':
+        response['result'] = decode(response['result'])
+        for profile in response['result']['profiles']:
+            hbess_result.share_axis(profile)
+    return response
+
+
+def wait_job(url, request, interval=0.2, timeout=None, progress=None):
+    # Submits a sizing request to the service at url, and polls it until it returns its (decoded) result
+    # progress(fraction, text) is told whether the job is queued or running
+    response = poll_job(url, request)
+    start = time.monotonic()
+    while response['status'] != 'done':
+        if progress is not None:
+            progress(0.1 if response['status'] == 'queued' else 0.5, f'Job {response["status"]} on the sizing service')
+        if timeout is not None and time.monotonic() - start > timeout:
+            raise TimeoutError(f'The sizing job {response["id"]} did not finish within {timeout} s')
+        time.sleep(interval)
+        response = poll_job(url, request, response['id'])
+    if progress is not None:
+        progress(1.0, 'Done')
+    return response['result']
@@ -0,0 +1,117 @@
+import functools
+import glob
+import importlib.util
+import os
+import pickle
+import re
+import subprocess
+import sys
+import pandas as pd
+from . import hbess_engine
+from . import hbess_result
+from .hbess_cache import content_hash
+
+# Cold start of the app: every new session (and every new container of the deployment) imports the app and sizes the
+# default scenario before the first page is shown.
+# - Heavy modules that only some stages need (Altair for the charts, SciPy submodules for the integrals, filters and
+#   linear programs) are imported when first used: see lazy_import, and `import scipy`, which loads its submodules lazily.
+# - The warmup command (hbess-cli.py warmup) sizes the default scenario ahead of time into .cache/, from which the app
+#   loads it. Results are keyed by the sizing arguments and the source code of func/, so a change of either is recomputed.
+# - import_times reports the import time of the app's modules (python -X importtime), to keep regressions visible.
+
+cache_dir = os.path.join(hbess_engine.ROOT, '.cache')
+
+# The default inputs of the app (same values and types as its widgets): Tug boat 1 with NMC/LTO cells
+default_scenario = {'loads': ['Tug boat 1'], 'cell_HE': 'NMC Samsung 94Ah', 'cell_HP': 'LTO Toshiba 23Ah', 'method': 'Power',
+                    'SOC_0': 90, 'V_ref': 1000, 'N_year': 365, 'DoD': 80, 'P_chrg': 2000.0, 'lifetime': 20, 'factor': None,
+                    'tolerance': 0.0, 'model': 'ocv', 'dtype': None}
+
+# Imported by hbess-app.py before its first page
+app_modules = ('streamlit', 'numpy', 'pandas', 'func.hbess_tables', 'func.hbess_visualise', 'func.hbess_ems', 'func.hbess_engine',
+               'func.hbess_service')
+
+
+def lazy_import(name):
+    # The module, executed on first attribute access (e.g. alt.Chart) instead of now
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+@functools.lru_cache(maxsize=1)
+def source_hash():
+    # Hash of the sizing code: cached results of an older version are not reused
+    return content_hash(sorted(glob.glob(os.path.join(hbess_engine.ROOT, 'func', '*.py')))).hexdigest()
+
+
+def result_key(load_profiles, cell_HE, cell_HP, method, SOC_0, V_ref, N_year, DoD, P_chrg, lifetime, factor, tolerance=None, model='ocv', dtype=None):
+    # Key of a run_sizing_envelope result (the arguments are those of run_sizing_envelope)
+    return content_hash((source_hash(), list(load_profiles), cell_HE, cell_HP, method, SOC_0, V_ref, N_year, DoD, P_chrg, lifetime,
+                         factor, tolerance, model, dtype)).hexdigest()
+
+
+def load_result(key):
+    # The stored result, or None (not warmed up, or unreadable)
+    path = os.path.join(cache_dir, f'{key}.pkl')
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, 'rb') as file:
+            envelope = pickle.load(file)
+    except (OSError, EOFError, AttributeError, ImportError, pickle.UnpicklingError):
+        return None
+    for profile in envelope['profiles']:
+        hbess_result.share_axis(profile)
+    return envelope
+
+
+def store_result(key, envelope):
+    # Written to a temporary file first, so that a session never reads a partial file
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f'{key}.pkl')
+    stored = dict(envelope, profiles=[{name: value for name, value in profile.items() if name != 'arrays'} for profile in envelope['profiles']])
+    with open(f'{path}.tmp', 'wb') as file:
+        pickle.dump(stored, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f'{path}.tmp', path)
+    return path
+
+
+def scenario_arguments(scenario):
+    # run_sizing_envelope arguments of a scenario (bundled names as in default_scenario)
+    loads = [hbess_engine.read_load(name) for name in scenario['loads']]
+    cells = [hbess_engine.read_cell(scenario[key]) for key in ('cell_HE', 'cell_HP')]
+    return (loads, *cells, *(scenario[key] for key in ('method', 'SOC_0', 'V_ref', 'N_year', 'DoD', 'P_chrg', 'lifetime', 'factor', 'tolerance', 'model', 'dtype')))
+
+
+def warmup(scenarios=(default_scenario,), progress=None):
+    # Sizes the scenarios and stores their results for the app; returns the paths of the stored results
+    paths = []
+    for scenario in scenarios:
+        arguments = scenario_arguments(scenario)
+        loads, cell_HE, cell_HP, method, SOC_0, V_ref, N_year, DoD, P_chrg, lifetime, factor, tolerance, model, dtype = arguments
+        envelope = hbess_engine.run_sizing_envelope(loads, cell_HE, cell_HP, method, SOC_0, V_ref, N_year, DoD, P_chrg, lifetime, factor,
+                                                    progress, tolerance=tolerance, model=model, dtype=dtype)
+        paths.append(store_result(result_key(*arguments), envelope))
+    return paths
+
+
+def import_times(modules=app_modules):
+    # Import time of the modules in a fresh interpreter (as a new session of the app): one row per imported module,
+    # self and cumulative time in ms; depth 0 are the modules imported directly
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {", ".join(modules)}'],
+                             cwd=hbess_engine.ROOT, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise ImportError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'Import failed')
+    rows = []
+    for line in process.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)', line)
+        if match:
+            rows.append({'module': match[4], 'self': int(match[1]) / 1000, 'cumulative': int(match[2]) / 1000,
+                         'depth': (len(match[3]) - 1) // 2})
+    return pd.DataFrame(rows, columns=['module', 'self', 'cumulative', 'depth'])
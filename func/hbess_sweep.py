@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+from . import hbess_tables
+
+# Sensitivity of the packs to the target voltage, DoD and initial SoC. calculate_packs rounds the string length
+# (S = round(V_ref / V_cell)) and the number of strings (ceil(N_min / S)), so the packs jump across the parameter space.
+# The energy integrals of the shared load profile do not depend on these parameters: they are computed once, and the
+# packs, SoC range and voltages of the whole grid follow in one broadcast computation with axes (V_ref, DoD, SOC_0).
+
+
+def sweep_pack(E_req, E_cum_min, E_cum_max, cell, V_ref, DoD, SOC_0):
+    # E_req: required energy (Wh); E_cum_min, E_cum_max: extremes of the cumulative energy of the pack (kWh)
+    # Returns calculate_packs (S, P, N, C, E, V) and the SoC and voltage range, as arrays of shape (V_ref, DoD, SOC_0)
+    # Target voltages below half the cell voltage give no string (S = 0): NaN
+    V_ref = np.asarray(V_ref, dtype=float)[:, None, None]
+    DoD = np.asarray(DoD, dtype=float)[None, :, None]
+    SOC_0 = np.asarray(SOC_0, dtype=float)[None, None, :]
+
+    # As calculate_packs_array, in the same order of operations (the same rounding)
+    N_min = (E_req / cell.energy) / (DoD / 100)
+    S = np.round(V_ref / cell.voltage)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        P = np.where(S > 0, np.ceil(N_min / S), np.nan) #number of strings (parallel)
+    N = S * P
+    C = N * cell.cost #eur
+    E = np.round(N * cell.energy / 1000, 2) #kWh
+
+    # SoC range over the profile (as get_soc) and the OCV of the pack at both ends
+    with np.errstate(divide='ignore', invalid='ignore'):
+        SOC_min = np.where(E > 0, SOC_0 - 100 * E_cum_max / E, SOC_0)
+        SOC_max = np.where(E > 0, SOC_0 - 100 * E_cum_min / E, SOC_0)
+    V_a, V_b = S * hbess_tables.get_ocv(cell, SOC_min / 100), S * hbess_tables.get_ocv(cell, SOC_max / 100)
+
+    shape = np.broadcast_shapes(V_ref.shape, DoD.shape, SOC_0.shape)
+    grid = {'S': S, 'P': P, 'N': N, 'C': C, 'E': E, 'V': S * cell.voltage, 'SOC_min': SOC_min, 'SOC_max': SOC_max,
+            'V_min': np.minimum(V_a, V_b), 'V_max': np.maximum(V_a, V_b)}
+    return {key: np.broadcast_to(value, shape) for key, value in grid.items()}
+
+
+def sweep_grid(energies, cell_HE, cell_HP, V_ref, DoD, SOC_0):
+    # energies: {'HE': (E_req, E_cum_min, E_cum_max), 'HP': ...}; returns one row per (V_ref, DoD, SOC_0)
+    grids = {pack: sweep_pack(*energies[pack], cell, V_ref, DoD, SOC_0) for pack, cell in (('HE', cell_HE), ('HP', cell_HP))}
+    axes = np.meshgrid(np.asarray(V_ref, dtype=float), np.asarray(DoD, dtype=float), np.asarray(SOC_0, dtype=float), indexing='ij')
+
+    df_sweep = pd.DataFrame({'V_ref': axes[0].ravel(), 'DoD': axes[1].ravel(), 'SOC_0': axes[2].ravel()})
+    for pack in ('HE', 'HP'):
+        for key, value in grids[pack].items():
+            df_sweep[f'{key}_{pack}'] = value.ravel()
+    df_sweep['C_tot'] = df_sweep['C_HE'] + df_sweep['C_HP']
+    df_sweep['E_tot'] = df_sweep['E_HE'] + df_sweep['E_HP']
+    df_sweep['feasible'] = (df_sweep['SOC_min_HE'] >= 0) & (df_sweep['SOC_min_HP'] >= 0) & df_sweep['C_tot'].notna()
+    return df_sweep
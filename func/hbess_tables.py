@@ -1,45 +1,40 @@
 import pandas as pd
-import ast
-import streamlit as st
 import math
+import os
+import numpy as np
 import scipy
+from .hbess_cell import parse_cell
+from . import hbess_result
 
-def read_cell_csv(file):
+def report(message, callback):
+    # Pass a message to the caller (e.g. st.error), or raise it when no callback is given
+    if callback is None:
+        raise ValueError(message)
+    callback(message)
+
+
+def read_cell_csv(file, on_error=None):
     # Read the .csv file and create a Dataframe
     df_cell = pd.read_csv(file)
 
     # Control validity of .csv file:
-    if (df_cell.shape != (12, 3) or list(df_cell.columns) != ['parameter', 'value', 'unit']):
+    # (the 13th row, the internal resistance, is optional)
+    if (df_cell.shape not in ((12, 3), (13, 3)) or list(df_cell.columns) != ['parameter', 'value', 'unit']):
         # Error handling
-        st.error('The uploaded file (battery cell) is not in the correct format', icon="⚠️")
-        df_cell = pd.read_csv('battery_cells/None.csv')
+        report('The uploaded file (battery cell) is not in the correct format', on_error)
+        df_cell = pd.read_csv(os.path.join(os.path.dirname(__file__), '..', 'battery_cells', 'None.csv'))
         #raise Exception('The uploaded file (cell information) is not in the correct format')
 
-    # Convert the string representations of the lists to Python lists
-    OCV = ast.literal_eval(df_cell.iloc[8]['value'])
-    OCV_SOC = ast.literal_eval(df_cell.iloc[9]['value'])
-    SOH = ast.literal_eval(df_cell.iloc[10]['value'])
-    SOH_N = ast.literal_eval(df_cell.iloc[11]['value'])
-
-    # Create a DataFrame containing the lists
-    df_OCV = pd.DataFrame({'OCV': OCV, 'SOC': OCV_SOC})
-    df_SOH = pd.DataFrame({'SOH': SOH, 'N': SOH_N})
-
-    # Print the Dataframes in the terminal
-    if False:
-        print(df_cell.to_string())
-        print(df_OCV.to_string())
-        print(df_SOH.to_string())
-
-    return df_cell, df_OCV, df_SOH
+    # Parse the parameters once into a typed cell (OCV and SOH curves as arrays)
+    return parse_cell(df_cell)
 
 
-def read_load_csv(file):
+def read_load_csv(file, on_error=None):
     df_load = pd.read_csv(file)
     
     # Control validity of .csv file: exactly two columns, at least two rows, and the correct headers
     if (df_load.shape[1] != 2) or (df_load.shape[0] < 2) or (list(df_load.columns) != ['time (s)', 'power (W)']):
-        st.error('The uploaded file (load profile) is not in the correct format', icon="⚠️")
+        report('The uploaded file (load profile) is not in the correct format', on_error)
         df_load = pd.DataFrame({'t': [0, 3600], 'P': [0, 0]});
     
     else:
@@ -48,94 +43,124 @@ def read_load_csv(file):
 
     return df_load
 
-def display_cell(pd_cell):
+def display_cell(cell):
     cell_formatted = pd.DataFrame({'parameter': ['Rated capacity', 'Nominal voltage', 'Power capacity', 'Maximum C-rates', 'Cost density', 'Weight density'],
-                                   'value': ['{} Ah'.format(pd_cell.iloc[2]['value']),
-                                   '{} V'.format(pd_cell.iloc[3]['value'], 2),
-                                   '{} Wh'.format(round(float(pd_cell.iloc[3]['value']) * float(pd_cell.iloc[2]['value']), 2)),
-                                   '{} / {}'.format(round(float(pd_cell.iloc[6]['value']) / float(pd_cell.iloc[2]['value']), 2), round(float(pd_cell.iloc[7]['value']) / float(pd_cell.iloc[2]['value']), 2)),
-                                   '{} €/kWh'.format(round(1000 * float(pd_cell.iloc[5]['value']) / (float(pd_cell.iloc[3]['value']) * float(pd_cell.iloc[2]['value'])), 2)),
-                                   '{} kg/kWh'.format(round(1000*float(pd_cell.iloc[4]['value']) / (float(pd_cell.iloc[3]['value']) * float(pd_cell.iloc[2]['value'])), 2))
+                                   'value': ['{:g} Ah'.format(cell.capacity),
+                                   '{:g} V'.format(cell.voltage),
+                                   '{} Wh'.format(round(cell.energy, 2)),
+                                   '{} / {}'.format(round(cell.I_dis / cell.capacity, 2), round(cell.I_chrg / cell.capacity, 2)),
+                                   '{} €/kWh'.format(round(1000 * cell.cost / cell.energy, 2)),
+                                   '{} kg/kWh'.format(round(1000 * cell.weight / cell.energy, 2))
                                 ]})
+    if cell.R > 0:
+        cell_formatted.loc[len(cell_formatted)] = ['Internal resistance', '{:g} mΩ'.format(1000 * cell.R)]
     
     return cell_formatted
 
-def compare_cells(he_cell, hp_cell):
-    if ((round(float(hp_cell.iloc[3]['value']) * float(hp_cell.iloc[2]['value']), 2)) > (round(float(he_cell.iloc[3]['value']) * float(he_cell.iloc[2]['value']), 2))):
+def compare_cells(he_cell, hp_cell, on_info=None):
+    if on_info is None:
+        on_info = lambda message: None
+
+    if round(hp_cell.energy, 2) > round(he_cell.energy, 2):
         #HP cell contains more energy than HP cell
-        st.info('The selected high power (HP) cell contains more energy than the high energy (HE) cell', icon="ℹ️")
+        on_info('The selected high power (HP) cell contains more energy than the high energy (HE) cell')
 
-    if (round(float(he_cell.iloc[6]['value']) / float(he_cell.iloc[2]['value']), 2)) > (round(float(hp_cell.iloc[6]['value']) / float(hp_cell.iloc[2]['value']), 2)):
+    if round(he_cell.I_dis / he_cell.capacity, 2) > round(hp_cell.I_dis / hp_cell.capacity, 2):
         #HE cell has a higher discharge rate
-        st.info('The selected high power (HP) cell has a lower discharge rate than the high energy (HE) cell', icon="ℹ️")
+        on_info('The selected high power (HP) cell has a lower discharge rate than the high energy (HE) cell')
 
-    if False and (round(float(he_cell.iloc[7]['value']) / float(he_cell.iloc[2]['value']), 2)) > (round(float(hp_cell.iloc[7]['value']) / float(hp_cell.iloc[2]['value']), 2)):
+    if False and round(he_cell.I_chrg / he_cell.capacity, 2) > round(hp_cell.I_chrg / hp_cell.capacity, 2):
         #HE cell has a higher charge rate
-        st.info('The selected high power (HP) cell has a lower charge rate than the high energy (HE) cell', icon="ℹ️")
+        on_info('The selected high power (HP) cell has a lower charge rate than the high energy (HE) cell')
 
     return None
 
 
-def calculate_packs(load, time, cell, V_ref, DoD):
-    E_req = scipy.integrate.cumtrapz(load.to_numpy(), time.to_numpy(), initial=0).max() / 3600 #Wh
-    E_cell = float(cell.iloc[3]['value']) * float(cell.iloc[2]['value']) #Wh
+def get_required_energy(load, time):
+    # load: one power array, or one row per pack (e.g. [P_HE, P_HP]) integrated at once
+    return scipy.integrate.cumtrapz(load, time, initial=0).max(axis=-1) / 3600 #Wh
+
+
+def calculate_packs(load, time, cell, V_ref, DoD, E_min=0):
+    # E_min: smallest pack energy (Wh), e.g. the one the load sharing is planned for (see hbess_ems.load_sharing)
+    E_req = max(get_required_energy(load.to_numpy(), time.to_numpy()), E_min * DoD / 100) #Wh
+    E_cell = cell.energy #Wh
     N_min = (E_req / E_cell) / (DoD / 100)
 
-    S = round(V_ref / float(cell.iloc[3]['value'])) #string length (series)
-    V_pack = S * float(cell.iloc[3]['value'])
+    S = round(V_ref / cell.voltage) #string length (series)
+    V_pack = S * cell.voltage
     P = math.ceil(N_min / S) #number of strings (parallel)
 
     N = S * P #total number of cells
-    C = N * float(cell.iloc[5]['value']) #eur
-    E = round(N * float(cell.iloc[3]['value']) * float(cell.iloc[2]['value']) / 1000, 2) #kWh
+    C = N * cell.cost #eur
+    E = round(N * cell.energy / 1000, 2) #kWh
     V = V_pack
 
     return S, P, N, C, E, V
 
-def get_cumulative_energy(load_profile):
-    t_h = load_profile['t'].to_numpy() / 3600 #s to h
+def calculate_packs_array(E_req, cell, V_ref, DoD):
+    # Same as calculate_packs, but for an array of required energies (Wh) at once
+    E_req = np.asarray(E_req, dtype=float)
+    E_cell = cell.energy #Wh
+    N_min = (E_req / E_cell) / (DoD / 100)
+
+    S = round(V_ref / cell.voltage) #string length (series)
+    V_pack = S * cell.voltage
+    P = np.ceil(N_min / S).astype(int) #number of strings (parallel)
+
+    N = S * P #total number of cells
+    C = N * cell.cost #eur
+    E = np.round(N * cell.energy / 1000, 2) #kWh
+    V = V_pack
+
+    return S, P, N, C, E, V
+
+def get_cumulative_energy(load_profile, dtype=None):
+    # dtype: storage of the cumulative energies (e.g. 'float32'; float64 by default), integrated in float64
+    t_h = load_profile['t'].to_numpy(dtype=float) / 3600 #s to h
     E_cum = scipy.integrate.cumtrapz(load_profile['P'].to_numpy(), t_h, initial=0) / 1000     #kWh
     E_HE_cum = scipy.integrate.cumtrapz(load_profile['P_HE'].to_numpy(), t_h, initial=0) / 1000  #kWh
     E_HP_cum = scipy.integrate.cumtrapz(load_profile['P_HP'].to_numpy(), t_h, initial=0) / 1000  #kWh
 
-    df_E_cum = pd.DataFrame({'t': t_h, 'E_cum': E_cum, 'E_HE_cum': E_HE_cum, 'E_HP_cum': E_HP_cum})
+    df_E_cum = hbess_result.as_frame(t_h, dtype or 'float64', E_cum=E_cum, E_HE_cum=E_HE_cum, E_HP_cum=E_HP_cum)
     return df_E_cum
 
 def get_soc(df_E_cum, E_HE, E_HP, SOC0):
-    df_SOC = df_E_cum.copy().drop(columns=['E_cum']).rename(columns={'E_HE_cum': 'SOC_HE', 'E_HP_cum': 'SOC_HP'})
-    df_SOC['SOC_HE'] = (SOC0) - 100*(df_SOC['SOC_HE'] / E_HE)
-    df_SOC['SOC_HP'] = (SOC0) - 100*(df_SOC['SOC_HP'] / E_HP)
+    # Views of the time axis of df_E_cum, in the storage dtype of the energies
+    dtype = hbess_result.storage_dtype(df_E_cum, 'E_HE_cum')
+    with np.errstate(divide='ignore', invalid='ignore'): #empty pack: NaN, as pandas
+        SOC_HE = (SOC0) - 100*(df_E_cum['E_HE_cum'].to_numpy() / E_HE)
+        SOC_HP = (SOC0) - 100*(df_E_cum['E_HP_cum'].to_numpy() / E_HP)
 
+    df_SOC = hbess_result.as_frame(hbess_result.time_axis(df_E_cum), dtype, SOC_HE=SOC_HE, SOC_HP=SOC_HP)
     return df_SOC
 
-def get_voltage(df_SOC, df_OCV_HE, df_OCV_HP, S_HE, S_HP):
-    #High energy pack
-    SOC = df_OCV_HE['SOC'].to_numpy()
-    OCV = df_OCV_HE['OCV'].to_numpy()
-    SOC_TO_OCV = scipy.interpolate.interp1d(SOC, OCV, kind='linear', fill_value='extrapolate') #y = f(x)
-
-    SOC = df_SOC['SOC_HE'].to_numpy() / 100
-    V_HE = S_HE * SOC_TO_OCV(SOC)
+def get_ocv(cell, SOC):
+    # Open-circuit voltage of a cell at an array of SoC values (0 to 1), linearly extrapolated beyond the OCV curve
+    SOC = np.asarray(SOC, dtype=float)
+    x, y = cell.OCV_SOC, cell.OCV
+    OCV = np.interp(SOC, x, y)
+    if x[-1] > x[0]:
+        OCV = np.where(SOC < x[0], y[0] + (SOC - x[0]) * (y[1] - y[0]) / (x[1] - x[0]), OCV)
+        OCV = np.where(SOC > x[-1], y[-1] + (SOC - x[-1]) * (y[-1] - y[-2]) / (x[-1] - x[-2]), OCV)
+    return OCV
 
-    #High power pack
-    SOC = df_OCV_HP['SOC'].to_numpy()
-    OCV = df_OCV_HP['OCV'].to_numpy()
-    SOC_TO_OCV = scipy.interpolate.interp1d(SOC, OCV, kind='linear', fill_value='extrapolate') #y = f(x)
+def get_voltage(df_SOC, cell_HE, cell_HP, S_HE, S_HP):
+    V_HE = S_HE * get_ocv(cell_HE, df_SOC['SOC_HE'].to_numpy() / 100)   #High energy pack
+    V_HP = S_HP * get_ocv(cell_HP, df_SOC['SOC_HP'].to_numpy() / 100)   #High power pack
 
-    SOC = df_SOC['SOC_HP'].to_numpy() / 100
-    V_HP = S_HP * SOC_TO_OCV(SOC)
-    
-    df_V = pd.DataFrame({'t': df_SOC['t'], 'V_HE': V_HE, 'V_HP': V_HP})
+    df_V = hbess_result.as_frame(hbess_result.time_axis(df_SOC), hbess_result.storage_dtype(df_SOC, 'SOC_HE'), V_HE=V_HE, V_HP=V_HP)
 
     return df_V
 
 def get_current(load_profile, df_V):
     #I = P / V
-    I_HE = load_profile['P_HE'] / df_V['V_HE']
-    I_HP = load_profile['P_HP'] / df_V['V_HP']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        I_HE = load_profile['P_HE'].to_numpy() / df_V['V_HE'].to_numpy()
+        I_HP = load_profile['P_HP'].to_numpy() / df_V['V_HP'].to_numpy()
     I = I_HE + I_HP
 
-    df_I = pd.DataFrame({'t': df_V['t'], 'I': I, 'I_HE': I_HE, 'I_HP': I_HP})
+    df_I = hbess_result.as_frame(hbess_result.time_axis(df_V), hbess_result.storage_dtype(df_V, 'V_HE'), I=I, I_HE=I_HE, I_HP=I_HP)
 
     return df_I
 
@@ -150,13 +175,9 @@ def add_charging(load_profile, df_E_cum, P_chrg):
     t_start = load_profile['t'].iloc[-1]        #s
     t_chrg = (E_cum / float(P_chrg)) * 3600     #s
 
-    new_row = pd.DataFrame({'t': [t_start], 'P': [-1000*float(P_chrg)], 'P_HE': [P_HE_chrg], 'P_HP': [P_HP_chrg]})
-    load_profile = pd.concat([load_profile, new_row], ignore_index=True)
-    new_row = pd.DataFrame({'t': [t_start + t_chrg], 'P': [-1000*float(P_chrg)], 'P_HE': [P_HE_chrg], 'P_HP': [P_HP_chrg]})
-    load_profile = pd.concat([load_profile, new_row], ignore_index=True)
-
-    print(f't_start: {t_start}\nt_end: {t_start+t_chrg}\nP_chrg: {-1000*float(P_chrg)} W\nP_HE_chrg: {P_HE_chrg} W\nP_HP_chrg: {P_HP_chrg} W')
-    print(load_profile.tail().to_string())
+    # Two samples of constant charging power after the profile, appended in one allocation
+    charging = {'t': [t_start, t_start + t_chrg], 'P': [-1000*float(P_chrg)] * 2, 'P_HE': [P_HE_chrg] * 2, 'P_HP': [P_HP_chrg] * 2}
+    load_profile = pd.DataFrame({column: np.concatenate((load_profile[column].to_numpy(), charging[column])) for column in charging})
 
     return load_profile
 ##
\ No newline at end of file
@@ -1,7 +1,41 @@
-import altair as alt
 import numpy as np
-from scipy import integrate     # Integration techniques
 import pandas as pd
+import math
+from .hbess_startup import lazy_import
+
+alt = lazy_import('altair')     # Plotting library, imported by the first chart (see hbess_startup)
+
+chart_points = 2000     #default maximum number of samples per chart (before melting)
+
+
+def downsample(chart_data, max_points=chart_points, x='t'):
+    # Shape-preserving min/max bucketing: split the samples into buckets and keep, per bucket, the samples with the
+    # minimum and maximum of every column, plus the first and last sample. Peaks and minima (e.g. of the voltage) are always kept.
+    n = len(chart_data)
+    columns = [column for column in chart_data.columns if column != x]
+    if max_points is None or n <= max(max_points, 2) or not columns:
+        return chart_data.copy()
+
+    n_buckets = max(1, (max_points - 2) // (2 * len(columns)))
+    size = math.ceil((n - 2) / n_buckets)
+    offsets = 1 + size * np.arange(n_buckets)
+
+    # One column at a time, through one (bucket, sample) buffer: the padding and NaN are never selected, and the
+    # memory used is that of one column (the columns may be float32 views of a result, see hbess_result)
+    buffer = np.empty(n_buckets * size)
+    keep = [np.array([0, n - 1])]
+    for column in columns:
+        values = chart_data[column].to_numpy()[1:-1]
+        buffer[:len(values)] = values
+        missing = np.isnan(buffer[:len(values)])
+        for fill, select in ((-np.inf, np.argmax), (np.inf, np.argmin)):
+            buffer[len(values):] = fill
+            buffer[:len(values)][missing] = fill
+            keep.append(offsets + select(buffer.reshape(n_buckets, size), axis=1))
+    keep = np.concatenate(keep)
+
+    return chart_data.iloc[np.unique(np.clip(keep, 0, n - 1))].copy()
+
 
 def energy_loadprofile(chart_data):
     E_req = np.trapz(chart_data['P'].to_numpy(), chart_data['t'].to_numpy()) / 3600000   #Ws to kWh
@@ -10,9 +44,9 @@ def energy_loadprofile(chart_data):
 
 
 
-def fig_loadprofile(chart_data, height):
+def fig_loadprofile(chart_data, height, max_points=chart_points):
     ## SCALE INPUTS
-    chart_data = chart_data.copy()                                  #copy of DataFrame for scaling
+    chart_data = downsample(chart_data.loc[:, ['t', 'P', 'P_HE', 'P_HP']], max_points)   #(reduced) copy of DataFrame for scaling
     chart_data.loc[:, 't'] = chart_data.loc[:, 't'] / 60            #seconds to hours
     chart_data.loc[:, 'P'] = chart_data.loc[:, 'P'] / 1000          #watts to kilowatts
     chart_data.loc[:, 'P_HE'] = chart_data.loc[:, 'P_HE'] / 1000    #watts to kilowatts
@@ -42,9 +76,9 @@ def fig_loadprofile(chart_data, height):
     return chart
 
 
-def fig_cumul_energy(df_E_cum, height):
-    df_E_cum['t'] *= 60 
-    chart_data = df_E_cum.melt('t')
+def fig_cumul_energy(df_E_cum, height, max_points=chart_points):
+    chart_data = downsample(df_E_cum, max_points)
+    chart_data = chart_data.assign(t = chart_data['t'] * 60).melt('t')   #hours to minutes, without modifying the caller's DataFrame
 
     chart = (
         alt.Chart(data = chart_data)
@@ -62,9 +96,9 @@ def fig_cumul_energy(df_E_cum, height):
     return chart
 
 
-def fig_soc(df_SOC, height):
-    df_SOC['t'] *= 60 
-    chart_data = df_SOC.melt('t')
+def fig_soc(df_SOC, height, max_points=chart_points):
+    chart_data = downsample(df_SOC, max_points)
+    chart_data = chart_data.assign(t = chart_data['t'] * 60).melt('t')   #hours to minutes, without modifying the caller's DataFrame
 
 
     chart = (
@@ -83,9 +117,9 @@ def fig_soc(df_SOC, height):
     return chart
 
 
-def fig_voltage(df_V, height):
-    df_V['t'] *= 60
-    chart_data = df_V.melt('t')
+def fig_voltage(df_V, height, max_points=chart_points):
+    chart_data = downsample(df_V, max_points)
+    chart_data = chart_data.assign(t = chart_data['t'] * 60).melt('t')   #hours to minutes, without modifying the caller's DataFrame
 
     chart = (
         alt.Chart(data = chart_data)
@@ -102,9 +136,9 @@ def fig_voltage(df_V, height):
     )
     return chart
 
-def fig_current(df_I, height):
-    df_I['t'] *= 60
-    chart_data = df_I.melt('t')
+def fig_current(df_I, height, max_points=chart_points):
+    chart_data = downsample(df_I, max_points)
+    chart_data = chart_data.assign(t = chart_data['t'] * 60).melt('t')   #hours to minutes, without modifying the caller's DataFrame
 
     chart = (
         alt.Chart(data = chart_data)
@@ -122,8 +156,27 @@ def fig_current(df_I, height):
     return chart
 
 
-def fig_cost(df_cost, height):
-    chart_data = df_cost.melt('factor')
+def fig_soh(df_SOH, height):
+    chart_data = df_SOH.loc[:, ['year', 'SOH_HE', 'SOH_HP']].melt('year')
+
+    chart = (
+        alt.Chart(data = chart_data)
+        .mark_line(point = True)
+        .encode(
+        x = alt.X('year', axis = alt.Axis(title = 'Time (years)', grid = False)),
+        y = alt.Y('value', axis = alt.Axis(title = 'SOH (%)'), scale=alt.Scale(zero=False)),
+        color = alt.Color('variable', legend = alt.Legend(orient = 'bottom', title = 'None', titleOpacity = 0, titlePadding = 0, titleFontSize = 0))   
+        )
+        .properties(
+            height = height,
+        )
+        .interactive()
+    )
+    return chart
+
+
+def fig_cost(df_cost, height, max_points=chart_points):
+    chart_data = downsample(df_cost, max_points, x='factor').melt('factor')
 
     chart = (
         alt.Chart(data = chart_data)
@@ -141,3 +194,37 @@ def fig_cost(df_cost, height):
 
     return chart
 
+
+
+def fig_histogram(df, column, title, height, bins=40):
+    # Distribution of one column, e.g. the total cost of the Monte Carlo samples
+    chart = (
+        alt.Chart(data = df[[column]])
+        .mark_bar()
+        .encode(
+        x = alt.X(f'{column}:Q', bin = alt.Bin(maxbins = bins), axis = alt.Axis(title = title, grid = False)),
+        y = alt.Y('count()', axis = alt.Axis(title = 'Samples')),
+        )
+        .properties(
+            height = height,
+        )
+    )
+    return chart
+
+
+def fig_sweep(df_sweep, x, y, value, title, height):
+    # Heatmap of one result of a parameter sweep (one row per grid point, see hbess_sweep.sweep_grid)
+    chart = (
+        alt.Chart(data = df_sweep)
+        .mark_rect()
+        .encode(
+        x = alt.X(f'{x}:O', axis = alt.Axis(title = x.replace('_', ' '))),
+        y = alt.Y(f'{y}:O', axis = alt.Axis(title = y.replace('_', ' ')), sort = 'descending'),
+        color = alt.Color(f'{value}:Q', legend = alt.Legend(orient = 'bottom', title = title)),
+        tooltip = [x, y, value, 'N_HE', 'N_HP'],
+        )
+        .properties(
+            height = height,
+        )
+    )
+    return chart
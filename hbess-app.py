@@ -1,15 +1,18 @@
 import streamlit as st          # Framework for developing web apps
 import numpy as np              # Operations on arrays
 import pandas as pd             # Data manipulation and analysis
-import altair as alt            # Plotting library
 import func.hbess_tables        # Custom functions regarding Pandas Dataframe transformations
 import func.hbess_visualise     # Custom functions regarding visualisation of data (plots and tables)
 import func.hbess_ems           # Custom functions regarding the energy management strategy
+import func.hbess_engine        # Headless sizing engine (load sharing, packs, simulation)
+import func.hbess_service       # Client of the shared sizing job service
+import func.hbess_cache         # Content hashes (of the requests to the sizing service)
+import func.hbess_startup       # Precomputed default scenario (hbess-cli.py warmup); Altair and SciPy are imported when first used
 import math                     # Advanced mathematical operations (logarithms...)
-import scipy
-#from scipy import integrate     # Integration techniques
-import matplotlib.pyplot as plt #temporary
 from io import StringIO
+import dataclasses
+import os
+import time
 
 
 # Page configuration (name, description, contact...)
@@ -58,36 +61,42 @@ col_1_1, col_1_2, col_1_3 = tab_1.columns([2,4,2], gap="medium")
 # All the input fields
 N_LP = int(col_1_1.radio("Number of load profiles", ('1', '2', '3', '4', '5'), horizontal=True))
 
+dict_load = func.hbess_engine.dict_load
+dict_cell = func.hbess_engine.dict_cell     #all cells in battery_cells/
+cell_options = tuple(dict_cell) + ('Custom',)
+
 col_1_1_1, col_1_1_2 = col_1_1.columns(2)
 input_HE = col_1_1_1.selectbox('High Energy (HE) Cell',
-                                ('NMC Samsung 94Ah', 'LTO Toshiba 23Ah', 'Custom'),
-                                help='TODO', index=0, key=111)
+                                cell_options,
+                                help='TODO', index=cell_options.index('NMC Samsung 94Ah') if 'NMC Samsung 94Ah' in dict_cell else 0, key=111)
 
 input_HP = col_1_1_2.selectbox('High Power (HP) Cell',
-                                ('NMC Samsung 94Ah', 'LTO Toshiba 23Ah', 'Custom'),
-                                help='TODO', index=1, key=112)
-
-input_load = col_1_1.selectbox('Load profile',
-                                ('Tug boat 1', 'Tug boat 2', 'Sine wave', 'Custom'),
-                                help='TODO', index=0, key=113)
+                                cell_options,
+                                help='TODO', index=cell_options.index('LTO Toshiba 23Ah') if 'LTO Toshiba 23Ah' in dict_cell else 0, key=112)
 
-dict_load = {
-    'Tug boat 1': 'load_profiles/tug_boat_1.csv',
-    'Tug boat 2': 'load_profiles/tug_boat_2.csv',
-    'Sine wave': 'load_profiles/sine_wave.csv',
-}
+# One tab per load profile (operating mode), each with its own profile selection
+ordinals = ("First", "Second", "Third", "Fourth", "Fifth")
+tabs = col_1_2.tabs([f"{ordinal} load profile" for ordinal in ordinals[:N_LP]])
+load_options = tuple(dict_load) + ('Custom',)
+input_loads = [tab.selectbox('Load profile', load_options, help='TODO', index=i % len(dict_load), key=113 if i == 0 else 130 + i)
+               for i, tab in enumerate(tabs)]
 
-dict_cell = {
-    'LTO Toshiba 23Ah': 'battery_cells/LTO_Toshiba_23Ah.csv',
-    'NMC Samsung 94Ah': 'battery_cells/NMC_Samsung_94Ah.csv',
-}
+# Messages from the (Streamlit-free) engine are shown in the app
+show_error = lambda message: st.error(message, icon="⚠️")
+show_info = lambda message: st.info(message, icon="ℹ️")
 
 input_EMS = col_1_1.selectbox('Energy Management Strategy',
-                               ('Split', 'Power', 'Gradient', 'Cost', 'Cost: Split', 'Cost: Limit'),
+                               func.hbess_engine.methods,
                                help='TODO',index=1, key=114)
 
 if input_EMS == 'Split':
     input_factor = col_1_1.slider('Split factor', 0, 100, 50, 10)
+elif input_EMS in ('Rolling mean', 'Rolling max'):
+    input_factor = col_1_1.number_input('Window (min)', min_value=0.0, value=5.0, step=1.0, help='Length of the moving window of the HE power limit')
+elif input_EMS == 'Online: Low-pass':
+    input_factor = col_1_1.number_input('Time constant (s)', min_value=0.0, value=60.0, step=10.0, help='Of the low-pass filtered power taken by the HE pack')
+elif input_EMS == 'Online: Rate limit':
+    input_factor = col_1_1.number_input('HE ramp rate (kW/s)', min_value=0.0, value=10.0, step=1.0, help='Largest change of the HE power per second')
 else:
     input_factor = None;
 
@@ -103,6 +112,14 @@ input_LFTM = col_1_1_2.number_input('Expected lifetime (years)', min_value=1, ma
 if(input_SOC0 < input_DOD): 
     st.error("The target Depth of Discharge (DoD) is larger than the Initial State of Charge (SoC)", icon="⚠️")
 
+col_1_1_s = col_1_1.expander('Advanced settings')
+input_TOL = col_1_1_s.number_input('Profile compression tolerance (%)', min_value=0.0, max_value=10.0, value=0.0, step=0.1, key=125,
+                                   help='Size on a compressed load profile: power and cumulative energy stay within this error of the original (0: no compression)')
+input_POINTS = col_1_1_s.number_input('Maximum number of samples per chart', min_value=100, max_value=100000, value=func.hbess_visualise.chart_points, step=100, key=124,
+                                      help='Long profiles are reduced to this number of samples before plotting (peaks and minima are always kept)')
+input_DTYPE = 'float32' if col_1_1_s.checkbox('Single-precision results (float32)', value=False, key=166,
+                                              help='Store the simulated SoC, voltage and current in half the memory (for very long profiles)') else None
+
 col_1_1_c = col_1_1.expander('Upload custom files')
 col_1_1_c_1, col_1_1_c_2 = col_1_1_c.columns(2)
 
@@ -122,105 +139,134 @@ col_1_1_c_2.download_button(
 )
 
 # Uploading of custom files
-file_load = col_1_1_c.file_uploader("Choose a file for the load profile", key=121)
-if input_load == 'Custom':
-    if file_load is not None and input_load:
-        load_profile = func.hbess_tables.read_load_csv(file_load)
+load_profiles = []
+for i, input_load in enumerate(input_loads):
+    label = "Choose a file for the load profile" if N_LP == 1 else f"Choose a file for the {ordinals[i].lower()} load profile"
+    file_load = col_1_1_c.file_uploader(label, key=121 if i == 0 else 140 + i)
+    if input_load == 'Custom':
+        if file_load is not None:
+            load_profiles.append(func.hbess_engine.read_load(file_load, show_error))
+        else:
+            st.warning(f'No custom load profile uploaded ({ordinals[i].lower()} load profile)', icon="⚠️")
+            load_profiles.append(pd.DataFrame({'t': [0, 3600], 'P': [0, 0]}))
     else:
-        st.warning('No custom load profile uploaded', icon="⚠️")
-        load_profile = pd.DataFrame({'t': [0, 3600], 'P': [0, 0]})
-else:
-    load_profile = func.hbess_tables.read_load_csv(dict_load[input_load])
+        load_profiles.append(func.hbess_engine.read_load(input_load, show_error))
 
 file_cell_HE = col_1_1_c.file_uploader("Choose a file for the High Energy (HE) cell", key=122)
 if input_HE == 'Custom':
     if file_cell_HE is not None:
-        cell_HE, df_OCV_HE, df_SOH_HE = func.hbess_tables.read_cell_csv(file_cell_HE)
+        cell_HE = func.hbess_engine.read_cell(file_cell_HE, show_error)
     else:
         st.warning('No custom HE battery cell uploaded', icon="⚠️")
-        cell_HE, df_OCV_HE, df_SOH_HE = func.hbess_tables.read_cell_csv('battery_cells/None.csv')
+        cell_HE = func.hbess_engine.read_cell('battery_cells/None.csv', show_error)
 else:
-    cell_HE, df_OCV_HE, df_SOH_HE = func.hbess_tables.read_cell_csv(dict_cell[input_HE])
+    cell_HE = func.hbess_engine.read_cell(input_HE, show_error)
 
 file_cell_HP = col_1_1_c.file_uploader("Choose a file for the High Power (HP) cell", key=123)
 if input_HP == 'Custom':
     if file_cell_HP is not None:
-        cell_HP, df_OCV_HP, df_SOH_HP = func.hbess_tables.read_cell_csv(file_cell_HP)
+        cell_HP = func.hbess_engine.read_cell(file_cell_HP, show_error)
     else:
         st.warning('No custom HP battery cell uploaded', icon="⚠️")
-        cell_HP, df_OCV_HP, df_SOH_HP = func.hbess_tables.read_cell_csv('battery_cells/None.csv')
+        cell_HP = func.hbess_engine.read_cell('battery_cells/None.csv', show_error)
 else:
-    cell_HP, df_OCV_HP, df_SOH_HP = func.hbess_tables.read_cell_csv(dict_cell[input_HP])
-
-# Analyse the load profiles most important parameters
-P_max = load_profile['P'].max() / 1000 #kW
-P_mean = load_profile['P'].mean() / 1000 #kW
-PAPR = 10 * math.log((P_max ** 2) / (P_mean ** 2))
-E_req = np.trapz(load_profile['P'].to_numpy(), load_profile['t'].to_numpy()) / 3600000   #Ws to kWh
-
-# Calculate the HE and HP contributions
-load_profile, df_cost = func.hbess_ems.load_sharing(load_profile, cell_HE, cell_HP, input_EMS, input_SOC0, input_VREF, input_CYCL, input_DOD, input_PCHRG, input_LFTM, input_factor)
-
-# Concatenation of charging part
-df_E_cum = func.hbess_tables.get_cumulative_energy(load_profile)        #Cumulative energy usage
-# ###
-load_profile = func.hbess_tables.add_charging(load_profile, df_E_cum, input_PCHRG)
-# ###
-df_E_cum = func.hbess_tables.get_cumulative_energy(load_profile)        #Cumulative energy usage
-
-
-# Calculation of packs
-S_HE, P_HE, N_HE, C_HE, E_HE, V_HE = func.hbess_tables.calculate_packs(load_profile['P_HE'], load_profile['t'], cell_HE, input_VREF, input_DOD)
-S_HP, P_HP, N_HP, C_HP, E_HP, V_HP = func.hbess_tables.calculate_packs(load_profile['P_HP'], load_profile['t'], cell_HP, input_VREF, input_DOD)
-C_tot = C_HE + C_HP
-E_tot = E_HE + E_HP
-
-###testing the tabs for multiple LP###
-N = int(N_LP)
-
-match N:
-    case 1:
-        print('1')
-        tabs = col_1_2.tabs(["First load profile"])
-    case 2:
-        print('2')
-        tabs = col_1_2.tabs(["First load profile", "Second load profile"])
-    case 3:
-        print('3')
-        tabs = col_1_2.tabs(["First load profile", "Second load profile", "Third load profile"])
-    case 4:
-        print('4')
-        tabs = col_1_2.tabs(["First load profile", "Second load profile", "Third load profile", "Fourth load profile"])
-    case 5:
-        tabs = col_1_2.tabs(["First load profile", "Second load profile", "Third load profile", "Fourth load profile", "Fifth load profile"])
-######
-
-
-# Display the load profiles metrics
-col_1_2_1, col_1_2_2, col_1_2_3, col_1_2_4 = col_1_2.columns(4)
-col_1_2_1.metric("Required Energy", "%0.2f kWh" % E_req)
-col_1_2_2.metric("Maximum Power", "%0.2f kW" % P_max)
-col_1_2_3.metric("Average Power", "%0.2f kW" % P_mean)
-col_1_2_4.metric("Total Cost", "\u20ac{:,.2f}".format(C_tot))
-#col_2_1_3.metric("Total Cost", "\u20ac{:,.0f}".format(C_tot)) #S_HE, P_HE, cell_HE 
-#col_1_2_4.metric("Peak-to-Average Power Ratio", "%0.2f dB" % PAPR)
-
-# Plot - Load Profile 
-chart = func.hbess_visualise.fig_loadprofile(load_profile, 520)
-col_1_2.altair_chart(chart, theme="streamlit", use_container_width=True)
+    cell_HP = func.hbess_engine.read_cell(input_HP, show_error)
+
+# Equivalent circuit: the internal resistance of the cells (from the cell file if given, otherwise 0) can be adjusted
+dict_model = {'Open-circuit voltage': 'ocv', 'Internal resistance (R-int)': 'rint'}
+input_MODEL = dict_model[col_1_1_s.radio('Voltage model', tuple(dict_model), horizontal=True, key=130,
+                                         help='R-int: the voltage sag and extra current caused by the internal resistance of the cells are simulated')]
+if input_MODEL == 'rint':
+    col_1_1_s_1, col_1_1_s_2 = col_1_1_s.columns(2)
+    input_R_HE = col_1_1_s_1.number_input('HE cell resistance (mΩ)', min_value=0.0, max_value=1000.0, value=1000 * cell_HE.R, step=0.1,
+                                          help='DC internal resistance per HE cell, used by the R-int model (default: the value of the cell file, 0 if it has none)')
+    input_R_HP = col_1_1_s_2.number_input('HP cell resistance (mΩ)', min_value=0.0, max_value=1000.0, value=1000 * cell_HP.R, step=0.1,
+                                          help='DC internal resistance per HP cell, used by the R-int model (default: the value of the cell file, 0 if it has none)')
+    cell_HE = dataclasses.replace(cell_HE, R=input_R_HE / 1000)  #mOhm to Ohm
+    cell_HP = dataclasses.replace(cell_HP, R=input_R_HP / 1000)
+
+# Size the HE and HP packs for all load profiles, and simulate every profile with them
+my_bar = st.progress(0, text="Operation in progress. Please wait.")
+if os.environ.get('HBESS_SERVICE'):
+    # Shared sizing service (hbess-cli.py serve): identical requests of all sessions are computed once. A pending job is
+    # polled once per run of the page (its id is kept in the session state), so that the widgets stay responsive
+    request = func.hbess_service.sizing_request(load_profiles, cell_HE, cell_HP, input_EMS, input_SOC0, input_VREF, input_CYCL, input_DOD,
+                                                input_PCHRG, input_LFTM, input_factor, input_TOL / 100, input_MODEL, input_DTYPE)
+    request_key = func.hbess_cache.content_hash(request).hexdigest()
+    job = st.session_state.get('service_job')
+    response = func.hbess_service.poll_job(os.environ['HBESS_SERVICE'], request, job[1] if job and job[0] == request_key else None)
+    if response['status'] != 'done':
+        st.session_state['service_job'] = (request_key, response['id'])
+        my_bar.progress(10 if response['status'] == 'queued' else 50, text=f"Job {response['status']} on the sizing service")
+        time.sleep(0.2)
+        st.rerun()
+    st.session_state.pop('service_job', None) #a finished request is submitted again: the service keys it by its files too
+    envelope = response['result']
+else:
+    # Results stored by hbess-cli.py warmup (e.g. the default scenario of a new session), otherwise sized here
+    envelope = func.hbess_startup.load_result(func.hbess_startup.result_key(
+                   load_profiles, cell_HE, cell_HP, input_EMS, input_SOC0, input_VREF, input_CYCL, input_DOD, input_PCHRG, input_LFTM,
+                   input_factor, input_TOL / 100, input_MODEL, input_DTYPE))
+    if envelope is None:
+        envelope = func.hbess_engine.run_sizing_envelope(load_profiles, cell_HE, cell_HP,
+                                                         input_EMS, input_SOC0, input_VREF, input_CYCL, input_DOD, input_PCHRG, input_LFTM, input_factor,
+                                                         progress=lambda fraction, text: my_bar.progress(round(100*fraction), text=text),
+                                                         cache=st.session_state.setdefault('stage_cache', {}),   #only stages with changed inputs are recomputed
+                                                         tolerance=input_TOL / 100, model=input_MODEL, dtype=input_DTYPE)
+my_bar.empty()
+
+S_HE, P_HE, N_HE, C_HE, E_HE, V_HE = (envelope[key] for key in ('S_HE', 'P_HE', 'N_HE', 'C_HE', 'E_HE', 'V_HE'))
+S_HP, P_HP, N_HP, C_HP, E_HP, V_HP = (envelope[key] for key in ('S_HP', 'P_HP', 'N_HP', 'C_HP', 'E_HP', 'V_HP'))
+C_tot = envelope['C_tot']
+E_tot = envelope['E_tot']
+
+# Display the metrics and chart of every load profile in its tab
+for i, (tab, result) in enumerate(zip(tabs, envelope['profiles'])):
+    col_1_2_1, col_1_2_2, col_1_2_3, col_1_2_4 = tab.columns(4)
+    col_1_2_1.metric("Required Energy", "%0.2f kWh" % result['E_req'])
+    col_1_2_2.metric("Maximum Power", "%0.2f kW" % result['P_max'])
+    col_1_2_3.metric("Average Power", "%0.2f kW" % result['P_mean'])
+    col_1_2_4.metric("Total Cost", "\u20ac{:,.2f}".format(C_tot))
+    #col_1_2_4.metric("Peak-to-Average Power Ratio", "%0.2f dB" % (10 * math.log((result['P_max'] ** 2) / (result['P_mean'] ** 2))))
+
+    # Plot - Load Profile
+    chart = func.hbess_visualise.fig_loadprofile(result['load_profile'], 520, input_POINTS)
+    tab.altair_chart(chart, theme="streamlit", use_container_width=True)
+
+for i, result in enumerate(envelope['profiles']):
+    for pack in ('HE', 'HP'):
+        if result[f'infeasible_{pack}'] > 0:
+            tabs[i].warning(f"The {pack} pack can't deliver the requested power in {result[f'infeasible_{pack}']} time steps (internal resistance)", icon="⚠️")
+
+if input_TOL > 0 and envelope['tolerance'] is None:
+    col_1_1_s.info(f"The {input_EMS} EMS is not linear in the load power: the load profile is not compressed", icon="ℹ️")
+
+if N_LP > 1:
+    col_1_2.info(f"The HE pack is sized by the {ordinals[envelope['driver_HE']].lower()} load profile ({input_loads[envelope['driver_HE']]}), "
+                 f"the HP pack by the {ordinals[envelope['driver_HP']].lower()} load profile ({input_loads[envelope['driver_HP']]})", icon="ℹ️")
 
 # Display import cell information in a table
-col_1_3.write(f"**High Energy (HE) Cell:** {cell_HE.iloc[0]['value']}")
+col_1_3.write(f"**High Energy (HE) Cell:** {cell_HE.name}")
 col_1_3.table(func.hbess_tables.display_cell(cell_HE))
-col_1_3.write(f"**High Power (HP) Cell:** {cell_HP.iloc[0]['value']}")
+col_1_3.write(f"**High Power (HP) Cell:** {cell_HP.name}")
 col_1_3.table(func.hbess_tables.display_cell(cell_HP))
 
 # Compare the cell types and give information to user if the selection makes sense
-func.hbess_tables.compare_cells(cell_HE, cell_HP)
+func.hbess_tables.compare_cells(cell_HE, cell_HP, show_info)
 
 
 # Layout of second tab
 col_2_1, col_2_2 = tab_2.columns([1, 2], gap="medium")
+
+# The packs are shared by all load profiles: show the simulation of one of them (by default the one that sizes the HE pack)
+i_LP = envelope['driver_HE']
+if N_LP > 1:
+    i_LP = col_2_1.selectbox('Simulated load profile', range(N_LP), index=i_LP, key=126,
+                             format_func=lambda i: f"{ordinals[i]} load profile ({input_loads[i]})")
+result = envelope['profiles'][i_LP]
+P_max, P_mean, E_req = result['P_max'], result['P_mean'], result['E_req']   #kW, kW, kWh
+load_profile, df_cost, df_E_cum = result['load_profile'], result['df_cost'], result['df_E_cum']
+
 col_2_1_1, col_2_1_2, col_2_1_3 = col_2_1.columns(3, gap="medium")
 col_2_2_1, col_2_2_2 = col_2_2.columns(2, gap="medium")
 
@@ -229,10 +275,7 @@ col_2_2_1, col_2_2_2 = col_2_2.columns(2, gap="medium")
 # S_HP, P_HP, N_HP, C_HP, E_HP = func.hbess_tables.calculate_packs(load_profile['P_HP'], load_profile['t'], cell_HP, input_VREF, input_DOD)
 
 # Calculation of graph information
-
-df_SOC = func.hbess_tables.get_soc(df_E_cum, E_HE, E_HP, input_SOC0)    #SOC calculations
-df_V = func.hbess_tables.get_voltage(df_SOC, df_OCV_HE, df_OCV_HP, S_HE, S_HP) #Voltage Calculations
-df_I = func.hbess_tables.get_current(load_profile, df_V)
+df_SOC, df_V, df_I = result['df_SOC'], result['df_V'], result['df_I']
 
 ####
 #df_cost = func.hbess_ems.cost_limit(load_profile, cell_HE, cell_HP, input_VREF, input_DOD)
@@ -277,6 +320,20 @@ with col_2_1_5:
              '- Maximum current: ', df_I['I_HP'].max(), ' A', '\n'
              '- Cost: ', C_HP, ' €')
 
+# Degradation over the expected lifetime: flag the packs that can't deliver the required energy at the end of life
+col_2_1.subheader("Lifetime")
+for pack, name in (('HE', 'High Energy (HE)'), ('HP', 'High Power (HP)')):
+    year_fail, P_eol = envelope[f'year_{pack}_fail'], envelope[f'P_{pack}_eol']
+    text = (f"**{name} pack:** {envelope[f'EFC_{pack}'] * input_CYCL:,.0f} equivalent full cycles per year, "
+            f"{envelope[f'SOH_{pack}_eol']:.1f}% State of Health after {input_LFTM} years.")
+    if year_fail is None:
+        col_2_1.success(text + " The pack meets the load profiles over its whole lifetime.")
+    elif P_eol is None:
+        col_2_1.warning(text + f" The pack can't deliver the required energy from year {year_fail}, and no pack of up to 10 times its size would last {input_LFTM} years.", icon="⚠️")
+    else:
+        col_2_1.warning(text + f" The pack can't deliver the required energy from year {year_fail}: "
+                        f"{P_eol} strings in parallel ({envelope[f'N_{pack}_eol']} cells, \u20ac{envelope[f'C_{pack}_eol']:,.0f}) would last {input_LFTM} years.", icon="⚠️")
+
 
 
 
@@ -284,30 +341,104 @@ with col_2_1_5:
 
 
 #Plots
-chart = func.hbess_visualise.fig_loadprofile(load_profile, 320)
+chart = func.hbess_visualise.fig_loadprofile(load_profile, 320, input_POINTS)
 
 # col_2_2_1.write('**Load profile**')
 # col_2_2_1.altair_chart(chart, theme="streamlit", use_container_width=True)
 
 col_2_2_1.write('**Energy Usage**')
-chart = func.hbess_visualise.fig_cumul_energy(df_E_cum, 320)
+chart = func.hbess_visualise.fig_cumul_energy(df_E_cum, 320, input_POINTS)
 col_2_2_1.altair_chart(chart, theme="streamlit", use_container_width=True)
 
 col_2_2_1.write('**Voltage**')
-chart = func.hbess_visualise.fig_voltage(df_V, 320)
+chart = func.hbess_visualise.fig_voltage(df_V, 320, input_POINTS)
 col_2_2_1.altair_chart(chart, theme="streamlit", use_container_width=True)
 
 
 col_2_2_2.write('**State of Charge**')
-chart = func.hbess_visualise.fig_soc(df_SOC, 320)
+chart = func.hbess_visualise.fig_soc(df_SOC, 320, input_POINTS)
 col_2_2_2.altair_chart(chart, theme="streamlit", use_container_width=True)
 
 col_2_2_2.write('**Current**')
-chart = func.hbess_visualise.fig_current(df_I, 320)
+chart = func.hbess_visualise.fig_current(df_I, 320, input_POINTS)
 col_2_2_2.altair_chart(chart, theme="streamlit", use_container_width=True)
 
 
+col_2_2_2.write('**State of Health**')
+chart = func.hbess_visualise.fig_soh(envelope['df_SOH'], 320)
+col_2_2_2.altair_chart(chart, theme="streamlit", use_container_width=True)
+
+
+# Repeated duty cycles with charging windows: does the SoC drift over days or weeks?
+col_2_2_s = col_2_2.expander('Repeated duty cycles')
+col_2_2_s_1, col_2_2_s_2, col_2_2_s_3 = col_2_2_s.columns(3)
+input_REPEAT = col_2_2_s_1.number_input('Number of duty cycles', min_value=1, max_value=10000, value=7, step=1, key=127,
+                                        help='How many times the load profile is repeated, each followed by a charging window, to show the SoC drift')
+input_PERIOD = col_2_2_s_2.number_input('Time between duty cycles (h)', min_value=0.0, max_value=1000.0, value=0.0, step=0.5, key=128,
+                                        help='Time from the start of one duty cycle to the next (0: the load profile and a full recharge)')
+input_EFF = col_2_2_s_3.slider('Charging efficiency (%)', 50, 100, 100, key=129, help='Fraction of the charging energy that is stored')
+try:
+    # The shown load profile, with the packs of all load profiles
+    schedule = func.hbess_engine.run_schedule({**envelope, **result}, cell_HE, cell_HP, input_SOC0, input_PCHRG, input_REPEAT,
+                                              input_PERIOD or None, input_EFF / 100)
+    col_2_2_s_1.metric("SoC drift HE", "%0.2f %%/cycle" % schedule['drift_HE'])
+    col_2_2_s_2.metric("SoC drift HP", "%0.2f %%/cycle" % schedule['drift_HP'])
+    col_2_2_s_3.metric("Cycle period", "%0.2f h" % (schedule['period'] / 3600))
+    for pack in ('HE', 'HP'):
+        if schedule[f'cycle_empty_{pack}'] is not None:
+            col_2_2_s.warning(f"The {pack} pack runs empty in duty cycle {schedule[f'cycle_empty_{pack}']}", icon="⚠️")
+    chart = func.hbess_visualise.fig_soc(schedule['df_SOC'], 320, input_POINTS)
+    col_2_2_s.altair_chart(chart, theme="streamlit", use_container_width=True)
+except ValueError as error:
+    show_error(str(error))
+
+
+# Monte Carlo: how often would the packs be too small for perturbed load profiles, cell costs and capacities?
+col_2_2_m = col_2_2.expander('Uncertainty (Monte Carlo)')
+col_2_2_m_1, col_2_2_m_2, col_2_2_m_3 = col_2_2_m.columns(3)
+input_MC_N = col_2_2_m_1.number_input('Number of samples', min_value=100, max_value=100000, value=1000, step=100, key=160)
+input_MC_SCALE = col_2_2_m_2.number_input('Power scaling (%)', min_value=0.0, max_value=100.0, value=10.0, step=1.0, key=161,
+                                          help='Standard deviation of a power factor per sample')
+input_MC_NOISE = col_2_2_m_3.number_input('Power noise (%)', min_value=0.0, max_value=100.0, value=5.0, step=1.0, key=162,
+                                          help='Standard deviation of the noise on every time step, relative to the peak power')
+input_MC_WARP = col_2_2_m_1.number_input('Time-warping (%)', min_value=0.0, max_value=100.0, value=10.0, step=1.0, key=163,
+                                         help='Standard deviation of the local stretching of the time axis')
+input_MC_COST = col_2_2_m_2.number_input('Cell cost (%)', min_value=0.0, max_value=100.0, value=10.0, step=1.0, key=164,
+                                         help='Standard deviation of the cell cost')
+input_MC_CAP = col_2_2_m_3.number_input('Cell capacity (%)', min_value=0.0, max_value=100.0, value=5.0, step=1.0, key=165,
+                                        help='Standard deviation of the cell capacity')
+montecarlo = func.hbess_engine.run_montecarlo({**result, 'P_HE': envelope['P_HE'], 'P_HP': envelope['P_HP']}, cell_HE, cell_HP,
+                                              input_EMS, input_VREF, input_DOD, input_factor, input_MC_N, input_MC_SCALE / 100, input_MC_NOISE / 100,
+                                              input_MC_WARP / 100, input_MC_COST / 100, input_MC_CAP / 100, seed=0)
+col_2_2_m_1.metric("HE pack too small", "%0.1f %%" % (100 * montecarlo['undersized_HE']))
+col_2_2_m_2.metric("HP pack too small", "%0.1f %%" % (100 * montecarlo['undersized_HP']))
+col_2_2_m_3.metric("Either pack", "%0.1f %%" % (100 * montecarlo['undersized']))
+chart = func.hbess_visualise.fig_histogram(montecarlo['df_samples'], 'C_tot', 'Total cost (€)', 240)
+col_2_2_m.altair_chart(chart, theme="streamlit", use_container_width=True)
+col_2_2_m.dataframe(montecarlo['df_percentiles'], hide_index=True, use_container_width=True)
+
 
 if df_cost is not None:
-    chart = func.hbess_visualise.fig_cost(df_cost, 320)
-    col_2_2_1.altair_chart(chart, theme="streamlit", use_container_width=True)
\ No newline at end of file
+    chart = func.hbess_visualise.fig_cost(df_cost, 320, input_POINTS)
+    col_2_2_1.altair_chart(chart, theme="streamlit", use_container_width=True)
+
+# Layout of third tab: sensitivity of the packs to the target voltage, DoD and initial SoC (the load sharing is kept)
+tab_3.write('**Parameter sweep**')
+col_3_1, col_3_2 = tab_3.columns([1, 2], gap="medium")
+input_SWEEP_V = col_3_1.slider('Target voltage (V)', 100, 2000, (int(np.clip(input_VREF - 400, 100, 2000)), int(np.clip(input_VREF + 400, 100, 2000))), step=10, key=150, help='Range of target voltages')
+input_SWEEP_VSTEP = col_3_1.number_input('Target voltage step (V)', min_value=1, max_value=500, value=25, step=5, key=151)
+input_SWEEP_DOD = col_3_1.slider('Depth of Discharge (DoD)', 5, 100, (50, 100), step=5, key=152, help='Range of DoD, in steps of 5%')
+input_SWEEP_SOC0 = col_3_1.slider('Initial State of Charge (SoC)', 0, 100, input_SOC0, key=153, help='Initial SoC of the voltage map')
+dict_sweep = {'Total cost (€)': 'C_tot', 'Total energy (kWh)': 'E_tot', 'Number of HE cells': 'N_HE', 'Number of HP cells': 'N_HP',
+              'Minimum HE voltage (V)': 'V_min_HE', 'Maximum HE voltage (V)': 'V_max_HE', 'Minimum HP voltage (V)': 'V_min_HP', 'Maximum HP voltage (V)': 'V_max_HP'}
+input_SWEEP_VALUE = col_3_1.selectbox('Result', list(dict_sweep), key=154)
+
+df_sweep = func.hbess_engine.run_sweep(envelope, cell_HE, cell_HP, np.arange(input_SWEEP_V[0], input_SWEEP_V[1] + 1, input_SWEEP_VSTEP),
+                                       np.arange(input_SWEEP_DOD[0], input_SWEEP_DOD[1] + 1, 5), [input_SWEEP_SOC0])
+chart = func.hbess_visualise.fig_sweep(df_sweep[df_sweep['feasible']], 'V_ref', 'DoD', dict_sweep[input_SWEEP_VALUE], input_SWEEP_VALUE, 420)
+col_3_2.altair_chart(chart, theme="streamlit", use_container_width=True)
+col_3_2.caption('Grid points at which a pack would run empty (SoC below 0%) are left out')
+
+col_3_1.write('**Cheapest configurations**')
+col_3_1.dataframe(df_sweep[df_sweep['feasible']].nsmallest(10, 'C_tot')[['V_ref', 'DoD', 'N_HE', 'N_HP', 'C_tot', 'V_min_HE', 'V_min_HP']],
+                  hide_index=True, use_container_width=True)
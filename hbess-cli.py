@@ -0,0 +1,415 @@
+import argparse                 # Command-line arguments
+import asyncio
+import dataclasses
+import json                     # Machine-readable output
+import os
+import signal
+import sys
+import time
+import numpy as np
+import func.hbess_engine        # Headless sizing engine (no Streamlit)
+import func.hbess_ems           # Energy management strategies
+import func.hbess_batch         # Process-pool batch runner and cell pair search
+import func.hbess_catalog       # Indexed directory of cell files
+import func.hbess_profile       # Streaming and binary load profiles
+import func.hbess_online        # Causal (online) energy management
+import func.hbess_service       # Local sizing job service
+import func.hbess_result        # Struct-of-arrays simulation results
+import func.hbess_startup       # Cold start of the app: precomputed results, import times
+import func.hbess_benchmark     # Benchmarks of the EMS methods and stages on synthetic profiles
+
+
+def add_sizing_arguments(parser):
+    parser.add_argument('--load', nargs='+', default=['Tug boat 1'],
+                        help='Bundled load profile names or paths to .csv files; with several profiles, the packs are sized for all of them')
+    parser.add_argument('--he', default='NMC Samsung 94Ah', help='Bundled High Energy (HE) cell name or path to a .csv file')
+    parser.add_argument('--hp', default='LTO Toshiba 23Ah', help='Bundled High Power (HP) cell name or path to a .csv file')
+    parser.add_argument('--ems', default='Power', choices=func.hbess_engine.methods, help='Energy Management Strategy')
+    parser.add_argument('--r-he', type=float, default=None, help='Internal resistance of the HE cell (mOhm), instead of the value in its file')
+    parser.add_argument('--r-hp', type=float, default=None, help='Internal resistance of the HP cell (mOhm), instead of the value in its file')
+    add_parameter_arguments(parser)
+
+
+def add_parameter_arguments(parser):
+    parser.add_argument('--factor', type=float, default=50,
+                        help='Split factor (%%) of the Split strategy, window (min) of Rolling mean/max, time constant (s) of Online: Low-pass, HE ramp rate (kW/s) of Online: Rate limit')
+    parser.add_argument('--dod', type=float, default=80, help='Depth of Discharge (%%)')
+    parser.add_argument('--vref', type=float, default=1000, help='Target voltage (V)')
+    parser.add_argument('--cycles', type=int, default=365, help='Number of cycles per year')
+    parser.add_argument('--soc0', type=float, default=90, help='Initial State of Charge (%%)')
+    parser.add_argument('--pchrg', type=float, default=2000.0, help='Maximum charging power (kW)')
+    parser.add_argument('--lifetime', type=int, default=20, help='Expected lifetime (years)')
+    parser.add_argument('--model', default='ocv', choices=func.hbess_engine.models,
+                        help='Voltage model: open-circuit voltage, or equivalent circuit with internal resistance')
+    parser.add_argument('--tolerance', type=float, default=None, help='Compress the load profile first, within this relative error (e.g. 0.01)')
+    parser.add_argument('--dtype', default='float64', choices=func.hbess_result.dtypes,
+                        help='Storage of the simulated SoC, voltage and current (float32: half the memory of long profiles)')
+
+
+def get_parameters(args):
+    if args.tolerance and args.ems not in func.hbess_ems.linear_methods:
+        print(f'Note: the {args.ems} EMS is not linear in the load power, the profile is not compressed (--tolerance ignored)', file=sys.stderr)
+    return {'SOC_0': args.soc0, 'V_ref': args.vref, 'N_year': args.cycles, 'DoD': args.dod,
+            'P_chrg': args.pchrg, 'lifetime': args.lifetime, 'factor': args.factor, 'tolerance': args.tolerance, 'model': args.model,
+            'dtype': args.dtype}
+
+
+def read_cells(args):
+    # HE and HP cells, with the internal resistance given on the command line (if any)
+    cells = []
+    for name, R in ((args.he, args.r_he), (args.hp, args.r_hp)):
+        cell = func.hbess_engine.read_cell(name)
+        cells.append(cell if R is None else dataclasses.replace(cell, R=R / 1000)) #mOhm to Ohm
+    return cells
+
+
+def print_error(message):
+    print(f'Error: {message}', file=sys.stderr)
+
+
+def print_progress(fraction, text):
+    print(f'[{100*fraction:3.0f}%] {text}', file=sys.stderr)
+
+
+def cmd_size(args):
+    load_profiles = [func.hbess_engine.read_load(name) for name in args.load]
+    cell_HE, cell_HP = read_cells(args)
+
+    if len(load_profiles) == 1:
+        result = func.hbess_engine.run_sizing(load_profiles[0], cell_HE, cell_HP, args.ems, **get_parameters(args),
+                                              progress=print_progress if args.verbose else None)
+        summary = func.hbess_engine.summarise(result)
+    else:
+        envelope = func.hbess_engine.run_sizing_envelope(load_profiles, cell_HE, cell_HP, args.ems, **get_parameters(args),
+                                                         progress=print_progress if args.verbose else None)
+        summary = func.hbess_engine.summarise_envelope(envelope, args.load)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+
+
+def print_summary(summary, indent=''):
+    for key, value in summary.items():
+        if isinstance(value, dict):
+            print(f'{indent}{key}:')
+            print_summary(value, indent + '    ')
+        else:
+            print(f'{indent}{key:>10}: {value}')
+
+
+def cmd_schedule(args):
+    cell_HE, cell_HP = read_cells(args)
+    parameters = get_parameters(args)
+
+    for name in args.load:
+        result = func.hbess_engine.run_sizing(func.hbess_engine.read_load(name), cell_HE, cell_HP, args.ems, **parameters)
+        schedule = func.hbess_engine.run_schedule(result, cell_HE, cell_HP, args.soc0, args.pchrg, args.repeat, args.period, args.efficiency)
+
+        print(f'{name}: {args.repeat} cycles, one every {schedule["period"] / 3600:.2f} h')
+        print_summary({key: value for key, value in schedule.items() if not key.startswith('df_')}, '    ')
+        if args.output:
+            schedule['df_cycles'].to_csv(args.output if len(args.load) == 1 else f'{name}_{args.output}', index=False)
+
+
+def cmd_sweep(args):
+    cell_HE, cell_HP = read_cells(args)
+    load_profiles = [func.hbess_engine.read_load(name) for name in args.load]
+    envelope = func.hbess_engine.run_sizing_envelope(load_profiles, cell_HE, cell_HP, args.ems, **get_parameters(args))
+
+    start, stop, step = args.vref_range
+    V_ref = np.arange(start, stop + step / 2, step)
+    start, stop, step = args.dod_range
+    DoD = np.arange(start, stop + step / 2, step)
+    df_sweep = func.hbess_engine.run_sweep(envelope, cell_HE, cell_HP, V_ref, DoD, args.soc0_values or [args.soc0])
+
+    columns = ['V_ref', 'DoD', 'SOC_0', 'N_HE', 'N_HP', 'C_tot', 'E_tot', 'V_min_HE', 'V_max_HE', 'V_min_HP', 'V_max_HP']
+    print(df_sweep[df_sweep['feasible']].nsmallest(args.top, 'C_tot')[columns].to_string(index=False))
+    if args.output:
+        df_sweep.to_csv(args.output, index=False)
+
+
+def cmd_montecarlo(args):
+    cell_HE, cell_HP = read_cells(args)
+    parameters = get_parameters(args)
+
+    for name in args.load:
+        result = func.hbess_engine.run_sizing(func.hbess_engine.read_load(name), cell_HE, cell_HP, args.ems, **parameters)
+        montecarlo = func.hbess_engine.run_montecarlo(result, cell_HE, cell_HP, args.ems, args.vref, args.dod, args.factor, args.samples,
+                                                      args.scale, args.noise, args.warp, args.cost, args.capacity, args.seed)
+
+        print(f'{name}: {args.samples} samples, nominal packs of {result["N_HE"]} HE and {result["N_HP"]} HP cells')
+        print_summary({key: value for key, value in montecarlo.items() if not key.startswith('df_')}, '    ')
+        print(montecarlo['df_percentiles'].to_string(index=False))
+        if args.output:
+            montecarlo['df_samples'].to_csv(args.output if len(args.load) == 1 else f'{name}_{args.output}', index=False)
+
+
+def cmd_batch(args):
+    profiles = {name: func.hbess_engine.read_load(name) for name in args.load}
+    cells = {name: func.hbess_engine.read_cell(name) for name in set(args.he + args.hp)}
+    pairs = [(HE, HP) for HE in args.he for HP in args.hp if HE != HP]
+
+    df_batch = func.hbess_batch.run_batch(profiles, cells, args.ems, get_parameters(args), pairs=pairs,
+                                          max_workers=args.workers, progress=print_progress if args.verbose else None)
+
+    if args.output:
+        df_batch.to_csv(args.output, index=False)
+    else:
+        columns = [column for column in ['load', 'HE', 'HP', 'EMS', 'N_HE', 'N_HP', 'C_tot', 'E_tot', 'error'] if column in df_batch]
+        print(df_batch[columns].to_string(index=False))
+
+
+def cmd_search(args):
+    catalog = func.hbess_catalog.scan_cells(args.cells, on_error=print_error)
+    cells = {cell.name: cell for cell in catalog.values()}
+    load_profile = func.hbess_engine.read_load(args.load)
+
+    df_search, pruned = func.hbess_batch.search_pairs(load_profile, cells, args.ems, get_parameters(args),
+                                                      max_workers=args.workers, progress=print_progress if args.verbose else None)
+
+    print(f'{len(cells)} cells, {len(df_search)} pairs evaluated, {pruned} pruned by their lower bound')
+    if args.output:
+        df_search.to_csv(args.output, index=False)
+    columns = [column for column in ['HE', 'HP', 'N_HE', 'N_HP', 'C_tot', 'E_tot', 'LB', 'feasible'] if column in df_search]
+    print(df_search[columns].head(args.top).to_string(index=False))
+
+
+def cmd_stats(args):
+    if func.hbess_profile.is_npy_profile(args.load):
+        stats = func.hbess_profile.scan_load_npy(args.load, args.chunksize)
+    else:
+        stats = func.hbess_profile.scan_load_csv(args.load, args.chunksize)
+    for key, value in stats.items():
+        print(f'{key:>10}: {value}')
+
+
+def cmd_convert(args):
+    stats = func.hbess_profile.convert_load_csv(args.load, args.output, args.dtype, args.chunksize)
+    print('Written {} and {} ({} samples)'.format(*func.hbess_profile.npy_paths(args.output), stats['samples']))
+
+
+def cmd_replay(args):
+    # Streams the load profile through an online controller, batch by batch, in constant memory
+    if args.load in func.hbess_engine.dict_load or func.hbess_profile.is_npy_profile(args.load):
+        samples = func.hbess_online.stream_profile(func.hbess_engine.read_load(args.load), args.batch)
+    else:
+        samples = func.hbess_online.rebatch(func.hbess_profile.read_load_chunks(args.load), args.batch)
+    parameter = func.hbess_online.default_parameters[args.controller] if args.parameter is None else args.parameter
+    parameter = 1000 * parameter if args.controller == 'Rate limit' else parameter #kW/s to W/s
+    batches = func.hbess_online.online_sharing(samples, args.controller, parameter)
+
+    def written(batches, file):
+        file.write('time (s),power (W),P_HE (W),P_HP (W)\n')
+        for batch in batches:
+            np.savetxt(file, np.column_stack(batch), delimiter=',', fmt='%.10g')
+            yield batch
+
+    start = time.perf_counter()
+    if args.output:
+        with open(args.output, 'w') as file:
+            stats = func.hbess_online.replay_statistics(written(batches, file))
+    else:
+        stats = func.hbess_online.replay_statistics(batches)
+    elapsed = time.perf_counter() - start
+
+    for key, value in stats.items():
+        print(f'{key:>10}: {value}')
+    print(f'{"rate":>10}: {stats["samples"] / elapsed if elapsed > 0 else float("inf"):.0f} samples/s')
+
+
+def cmd_serve(args):
+    ready = lambda server: print(f'Sizing service listening on http://{args.host}:{args.port} ({args.workers or "all"} workers)', file=sys.stderr)
+
+    async def serve():
+        # Stop cleanly on SIGTERM too, so that the worker processes are shut down
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            pass #Windows
+        await func.hbess_service.serve(args.host, args.port, args.workers, args.cache, ready)
+
+    try:
+        asyncio.run(serve())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+def cmd_warmup(args):
+    progress = print_progress if args.verbose else None
+    for path in func.hbess_startup.warmup(progress=progress):
+        print(f'Stored {os.path.relpath(path)}')
+
+
+def cmd_imports(args):
+    df_imports = func.hbess_startup.import_times(args.modules or func.hbess_startup.app_modules)
+    total = df_imports.loc[df_imports['depth'] == 0, 'cumulative'].sum() #ms
+    print(df_imports[df_imports['depth'] == 0].drop(columns='depth').to_string(index=False, float_format='%.1f'))
+    print(f'\nSlowest modules (self time):')
+    print(df_imports.nlargest(args.top, 'self').drop(columns='depth').to_string(index=False, float_format='%.1f'))
+    print(f'\nTotal import time: {total:.0f} ms')
+    if args.output:
+        df_imports.to_csv(args.output, index=False)
+    if args.budget is not None and total > args.budget:
+        raise ValueError(f'The import time ({total:.0f} ms) exceeds the budget of {args.budget:.0f} ms')
+
+
+def print_comparison(df_compare, threshold):
+    print('Times in ms, peak memory in MB')
+    print(df_compare.to_string(index=False, float_format='%.3g'))
+    regressions = df_compare[df_compare['regression']]
+    if len(regressions):
+        raise ValueError(f'{len(regressions)} benchmarks are more than {threshold:g} times slower or larger than the baseline: '
+                         + ', '.join(f'{row.stage} ({row.samples})' for row in regressions.itertuples()))
+    print(f'No regressions (threshold {threshold:g})')
+
+
+def cmd_bench(args):
+    progress = print_progress if args.verbose else None
+    results = func.hbess_benchmark.run_benchmarks(args.stages, args.sizes, args.repeat, args.max_seconds, args.shape, progress)
+    if args.output:
+        func.hbess_benchmark.write_results(results, args.output)
+    if args.baseline:
+        print_comparison(func.hbess_benchmark.compare_results(func.hbess_benchmark.read_results(args.baseline), results, args.threshold), args.threshold)
+    else:
+        print('Times in ms, peak memory in MB, throughput in million samples per second')
+        print(func.hbess_benchmark.results_table(results).to_string(index=False, float_format='%.3g'))
+
+
+def cmd_bench_compare(args):
+    baseline, results = (func.hbess_benchmark.read_results(path) for path in (args.baseline, args.results))
+    print_comparison(func.hbess_benchmark.compare_results(baseline, results, args.threshold), args.threshold)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='HBESS Sizing Tool (command line)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_size = subparsers.add_parser('size', help='Size the HE and HP packs for one scenario')
+    add_sizing_arguments(parser_size)
+    parser_size.add_argument('--json', action='store_true', help='Print the result as JSON')
+    parser_size.add_argument('-v', '--verbose', action='store_true', help='Report progress on stderr')
+    parser_size.set_defaults(run=cmd_size)
+
+    parser_schedule = subparsers.add_parser('schedule', help='Repeat the sized duty cycle with charging windows and check the SoC drift')
+    add_sizing_arguments(parser_schedule)
+    parser_schedule.add_argument('--repeat', type=int, default=7, help='Number of duty cycles')
+    parser_schedule.add_argument('--period', type=float, default=None, help='Time between the starts of two duty cycles (h), by default the discharge and a full recharge')
+    parser_schedule.add_argument('--efficiency', type=float, default=1.0, help='Fraction of the charging energy that is stored')
+    parser_schedule.add_argument('-o', '--output', help='Write the SoC at the start of every cycle to this .csv file')
+    parser_schedule.set_defaults(run=cmd_schedule)
+
+    parser_sweep = subparsers.add_parser('sweep', help='Packs, cost and voltages over a grid of target voltages, DoD and initial SoC')
+    add_sizing_arguments(parser_sweep)
+    parser_sweep.add_argument('--vref-range', type=float, nargs=3, default=[600, 1400, 25], metavar=('START', 'STOP', 'STEP'), help='Target voltages (V)')
+    parser_sweep.add_argument('--dod-range', type=float, nargs=3, default=[50, 100, 5], metavar=('START', 'STOP', 'STEP'), help='Depths of Discharge (%%)')
+    parser_sweep.add_argument('--soc0-values', type=float, nargs='+', default=None, help='Initial States of Charge (%%), by default --soc0')
+    parser_sweep.add_argument('--top', type=int, default=10, help='Number of grid points to print')
+    parser_sweep.add_argument('-o', '--output', help='Write the whole grid to this .csv file')
+    parser_sweep.set_defaults(run=cmd_sweep)
+
+    parser_montecarlo = subparsers.add_parser('montecarlo', help='Size the packs for perturbed load profiles and cell costs and capacities')
+    add_sizing_arguments(parser_montecarlo)
+    parser_montecarlo.add_argument('--samples', type=int, default=10000, help='Number of Monte Carlo samples')
+    parser_montecarlo.add_argument('--scale', type=float, default=0.1, help='Relative standard deviation of a power factor per sample')
+    parser_montecarlo.add_argument('--noise', type=float, default=0.05, help='Relative standard deviation of the power noise (of the peak power)')
+    parser_montecarlo.add_argument('--warp', type=float, default=0.1, help='Relative standard deviation of the time-warping')
+    parser_montecarlo.add_argument('--cost', type=float, default=0.1, help='Relative standard deviation of the cell costs')
+    parser_montecarlo.add_argument('--capacity', type=float, default=0.05, help='Relative standard deviation of the cell capacities')
+    parser_montecarlo.add_argument('--seed', type=int, default=None, help='Seed of the random numbers')
+    parser_montecarlo.add_argument('-o', '--output', help='Write every sample to this .csv file')
+    parser_montecarlo.set_defaults(run=cmd_montecarlo)
+
+    parser_batch = subparsers.add_parser('batch', help='Size every load profile x cell pair x EMS combination in parallel')
+    parser_batch.add_argument('--load', nargs='+', default=list(func.hbess_engine.dict_load), help='Load profile names or paths')
+    parser_batch.add_argument('--he', nargs='+', default=list(func.hbess_engine.dict_cell), help='High Energy (HE) cell names or paths')
+    parser_batch.add_argument('--hp', nargs='+', default=list(func.hbess_engine.dict_cell), help='High Power (HP) cell names or paths')
+    parser_batch.add_argument('--ems', nargs='+', default=['Split', 'Power', 'Gradient', 'Cost: Split', 'Cost: Limit'],
+                              choices=func.hbess_engine.methods, help='Energy Management Strategies')
+    add_parameter_arguments(parser_batch)
+    parser_batch.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser_batch.add_argument('-o', '--output', help='Write the comparison table to this .csv file')
+    parser_batch.add_argument('-v', '--verbose', action='store_true', help='Report progress on stderr')
+    parser_batch.set_defaults(run=cmd_batch)
+
+    parser_search = subparsers.add_parser('search', help='Find the cheapest HE/HP pair in a directory of cell files')
+    parser_search.add_argument('--cells', default='battery_cells', help='Directory with cell .csv files')
+    parser_search.add_argument('--load', default='Tug boat 1', help='Bundled load profile name or path to a .csv file')
+    parser_search.add_argument('--ems', default='Cost: Split (exact)', choices=func.hbess_engine.methods, help='Energy Management Strategy')
+    add_parameter_arguments(parser_search)
+    parser_search.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser_search.add_argument('--top', type=int, default=10, help='Number of pairs to print')
+    parser_search.add_argument('-o', '--output', help='Write all evaluated pairs to this .csv file')
+    parser_search.add_argument('-v', '--verbose', action='store_true', help='Report progress on stderr')
+    parser_search.set_defaults(run=cmd_search)
+
+    parser_stats = subparsers.add_parser('stats', help='Energy and peak statistics of a (large) load profile, read in chunks')
+    parser_stats.add_argument('load', help='Load profile .csv file or binary profile (.t.npy)')
+    parser_stats.add_argument('--chunksize', type=int, default=func.hbess_profile.chunk_rows, help='Rows per chunk')
+    parser_stats.set_defaults(run=cmd_stats)
+
+    parser_convert = subparsers.add_parser('convert', help='Convert a load profile .csv file to a memory-mappable binary profile')
+    parser_convert.add_argument('load', help='Load profile .csv file')
+    parser_convert.add_argument('output', help='Name of the binary profile: writes <output>.t.npy and <output>.P.npy')
+    parser_convert.add_argument('--dtype', default='float32', choices=['float32', 'float64'], help='Data type of the power column')
+    parser_convert.add_argument('--chunksize', type=int, default=func.hbess_profile.chunk_rows, help='Rows per chunk')
+    parser_convert.set_defaults(run=cmd_convert)
+
+    parser_replay = subparsers.add_parser('replay', help='Replay a (large) load profile through an online energy management controller')
+    parser_replay.add_argument('load', help='Bundled load profile name, .csv file or binary profile (.t.npy)')
+    parser_replay.add_argument('--controller', default='Low-pass', choices=func.hbess_online.controllers, help='Online controller')
+    parser_replay.add_argument('--parameter', type=float, default=None, help='Time constant (s) of Low-pass (default: 60), HE ramp rate (kW/s) of Rate limit (default: 10)')
+    parser_replay.add_argument('--batch', type=int, default=func.hbess_online.batch_rows, help='Samples per batch')
+    parser_replay.add_argument('-o', '--output', help='Write the HE and HP power to this .csv file')
+    parser_replay.set_defaults(run=cmd_replay)
+
+    parser_serve = subparsers.add_parser('serve', help='Run the sizing job service (localhost HTTP) shared by the app sessions')
+    parser_serve.add_argument('--host', default=func.hbess_service.default_host, help='Address to listen on')
+    parser_serve.add_argument('--port', type=int, default=func.hbess_service.default_port, help='Port to listen on')
+    parser_serve.add_argument('--workers', type=int, default=None, help='Number of worker processes (default: all cores)')
+    parser_serve.add_argument('--cache', type=int, default=64, help='Number of finished jobs kept in the result cache')
+    parser_serve.set_defaults(run=cmd_serve)
+
+    parser_warmup = subparsers.add_parser('warmup', help='Size the default scenario of the app ahead of time (into .cache/)')
+    parser_warmup.add_argument('-v', '--verbose', action='store_true', help='Report progress on stderr')
+    parser_warmup.set_defaults(run=cmd_warmup)
+
+    parser_imports = subparsers.add_parser('imports', help='Report the import time of the modules of the app (cold start)')
+    parser_imports.add_argument('--modules', nargs='+', default=None, help='Modules to import (default: those of hbess-app.py)')
+    parser_imports.add_argument('--top', type=int, default=20, help='Number of slowest modules to show')
+    parser_imports.add_argument('--budget', type=float, default=None, help='Fail if the total import time exceeds this (ms)')
+    parser_imports.add_argument('-o', '--output', default=None, help='Write the import time of every module to this .csv file')
+    parser_imports.set_defaults(run=cmd_imports)
+
+    parser_bench = subparsers.add_parser('bench', help='Time the EMS methods, stages and charts on synthetic load profiles of 10^3 to 10^7 samples')
+    parser_bench.add_argument('--stages', nargs='+', default=None, choices=list(func.hbess_benchmark.stages), metavar='STAGE',
+                              help=f'Stages to time (default: all): {", ".join(func.hbess_benchmark.stages)}')
+    parser_bench.add_argument('--sizes', nargs='+', type=lambda value: int(float(value)), default=func.hbess_benchmark.sizes,
+                              help='Numbers of samples of the synthetic profiles (e.g. 1e3 1e5)')
+    parser_bench.add_argument('--shape', default=None, choices=list(func.hbess_engine.dict_load), help='Bundled load profile to repeat (default: Tug boat 1)')
+    parser_bench.add_argument('--repeat', type=int, default=5, help='Number of timed runs per stage and size (the best is kept)')
+    parser_bench.add_argument('--max-seconds', type=float, default=60.0, help='Skip the larger sizes of a stage once a run takes longer (s)')
+    parser_bench.add_argument('--baseline', default=None, help='Compare with the results of an earlier run (.json)')
+    parser_bench.add_argument('--threshold', type=float, default=1.5, help='Time or memory ratio to the baseline counted as a regression')
+    parser_bench.add_argument('-o', '--output', default=None, help='Write the results to this .json file')
+    parser_bench.add_argument('-v', '--verbose', action='store_true', help='Report progress on stderr')
+    parser_bench.set_defaults(run=cmd_bench)
+
+    parser_bench_compare = subparsers.add_parser('bench-compare', help='Compare two benchmark results (.json) and report regressions')
+    parser_bench_compare.add_argument('baseline', help='Results of the reference run')
+    parser_bench_compare.add_argument('results', help='Results of the new run')
+    parser_bench_compare.add_argument('--threshold', type=float, default=1.5, help='Time or memory ratio counted as a regression')
+    parser_bench_compare.set_defaults(run=cmd_bench_compare)
+
+    args = parser.parse_args(argv)
+    try:
+        args.run(args)
+    except (ValueError, OSError) as error:
+        print_error(error)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
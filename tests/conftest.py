@@ -0,0 +1,15 @@
+import os
+import sys
+import pytest
+
+# The tests import the func package from the repository root, as hbess-app.py and hbess-cli.py do
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from func import hbess_engine
+
+cells = ('NMC Samsung 94Ah', 'LTO Toshiba 23Ah')  #the default HE and HP cells of the app
+
+
+@pytest.fixture(scope='session')
+def cell_pair():
+    return tuple(hbess_engine.read_cell(name) for name in cells)
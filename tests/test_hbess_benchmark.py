@@ -0,0 +1,31 @@
+import warnings
+from func import hbess_benchmark
+
+
+def results(*rows):
+    # Benchmark results of (stage, times (s), peak memory (MB)) rows, on 1000 samples
+    return {'results': [{'stage': stage, 'samples': 1000, 'time': min(times), 'times': times, 'peak_memory': peak} for stage, times, peak in rows]}
+
+
+def test_compare_results_noise():
+    # Within the spread of the baseline runs, below the time floor, or tiny allocations: no regression
+    baseline = results(('spread', [0.020, 0.030, 0.035], 50.0), ('fast', [0.001, 0.001, 0.001], 50.0), ('small', [0.1, 0.1, 0.1], 0.01))
+    df = hbess_benchmark.compare_results(baseline, results(('spread', [0.040, 0.041, 0.045], 50.0), ('fast', [0.004, 0.004, 0.004], 50.0),
+                                                          ('small', [0.1, 0.1, 0.1], 0.1)))
+    assert not df['regression'].any()
+
+
+def test_compare_results_regression():
+    baseline = results(('slower', [0.020, 0.021, 0.022], 50.0), ('larger', [0.1, 0.1, 0.1], 10.0))
+    df = hbess_benchmark.compare_results(baseline, results(('slower', [0.040, 0.041, 0.042], 50.0), ('larger', [0.1, 0.1, 0.1], 20.0)))
+    assert df['regression'].all()
+
+
+def test_time_stage_restores_warnings():
+    def noisy():
+        warnings.warn('deprecated', DeprecationWarning)
+
+    filters = list(warnings.filters)
+    hbess_benchmark.time_stage(noisy, lambda: (), repeat=1, min_total=0)
+    assert warnings.filters == filters
+    assert not any(action == 'ignore' and category is Warning for action, message, category, module, line in warnings.filters)
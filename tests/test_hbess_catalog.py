@@ -0,0 +1,55 @@
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+
+from func import hbess_catalog
+from func import hbess_cell
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+
+def copy_cells(tmp_path):
+    for file_name in os.listdir(os.path.join(ROOT, 'battery_cells')):
+        if file_name.endswith('.csv'):
+            shutil.copy(os.path.join(ROOT, 'battery_cells', file_name), tmp_path)
+
+
+def test_index_round_trip(tmp_path):
+    copy_cells(tmp_path)
+    catalog = hbess_catalog.scan_cells(str(tmp_path))
+    assert os.path.exists(tmp_path / hbess_catalog.index_name)
+
+    cached = hbess_catalog.scan_cells(str(tmp_path))
+    assert sorted(cached) == sorted(catalog)
+    for path, cell in catalog.items():
+        assert hbess_cell.cell_fields(cached[path]) == hbess_cell.cell_fields(cell)
+        assert not cached[path].OCV.flags.writeable
+
+
+def test_index_is_not_code(tmp_path):
+    # A pickle (or anything that is not an index of this version) is ignored and the files are parsed again
+    class Payload:
+        def __reduce__(self):
+            return (open, (str(tmp_path / 'executed'), 'w'))
+    copy_cells(tmp_path)
+    (tmp_path / hbess_catalog.index_name).write_bytes(pickle.dumps(Payload()))
+    assert hbess_catalog.scan_cells(str(tmp_path))
+    assert not os.path.exists(tmp_path / 'executed')
+
+    (tmp_path / hbess_catalog.index_name).write_text(json.dumps({'version': hbess_catalog.index_version, 'cells': {'None.csv': {'stamp': [0, 0]}}}))
+    assert hbess_catalog.scan_cells(str(tmp_path))
+
+
+def test_scan_without_index_update(tmp_path):
+    copy_cells(tmp_path)
+    assert hbess_catalog.scan_cells(str(tmp_path), update_index=False)
+    assert not os.path.exists(tmp_path / hbess_catalog.index_name)
+
+
+def test_engine_import_writes_nothing():
+    before = sorted(os.listdir(os.path.join(ROOT, 'battery_cells')))
+    subprocess.run([sys.executable, '-c', 'import func.hbess_engine'], cwd=ROOT, check=True)
+    assert sorted(os.listdir(os.path.join(ROOT, 'battery_cells'))) == before
@@ -0,0 +1,69 @@
+import time
+import numpy as np
+import pytest
+from func import hbess_benchmark
+from func import hbess_ems
+from func import hbess_engine
+
+
+@pytest.mark.parametrize('load', list(hbess_engine.dict_load))
+@pytest.mark.parametrize('SOC_0, DoD', [(90, 80), (50, 40), (100, 80)])
+@pytest.mark.parametrize('max_steps', [hbess_ems.lp_max_steps, 1]) #HiGHS, and lp_projection
+def test_optimal_soc_within_bounds(load, SOC_0, DoD, max_steps, cell_pair, monkeypatch):
+    # The optimal sharing never charges a pack above 100% SoC or discharges it below SOC_0 - DoD
+    monkeypatch.setattr(hbess_ems, 'lp_max_steps', max_steps)
+    result = hbess_engine.run_sizing(hbess_engine.read_load(load), *cell_pair, 'Optimal', SOC_0, 1000, 365, DoD, 2000.0, 20, None)
+    for column in ('SOC_HE', 'SOC_HP'):
+        SOC = result['df_SOC'][column].to_numpy()
+        if np.isnan(SOC).all():
+            continue #no pack of this type
+        assert np.nanmax(SOC) <= 100 + 1e-6
+        assert np.nanmin(SOC) >= SOC_0 - DoD - 1e-6
+
+
+@pytest.mark.parametrize('load', list(hbess_engine.dict_load))
+@pytest.mark.parametrize('swap', [False, True])
+@pytest.mark.parametrize('max_steps', [hbess_ems.lp_max_steps, 1]) #HiGHS, and lp_projection
+def test_optimal_within_rated_power(load, swap, max_steps, cell_pair, monkeypatch):
+    # The packs are sized for the C-rates of the LP: each delivers its peak power within N x V x I_dis
+    monkeypatch.setattr(hbess_ems, 'lp_max_steps', max_steps)
+    cell_HE, cell_HP = cell_pair[::-1] if swap else cell_pair
+    result = hbess_engine.run_sizing(hbess_engine.read_load(load), cell_HE, cell_HP, 'Optimal', 90, 1000, 365, 80, 2000.0, 20, None)
+    for pack, cell in (('HE', cell_HE), ('HP', cell_HP)):
+        assert result['load_profile'][f'P_{pack}'].max() <= result[f'N_{pack}'] * cell.voltage * cell.I_dis * (1 + 1e-6)
+
+
+@pytest.mark.parametrize('load', list(hbess_engine.dict_load))
+@pytest.mark.parametrize('SOC_0', [90, 50])
+def test_lp_solvers_agree(load, SOC_0, cell_pair):
+    # HiGHS and the projection solve the same LP: the same optimal cost, and a feasible sharing from both
+    problem = hbess_ems.lp_problem(hbess_engine.read_load(load), *cell_pair, 80, SOC_0)
+    costs = []
+    for solver in (hbess_ems.lp_highs, hbess_ems.lp_projection):
+        q, E_HE, E_HP = solver(problem)
+        q_min, q_max, e_min, e_max = hbess_ems.lp_bounds(problem, E_HE, E_HP)
+        e = np.concatenate(([0], np.cumsum(problem['dt'] * q)))
+        scale = max(E_HE, E_HP)
+        assert np.all(q >= q_min - 1e-6 * scale) and np.all(q <= q_max + 1e-6 * scale)
+        assert np.all(e >= e_min - 1e-6 * scale) and np.all(e <= e_max + 1e-6 * scale)
+        costs.append(problem['c_HE'] * E_HE + problem['c_HP'] * E_HP)
+    assert costs[1] == pytest.approx(costs[0], rel=1e-5)
+
+
+def test_optimal_long_profile(cell_pair):
+    # Profiles longer than lp_max_steps go to the projection, which takes 10^5 samples in seconds
+    load_profile = hbess_benchmark.synthetic_profile('Tug boat 1', 10**5)
+    start = time.perf_counter()
+    sharing, _, (E_HE, E_HP) = hbess_ems.optimal_lp(load_profile, *cell_pair, 80, 90)
+    assert time.perf_counter() - start < 30
+    assert E_HE > 0 and np.isfinite(E_HP)
+    np.testing.assert_allclose(sharing['P_HE'] + sharing['P_HP'], sharing['P'], atol=1e-6 * sharing['P'].abs().max())
+
+
+@pytest.mark.parametrize('step, factors', [(1, np.arange(101)), (3, np.arange(0, 100, 3)), (0.5, np.arange(201) / 2), (25.0, [0, 25, 50, 75, 100])])
+def test_cost_split_grid(step, factors, cell_pair):
+    # The split factors are the multiples of step, integers whenever they all are
+    load_profile = hbess_engine.read_load('Tug boat 1')
+    df_cost = hbess_ems.cost_split(load_profile, *cell_pair, 1000, 80, step)[1]
+    np.testing.assert_array_equal(df_cost['factor'].to_numpy(), factors)
+    assert (df_cost['factor'].dtype.kind == 'i') == all(float(factor).is_integer() for factor in factors)
@@ -0,0 +1,73 @@
+import dataclasses
+import numpy as np
+import pytest
+from func import hbess_batch
+from func import hbess_ems
+from func import hbess_engine
+
+
+@pytest.mark.parametrize('load', list(hbess_engine.dict_load))
+@pytest.mark.parametrize('method, factor', [('Split', 30), ('Cost', None), ('Gradient', None), ('Cost: Split', None), ('Cost: Limit', None)])
+def test_compression_within_tolerance(load, method, factor, cell_pair):
+    # The required energy of both packs stays within the tolerance of the uncompressed sizing
+    tolerance = 0.01
+    load_profile = hbess_engine.read_load(load)
+    exact = hbess_engine.run_sizing(load_profile, *cell_pair, method, 90, 1000, 365, 80, 2000.0, 20, factor)
+    compressed = hbess_engine.run_sizing(load_profile, *cell_pair, method, 90, 1000, 365, 80, 2000.0, 20, factor, tolerance=tolerance)
+    assert compressed['tolerance'] == (tolerance if method in hbess_ems.linear_methods else None)
+    for pack in ('HE', 'HP'):
+        assert compressed[f'E_req_{pack}'] == pytest.approx(exact[f'E_req_{pack}'], rel=tolerance, abs=1e-9)
+
+
+@pytest.mark.parametrize('method', ['Cost: Limit', 'Cost: Rolling mean'])
+def test_parallel_profiles_match(method, cell_pair, monkeypatch):
+    # The profile stages calculated by the worker processes give the same sizing, and are cached as if calculated here
+    load_profiles = [hbess_engine.read_load(load) for load in hbess_engine.dict_load]
+    arguments = (load_profiles, *cell_pair, method, 90, 1000, 365, 80, 2000.0, 20, None)
+    serial = hbess_engine.run_sizing_envelope(*arguments, max_workers=1)
+
+    calls = []
+    run_profiles = hbess_batch.run_profiles
+    monkeypatch.setattr(hbess_batch, 'run_profiles', lambda *args: calls.append(args) or run_profiles(*args))
+    monkeypatch.setattr(hbess_engine, 'parallel_samples', 0)
+    cache = {}
+    parallel = hbess_engine.run_sizing_envelope(*arguments, cache=cache, max_workers=2)
+    assert len(calls) == 1
+    for key in ('N_HE', 'N_HP', 'C_tot', 'driver_HE', 'driver_HP'):
+        assert parallel[key] == serial[key]
+    for profile_serial, profile_parallel in zip(serial['profiles'], parallel['profiles']):
+        assert profile_parallel['E_req_HE'] == pytest.approx(profile_serial['E_req_HE'])
+        assert profile_parallel['E_req_HP'] == pytest.approx(profile_serial['E_req_HP'])
+    assert hbess_engine.run_sizing_envelope(*arguments, cache=cache, max_workers=2)['recomputed'] == []
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize('method', ['Power', 'Cost', 'Cost: Split'])
+def test_pair_lower_bounds(method, cell_pair):
+    # The lower bound of every pair is at most the cost of its power-feasible sizing, so search_pairs never prunes it
+    cells = {cell.name: cell for cell in cell_pair}
+    cells.update({f'{cell.name} (cheap)': dataclasses.replace(cell, name=f'{cell.name} (cheap)', cost=cell.cost / 3) for cell in cell_pair})
+    pairs = [(HE, HP) for HE in cells for HP in cells if HE != HP]
+    load_profile = hbess_engine.read_load('Tug boat 1')
+    LB = hbess_batch.pair_lower_bounds(load_profile, cells, pairs, 80, hbess_ems.load_fraction(method))
+    for (HE, HP), bound in zip(pairs, LB):
+        row = dict(HE=HE, HP=HP, **hbess_engine.summarise(hbess_engine.run_sizing(load_profile, cells[HE], cells[HP], method, 90, 1000, 365, 80, 2000.0, 20, None)))
+        if hbess_batch.power_feasible(row, cells):
+            assert bound <= row['C_tot'] + 1e-6
+
+
+@pytest.mark.parametrize('period', [None, 0.0])
+def test_schedule_current(period, cell_pair):
+    # The current of every cycle is the power of the (shared) profile over the pack voltage of that cycle;
+    # without a charging window (period of the discharge only) the packs are not charged
+    result = hbess_engine.run_sizing(hbess_engine.read_load('Tug boat 1'), *cell_pair, 'Split', 90, 1000, 365, 80, 2000.0, 20, 30)
+    t_end = result['discharge']['t'].iloc[-1] / 3600
+    schedule = hbess_engine.run_schedule(result, *cell_pair, 90, 2000.0, 3, None if period is None else t_end)
+    n = len(result['discharge'])
+    for pack in ('HE', 'HP'):
+        I = schedule['df_I'][f'I_{pack}'].to_numpy().reshape(3, n + 2)
+        V = schedule['df_V'][f'V_{pack}'].to_numpy().reshape(3, n + 2)
+        np.testing.assert_allclose(I[:, :n] * V[:, :n], np.broadcast_to(result['discharge'][f'P_{pack}'].to_numpy(), (3, n)), rtol=1e-9, atol=1e-6)
+        assert (I[:, n:] < 0).all() if period is None else (I[:, n:] == 0).all()
+    t = schedule['df_SOC']['t'].to_numpy().reshape(3, n + 2)
+    np.testing.assert_allclose(t[1:, :n] - t[:-1, :n], schedule['period'] / 3600)
@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+from func import hbess_engine
+
+methods = [('Split', 30), ('Cost', None), ('Gradient', None), ('Cost: Limit', None), ('Optimal', None),
+           ('Online: Peak', None), ('Online: Low-pass', 60.0), ('Online: Rate limit', 10.0)]
+
+
+@pytest.mark.parametrize('load', list(hbess_engine.dict_load))
+@pytest.mark.parametrize('method, factor', methods)
+def test_copies_around_nominal_sizing(load, method, factor, cell_pair):
+    # Unperturbed copies need exactly the nominal packs; copies with 1% noise (of the peak power) stay close to them
+    result = hbess_engine.run_sizing(hbess_engine.read_load(load), *cell_pair, method, 90, 1000, 365, 80, 2000.0, 20, factor)
+    options = dict(n_samples=50, scale=0, warp=0, cost=0, capacity=0, seed=0)
+    exact = hbess_engine.run_montecarlo(result, *cell_pair, method, 1000, 80, factor, noise=0, **options)['df_samples']
+    noisy = hbess_engine.run_montecarlo(result, *cell_pair, method, 1000, 80, factor, noise=0.01, **options)['df_samples']
+    peak = result['discharge']['P'].abs().max() / 1000 #kW
+    duration = (result['discharge']['t'].iloc[-1] - result['discharge']['t'].iloc[0]) / 3600 #h
+    for pack in ('HE', 'HP'):
+        np.testing.assert_allclose(exact[f'E_req_{pack}'], result[f'E_req_{pack}'], rtol=1e-9, atol=1e-9)
+        assert np.all(np.abs(noisy[f'E_req_{pack}'] - result[f'E_req_{pack}']) <= 0.05 * peak * duration)
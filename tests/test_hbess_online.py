@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.signal
+from func import hbess_online
+
+
+@pytest.fixture
+def telemetry():
+    # Constant sample rate, as the measurements of a vessel
+    n = 3000
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({'t': 0.5 * np.arange(n), 'P': 1e5 * np.sin(np.arange(n) / 50) + rng.normal(0, 1e4, n)})
+
+
+def replay(load_profile, controller, parameter, batch):
+    batches = hbess_online.online_sharing(hbess_online.stream_profile(load_profile, batch), controller, parameter)
+    return np.concatenate([P_HE for t, P, P_HE, P_HP in batches])
+
+
+@pytest.mark.parametrize('controller, parameter', [('Peak', None), ('Low-pass', 60.0), ('Rate limit', 1e4)])
+def test_batching_does_not_change_result(telemetry, controller, parameter):
+    P_HE = replay(telemetry, controller, parameter, hbess_online.batch_rows)
+    for batch in (1, 7):
+        np.testing.assert_allclose(replay(telemetry, controller, parameter, batch), P_HE, rtol=1e-9, atol=1e-6)
+
+
+def test_lowpass_filters_every_batch(telemetry, monkeypatch):
+    # At a constant sample rate, the first batch is filtered at once too (no time step before the first sample)
+    calls = []
+    lfilter = scipy.signal.lfilter
+    monkeypatch.setattr(scipy.signal, 'lfilter', lambda *args, **kwargs: calls.append(args) or lfilter(*args, **kwargs))
+    replay(telemetry, 'Low-pass', 60.0, 1000)
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize('controller, parameter', [('Peak', None), ('Low-pass', 60.0), ('Low-pass', 0.0), ('Rate limit', 1e4)])
+def test_rows_match_replay(telemetry, controller, parameter):
+    # Every row of online_rows is the controller over that row alone, also with irregular time steps
+    rng = np.random.default_rng(1)
+    t_rows = np.cumsum(rng.uniform(0.1, 1.0, (4, len(telemetry))), axis=1)
+    P_rows = telemetry['P'].to_numpy() * rng.uniform(0.5, 1.5, (4, 1))
+    P_HE = hbess_online.online_rows(t_rows, P_rows, controller, parameter)
+    for t, P, row in zip(t_rows, P_rows, P_HE):
+        np.testing.assert_allclose(row, replay(pd.DataFrame({'t': t, 'P': P}), controller, parameter, 1000), rtol=1e-9, atol=1e-6)